@@ -0,0 +1,141 @@
+from starlette.responses import JSONResponse
+from typing import Optional
+import asyncio
+import os
+
+# Admission control. Every request is put in a priority class by method and
+# path; each class has its own concurrency limit, a bounded wait queue and a
+# queueing deadline. A request that finds the queue full, or is still
+# waiting at the deadline, is answered 503 with Retry-After straight away
+# instead of tying up a worker thread. The default limits add up to the 40
+# threads FastAPI runs sync routes on, so saturated reports can never take
+# the threads bookings need.
+HIGH, NORMAL, LOW = "high", "normal", "low"
+
+
+def _limits(name, limit, queue, timeout):
+    prefix = f"ADMISSION_{name.upper()}_"
+    return {
+        "limit": int(os.getenv(prefix + "LIMIT", limit)),
+        "queue": int(os.getenv(prefix + "QUEUE", queue)),
+        "timeout": float(os.getenv(prefix + "TIMEOUT_SECONDS", timeout))
+    }
+
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") != "0"
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+CLASS_LIMITS = {
+    HIGH: _limits(HIGH, "24", "200", "5"),
+    NORMAL: _limits(NORMAL, "12", "100", "3"),
+    LOW: _limits(LOW, "4", "8", "1"),
+}
+
+# (method or None for any, path prefix, class); first match wins
+ROUTE_CLASSES = [
+    (None, "/events/stream", None), # long-lived stream, not admission controlled
+    (None, "/auth", HIGH),
+    (None, "/appointments", HIGH),
+    ("POST", "/customers", HIGH),
+    ("POST", "/waitlist/offers", HIGH), # accepting an offer books an appointment
+    (None, "/series", HIGH), # series book and cancel appointments
+    (None, "/dashboard/reports", LOW),
+    (None, "/dashboard/analytics", LOW),
+    (None, "/dashboard/staff", LOW),
+    (None, "/jobs", LOW),
+]
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    if method == "OPTIONS":
+        return None
+    for route_method, prefix, priority in ROUTE_CLASSES:
+        if (route_method is None or route_method == method) and path.startswith(prefix):
+            return priority
+    return NORMAL
+
+
+class PriorityClass:
+    def __init__(self, name: str, limit: int, queue: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self) -> bool:
+        if self._semaphore.locked() and self.waiting >= self.queue:
+            self.shed_queue_full += 1
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.shed_timeout += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            "class": self.name,
+            "limit": self.limit,
+            "queue_limit": self.queue,
+            "timeout_seconds": self.timeout,
+            "active": self.active,
+            "queued": self.waiting,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "shed": self.shed_queue_full + self.shed_timeout
+        }
+
+
+_classes = {}
+
+
+def _get_class(name: str) -> PriorityClass:
+    # Created lazily so the semaphores belong to the server's event loop
+    if name not in _classes:
+        _classes[name] = PriorityClass(name, **CLASS_LIMITS[name])
+    return _classes[name]
+
+
+def metrics():
+    return [_get_class(name).stats() for name in CLASS_LIMITS]
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        priority = classify(scope["method"], scope["path"]) if scope["type"] == "http" and ADMISSION_ENABLED else None
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+
+        admission = _get_class(priority)
+        if not await admission.acquire():
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Server is busy, please retry shortly"},
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release()
@@ -0,0 +1,208 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from datetime import date, timedelta
+from typing import Iterable, Optional
+
+from . import models, archive
+
+# Revenue analytics are answered from revenue_rollups: one row per completed
+# appointment day, staff member and service, with the week/month/quarter
+# bucket stored next to the day. Any range/granularity/breakdown is then a
+# single indexed GROUP BY, and bucketing is done here in Python so it works
+# the same on PostgreSQL and SQLite.
+GRANULARITIES = ("day", "week", "month", "quarter")
+BREAKDOWNS = ("service", "category", "staff")
+
+
+def bucket_start(d: date, granularity: str) -> date:
+    if granularity == "day":
+        return d
+    if granularity == "week":
+        return d - timedelta(days=d.weekday())
+    if granularity == "month":
+        return d.replace(day=1)
+    if granularity == "quarter":
+        return date(d.year, 3 * ((d.month - 1) // 3) + 1, 1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def next_bucket(d: date, granularity: str) -> date:
+    if granularity == "day":
+        return d + timedelta(days=1)
+    if granularity == "week":
+        return d + timedelta(days=7)
+    step = 1 if granularity == "month" else 3
+    month = d.month - 1 + step
+    return date(d.year + month // 12, month % 12 + 1, 1)
+
+
+def bucket_range(start: date, end: date, granularity: str):
+    buckets = []
+    current = bucket_start(start, granularity)
+    while current <= end:
+        buckets.append(current)
+        current = next_bucket(current, granularity)
+    return buckets
+
+
+def _rollup_rows(db: Session, days: Optional[Iterable[date]] = None, start: Optional[date] = None, end: Optional[date] = None):
+    # Reads both the hot and the archived tier so rebuilt rollups keep archived history
+    history = archive.appointment_history()
+    query = db.query(
+        history.c.id,
+        history.c.branch_id,
+        history.c.date,
+        history.c.staff_id,
+        history.c.total_amount
+    ).filter(history.c.status == "completed")
+    if days is not None:
+        query = query.filter(history.c.date.in_(list(days)))
+    if start:
+        query = query.filter(history.c.date >= start)
+    if end:
+        query = query.filter(history.c.date <= end)
+    appointments = query.all()
+    if not appointments:
+        return []
+
+    service_lines = archive.appointment_service_history()
+    lines = {}
+    for chunk_start in range(0, len(appointments), 500):
+        ids = [a.id for a in appointments[chunk_start:chunk_start + 500]]
+        for r in db.query(
+            service_lines.c.appointment_id,
+            models.Service.id,
+            models.Service.category,
+            models.Service.price
+        ).join(models.Service, models.Service.id == service_lines.c.service_id).filter(
+            service_lines.c.appointment_id.in_(ids)
+        ).all():
+            lines.setdefault(r.appointment_id, []).append(r)
+
+    # The stored total (which may be a manual override) is split across services by list price
+    rows = {}
+    for a in appointments:
+        total = a.total_amount or 0
+        services = lines.get(a.id) or [None]
+        price_sum = sum((s.price or 0) for s in services if s)
+        for i, s in enumerate(services):
+            if s is None:
+                share = total
+            elif price_sum:
+                share = total * (s.price or 0) / price_sum
+            else:
+                share = total / len(services)
+            key = (a.branch_id, a.date, a.staff_id, s.id if s else None)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {
+                    "branch_id": a.branch_id,
+                    "day": a.date,
+                    "week": bucket_start(a.date, "week"),
+                    "month": bucket_start(a.date, "month"),
+                    "quarter": bucket_start(a.date, "quarter"),
+                    "staff_id": a.staff_id,
+                    "service_id": s.id if s else None,
+                    "category": s.category if s else None,
+                    "revenue": 0,
+                    "bookings": 0
+                }
+            row["revenue"] += share
+            # Counted once per appointment, on its first service line
+            if i == 0:
+                row["bookings"] += 1
+    return list(rows.values())
+
+
+def refresh_days(db: Session, days: Iterable[Optional[date]]):
+    days = {d for d in days if d}
+    if not days:
+        return
+    db.query(models.RevenueRollup).filter(models.RevenueRollup.day.in_(days)).delete(synchronize_session=False)
+    rows = _rollup_rows(db, days=days)
+    if rows:
+        db.execute(models.RevenueRollup.__table__.insert(), rows)
+
+
+def rebuild_range(db: Session, start: date, end: date):
+    db.query(models.RevenueRollup).filter(
+        models.RevenueRollup.day >= start,
+        models.RevenueRollup.day <= end
+    ).delete(synchronize_session=False)
+    rows = _rollup_rows(db, start=start, end=end)
+    if rows:
+        db.execute(models.RevenueRollup.__table__.insert(), rows)
+
+
+def update_service_category(db: Session, service_id: int, category: str):
+    db.query(models.RevenueRollup).filter(models.RevenueRollup.service_id == service_id).update(
+        {"category": category}, synchronize_session=False
+    )
+
+
+def revenue_series(db: Session, start: date, end: date, granularity: str = "day", breakdown: Optional[str] = None):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if breakdown is not None and breakdown not in BREAKDOWNS:
+        raise ValueError(f"breakdown must be one of {', '.join(BREAKDOWNS)}")
+
+    bucket_col = getattr(models.RevenueRollup, granularity)
+    key_col = {
+        None: None,
+        "service": models.RevenueRollup.service_id,
+        "category": models.RevenueRollup.category,
+        "staff": models.RevenueRollup.staff_id,
+    }[breakdown]
+
+    columns = [bucket_col.label("bucket")]
+    if key_col is not None:
+        columns.append(key_col.label("key"))
+    query = db.query(
+        *columns,
+        func.sum(models.RevenueRollup.revenue).label("revenue"),
+        func.sum(models.RevenueRollup.bookings).label("bookings")
+    ).filter(
+        models.RevenueRollup.day >= start,
+        models.RevenueRollup.day <= end
+    ).group_by(*columns)
+
+    buckets = bucket_range(start, end, granularity)
+    values = {}
+    for r in query.all():
+        key = r.key if key_col is not None else None
+        values.setdefault(key, {})[r.bucket] = (r.revenue or 0, r.bookings or 0)
+
+    def points(by_bucket):
+        return [{
+            "bucket": str(b),
+            "revenue": round(by_bucket.get(b, (0, 0))[0], 2),
+            "bookings": by_bucket.get(b, (0, 0))[1]
+        } for b in buckets]
+
+    result = {"start": str(start), "end": str(end), "granularity": granularity, "breakdown": breakdown}
+    if breakdown is None:
+        result["points"] = points(values.get(None, {}))
+        return result
+
+    labels = {}
+    keys = [k for k in values if k is not None]
+    if breakdown == "service" and keys:
+        labels = dict(db.query(models.Service.id, models.Service.name).filter(models.Service.id.in_(keys)).all())
+    elif breakdown == "staff" and keys:
+        labels = dict(db.query(models.User.id, models.User.name).filter(models.User.id.in_(keys)).all())
+    ranked = sorted(values.items(), key=lambda kv: sum(v[0] for v in kv[1].values()), reverse=True)
+    result["series"] = [{
+        "key": key,
+        "label": labels.get(key, key) if key is not None else ("Not Assigned" if breakdown == "staff" else "Other"),
+        "points": points(by_bucket)
+    } for key, by_bucket in ranked]
+    return result
+
+
+def ensure_rollups(db: Session):
+    # Backfills the rollup table in the background the first time analytics are deployed
+    from . import jobs
+    history = archive.appointment_history()
+    if db.query(models.RevenueRollup.id).first() is None and \
+            db.query(history.c.id).filter(history.c.status == "completed").first() is not None:
+        jobs.schedule_once(db, "rebuild_revenue_rollups")
@@ -0,0 +1,77 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, union_all, literal
+from datetime import date
+import os
+
+from . import models
+
+# Closed appointments older than ARCHIVE_AFTER_MONTHS are moved from the hot
+# appointments/appointment_services tables into the *_archive tables so
+# booking, listing and dashboard queries only ever scan recent rows.
+# Customer history and reports read both tiers through the union helpers.
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+CLOSED_STATUSES = ("completed", "cancelled")
+
+
+def cutoff_date(months: int, today: date = None) -> date:
+    today = today or date.today()
+    month = today.month - 1 - months
+    return date(today.year + month // 12, month % 12 + 1, 1)
+
+
+def appointment_history():
+    hot = models.Appointment
+    cold = models.ArchivedAppointment
+    return union_all(
+        select(hot.id, hot.branch_id, hot.customer_id, hot.staff_id, hot.date, hot.time, hot.status,
+               hot.payment_status, hot.total_amount, hot.duration_minutes, literal(False).label("archived")),
+        select(cold.id, cold.branch_id, cold.customer_id, cold.staff_id, cold.date, cold.time, cold.status,
+               cold.payment_status, cold.total_amount, cold.duration_minutes, literal(True).label("archived")),
+    ).subquery("appointment_history")
+
+
+def appointment_service_history():
+    hot = models.appointment_services.c
+    cold = models.appointment_services_archive.c
+    return union_all(
+        select(hot.appointment_id, hot.service_id),
+        select(cold.appointment_id, cold.service_id),
+    ).subquery("appointment_service_history")
+
+
+def archive_chunk(db: Session, cutoff: date, after_id: int, limit: int):
+    # Copies one chunk to the cold tier and deletes it from the hot tables; the caller commits
+    appointments = db.query(models.Appointment).filter(
+        models.Appointment.id > after_id,
+        models.Appointment.date < cutoff,
+        models.Appointment.status.in_(CLOSED_STATUSES)
+    ).order_by(models.Appointment.id).limit(limit).all()
+    if not appointments:
+        return []
+    ids = [a.id for a in appointments]
+
+    db.execute(models.ArchivedAppointment.__table__.insert(), [{
+        "id": a.id,
+        "branch_id": a.branch_id,
+        "customer_id": a.customer_id,
+        "staff_id": a.staff_id,
+        "date": a.date,
+        "time": a.time,
+        "status": a.status,
+        "payment_status": a.payment_status,
+        "total_amount": a.total_amount,
+        "duration_minutes": a.duration_minutes,
+        "ends_at": a.ends_at
+    } for a in appointments])
+    lines = db.query(
+        models.appointment_services.c.appointment_id,
+        models.appointment_services.c.service_id
+    ).filter(models.appointment_services.c.appointment_id.in_(ids)).all()
+    if lines:
+        db.execute(models.appointment_services_archive.insert(), [
+            {"appointment_id": l.appointment_id, "service_id": l.service_id} for l in lines
+        ])
+
+    db.execute(models.appointment_services.delete().where(models.appointment_services.c.appointment_id.in_(ids)))
+    db.query(models.Appointment).filter(models.Appointment.id.in_(ids)).delete(synchronize_session=False)
+    return ids
@@ -0,0 +1,112 @@
+from sqlalchemy import event, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from types import MappingProxyType
+from typing import Iterable, NamedTuple, Optional
+import threading
+
+from . import models
+from .database import RoutingSession
+
+# In-process service catalog. Bookings validate service ids and compute
+# totals and durations from an immutable snapshot instead of querying
+# services. Any flush that touches a Service bumps catalog_state.version in
+# the same transaction, and snapshot() compares that version (one primary
+# key read in the booking's own transaction) before answering, so a process
+# holding an old snapshot reloads it rather than persisting an old price.
+# The read takes a share lock on the state row (PostgreSQL; SQLite write
+# transactions are serialized already), so a service change cannot commit
+# between the check and the booking's commit. The row is seeded at startup.
+CATALOG_STATE_ID = 1
+
+
+class CatalogService(NamedTuple):
+    id: int
+    branch_id: Optional[int]
+    name: str
+    category: str
+    price: float
+    duration: int
+
+
+class PricedServices(NamedTuple):
+    services: tuple
+    total_price: float
+    total_duration: int
+
+
+class Snapshot(NamedTuple):
+    version: int
+    services: MappingProxyType
+
+    def price(self, service_ids: Iterable[int], branch_id: Optional[int] = None) -> Optional[PricedServices]:
+        # None when an id is unknown, repeated or belongs to another branch
+        service_ids = list(service_ids)
+        if len(set(service_ids)) != len(service_ids):
+            return None
+        services = []
+        for service_id in service_ids:
+            service = self.services.get(service_id)
+            if service is None or (branch_id is not None and service.branch_id != branch_id):
+                return None
+            services.append(service)
+        return PricedServices(
+            tuple(services),
+            sum(s.price or 0 for s in services),
+            sum(s.duration or 0 for s in services)
+        )
+
+
+_snapshot: Optional[Snapshot] = None
+_lock = threading.Lock()
+
+
+def _state_version(db: Session, lock: bool = False) -> int:
+    query = db.query(models.CatalogState.version).filter(models.CatalogState.id == CATALOG_STATE_ID)
+    if lock:
+        query = query.with_for_update(read=True)
+    return query.scalar() or 0
+
+
+def _seed(dialect_name: str):
+    # Creates the state row unless it exists; concurrent seeds do not collide
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    return insert(models.CatalogState).values(id=CATALOG_STATE_ID, version=0).on_conflict_do_nothing(index_elements=["id"])
+
+
+def ensure_state(bind):
+    with bind.begin() as conn:
+        conn.execute(_seed(bind.dialect.name))
+
+
+def reload(db: Session) -> Snapshot:
+    global _snapshot
+    version = _state_version(db)
+    rows = db.query(models.Service).execution_options(all_branches=True).all()
+    snapshot = Snapshot(version, MappingProxyType({
+        s.id: CatalogService(s.id, s.branch_id, s.name, s.category, s.price, s.duration) for s in rows
+    }))
+    with _lock:
+        if _snapshot is None or _snapshot.version <= snapshot.version:
+            _snapshot = snapshot
+    return snapshot
+
+
+def snapshot(db: Session) -> Snapshot:
+    # Called by writes that persist prices, so the version read is locked until they commit
+    current = _snapshot
+    if current is None or current.version != _state_version(db, lock=True):
+        current = reload(db)
+    return current
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _bump_on_service_change(session, flush_context, instances):
+    changed = any(isinstance(obj, models.Service) for obj in (*session.new, *session.dirty, *session.deleted))
+    if not changed:
+        return
+    bump = update(models.CatalogState).where(models.CatalogState.id == CATALOG_STATE_ID).values(version=models.CatalogState.version + 1)
+    if not session.execute(bump).rowcount:
+        # The row went missing after startup (e.g. a restored table)
+        session.execute(_seed(session.get_bind(mapper=models.CatalogState.__mapper__).dialect.name))
+        session.execute(bump)
@@ -0,0 +1,62 @@
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from typing import Optional
+
+# Optimistic concurrency for customers and appointments. Every write bumps
+# the row's version. Clients send the version they edited (If-Match header or
+# "version" in the body) and the write is a single
+# UPDATE ... WHERE id = :id AND version = :expected RETURNING *; no matched
+# row means someone else saved first and the client gets 409 with the
+# current version in ETag. Requests without a version keep last-write-wins.
+# ORM flushes (batch status, deletes) are checked through the mappers'
+# version_id_col and surface as the same 409.
+
+
+def expected_version(if_match: Optional[str], body_version: Optional[int] = None) -> Optional[int]:
+    if if_match:
+        value = if_match.strip()
+        if value.startswith("W/"):
+            value = value[2:]
+        value = value.strip('"')
+        if value == "*":
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="If-Match must be a version number")
+    return body_version
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def raise_conflict(db: Session, model, entity_id: int, label: str):
+    current = db.query(model.version).filter(model.id == entity_id).scalar()
+    if current is None:
+        raise HTTPException(status_code=404, detail=f"{label} not found")
+    raise HTTPException(
+        status_code=409,
+        detail=f"{label} was changed by someone else, reload and try again",
+        headers={"ETag": etag(current)}
+    )
+
+
+def conditional_update(db: Session, model, entity_id: int, expected: Optional[int], values: dict, label: str):
+    # One round trip: the version check, the write and the read-back happen in the same statement
+    stmt = update(model).where(model.id == entity_id)
+    if expected is not None:
+        stmt = stmt.where(model.version == expected)
+    stmt = stmt.values(**values, version=model.version + 1).returning(model).execution_options(
+        synchronize_session=False, populate_existing=True
+    )
+    obj = db.execute(stmt).scalar_one_or_none()
+    if obj is None:
+        raise_conflict(db, model, entity_id, label)
+    return obj
+
+
+async def stale_data_handler(request: Request, exc):
+    return JSONResponse(status_code=409, content={"detail": "The record was changed by someone else, reload and try again"})
@@ -0,0 +1,188 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from typing import Iterable, Optional
+import os
+import threading
+import time
+
+from . import models, archive
+
+# Recency/frequency/monetary metrics per customer, kept in customer_metrics.
+# A full batch computes all customers from one grouped query and derives the
+# quintile cut points for scoring; appointment writes then re-score only the
+# customers they touched against those cut points.
+CUSTOMER_METRICS_BATCH_SECONDS = int(os.getenv("CUSTOMER_METRICS_BATCH_SECONDS", "86400"))
+
+_lock = threading.Lock()
+_thresholds = None
+_thresholds_at = None
+
+
+def _quintiles(values):
+    values = sorted(values)
+    if not values:
+        return []
+    return [values[min(len(values) - 1, int(len(values) * q / 5))] for q in range(1, 5)]
+
+
+def _score(value, cuts, reverse=False):
+    # Values tied with cut points land in the middle of the tied range
+    if not cuts:
+        return 3
+    score = (bisect_left(cuts, value) + bisect_right(cuts, value)) // 2 + 1
+    return 6 - score if reverse else score
+
+
+def _segment(r, f, visits):
+    if not visits:
+        return "prospect"
+    if r >= 4 and f >= 4:
+        return "champion"
+    if visits == 1 and r >= 4:
+        return "new"
+    if r <= 2 and f >= 3:
+        return "at_risk"
+    if r <= 2:
+        return "hibernating"
+    if f >= 4:
+        return "loyal"
+    return "potential"
+
+
+def _churn_risk(visits, first_visit, last_visit, today):
+    if not visits:
+        return None
+    days_since = (today - last_visit).days
+    if visits == 1:
+        expected_gap = 45
+    else:
+        expected_gap = max((last_visit - first_visit).days / (visits - 1), 7)
+    ratio = days_since / expected_gap
+    if ratio < 1.5:
+        return "low"
+    if ratio < 3:
+        return "medium"
+    return "high"
+
+
+def _aggregate(db: Session, customer_ids: Optional[Iterable[int]] = None):
+    history = archive.appointment_history()
+    query = db.query(
+        history.c.customer_id,
+        func.count(history.c.id).label("visits"),
+        func.sum(history.c.total_amount).label("spend"),
+        func.min(history.c.date).label("first_visit"),
+        func.max(history.c.date).label("last_visit")
+    ).filter(
+        history.c.status == "completed",
+        history.c.customer_id != None
+    )
+    if customer_ids is not None:
+        query = query.filter(history.c.customer_id.in_(list(customer_ids)))
+    return {r.customer_id: r for r in query.group_by(history.c.customer_id).all()}
+
+
+def _compute_thresholds(aggregates, today):
+    return {
+        "recency": _quintiles([(today - r.last_visit).days for r in aggregates]),
+        "frequency": _quintiles([r.visits for r in aggregates]),
+        "monetary": _quintiles([r.spend or 0 for r in aggregates]),
+    }
+
+
+def _load_thresholds(db: Session, today):
+    global _thresholds, _thresholds_at
+    with _lock:
+        if _thresholds is not None:
+            return _thresholds
+        rows = db.query(
+            models.CustomerMetrics.visits,
+            models.CustomerMetrics.lifetime_spend.label("spend"),
+            models.CustomerMetrics.last_visit
+        ).filter(models.CustomerMetrics.visits > 0).all()
+        thresholds = _compute_thresholds(rows, today)
+        if rows:
+            _thresholds, _thresholds_at = thresholds, time.monotonic()
+        return thresholds
+
+
+def _batch_due():
+    with _lock:
+        return _thresholds_at is None or time.monotonic() - _thresholds_at > CUSTOMER_METRICS_BATCH_SECONDS
+
+
+def _rows(customer_ids, aggregates, thresholds, today):
+    rows = []
+    now = datetime.now()
+    for customer_id in customer_ids:
+        a = aggregates.get(customer_id)
+        visits = a.visits if a else 0
+        spend = (a.spend or 0) if a else 0
+        if a:
+            r = _score((today - a.last_visit).days, thresholds["recency"], reverse=True)
+            f = _score(visits, thresholds["frequency"])
+            m = _score(spend, thresholds["monetary"])
+        else:
+            r = f = m = None
+        rows.append({
+            "customer_id": customer_id,
+            "visits": visits,
+            "lifetime_spend": spend,
+            "first_visit": a.first_visit if a else None,
+            "last_visit": a.last_visit if a else None,
+            "recency_score": r,
+            "frequency_score": f,
+            "monetary_score": m,
+            "segment": _segment(r, f, visits),
+            "churn_risk": _churn_risk(visits, a.first_visit, a.last_visit, today) if a else None,
+            "updated_at": now
+        })
+    return rows
+
+
+def _write(db: Session, rows):
+    # One upsert, so two writers scoring the same customer do not race between a delete and an insert
+    if not rows:
+        return
+    dialect = db.get_bind(mapper=models.CustomerMetrics.__mapper__).dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    stmt = insert(models.CustomerMetrics.__table__)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["customer_id"],
+        set_={c: stmt.excluded[c] for c in rows[0] if c != "customer_id"}
+    ), rows)
+
+
+def refresh_customers(db: Session, customer_ids: Iterable[Optional[int]]):
+    # Incremental path used by appointment writes; the caller commits
+    customer_ids = {c for c in customer_ids if c}
+    if not customer_ids:
+        return
+    today = date.today()
+    existing = {c for (c,) in db.query(models.Customer.id).filter(models.Customer.id.in_(customer_ids)).all()}
+    _write(db, _rows(sorted(existing), _aggregate(db, existing), _load_thresholds(db, today), today))
+
+
+def schedule_batch_if_due(db: Session):
+    # Recency and churn risk drift with time, so the full batch is rerun periodically
+    from . import jobs
+    if _batch_due():
+        jobs.schedule_once(db, "refresh_customer_metrics")
+
+
+def prepare_full_refresh(db: Session):
+    # Resets the scoring cut points from the whole customer base
+    global _thresholds, _thresholds_at
+    today = date.today()
+    aggregates = _aggregate(db)
+    thresholds = _compute_thresholds(list(aggregates.values()), today)
+    with _lock:
+        _thresholds, _thresholds_at = thresholds, time.monotonic()
+    return aggregates, thresholds, today
+
+
+def refresh_chunk(db: Session, customer_ids, aggregates, thresholds, today):
+    _write(db, _rows(customer_ids, aggregates, thresholds, today))
@@ -0,0 +1,287 @@
+from sqlalchemy import bindparam, event, or_, update
+from sqlalchemy.orm import Session
+from datetime import date
+from difflib import SequenceMatcher
+from itertools import combinations
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import os
+import re
+
+from . import models, events, customer_metrics
+from .database import Base, RoutingSession, add_missing_columns
+
+# Customer de-duplication. Every customer carries normalized matching keys
+# (phone digits, canonical email), kept current by a flush listener and by
+# the update route. find_pairs() never compares all customers with each
+# other: customers are grouped into blocks that share a key (same branch
+# and phone, email, or name and date of birth), only pairs inside a block
+# are scored, and oversized blocks (shared placeholder numbers, very common
+# names) are skipped. Pairs at or above DEDUP_THRESHOLD are recorded in
+# customer_duplicates for review; merge() re-points a duplicate's history to
+# the customer that is kept with bulk UPDATEs and deletes the duplicate.
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.65"))
+DEDUP_AUTO_MERGE_SCORE = float(os.getenv("DEDUP_AUTO_MERGE_SCORE", "0.95"))
+DEDUP_PHONE_DIGITS = int(os.getenv("DEDUP_PHONE_DIGITS", "10"))
+DEDUP_MAX_BLOCK = int(os.getenv("DEDUP_MAX_BLOCK", "50"))
+DEDUP_CHUNK_SIZE = int(os.getenv("DEDUP_CHUNK_SIZE", "5000"))
+
+# Gmail ignores dots in the local part
+DOTLESS_EMAIL_DOMAINS = {"gmail.com": "gmail.com", "googlemail.com": "gmail.com"}
+# Rows whose customer_id moves to the kept customer on merge
+CUSTOMER_REFERENCES = (models.Appointment, models.ArchivedAppointment, models.WaitlistEntry, models.WaitlistOffer, models.AppointmentSeries)
+
+
+class MatchKey(NamedTuple):
+    id: int
+    branch_id: Optional[int]
+    name: str
+    phone: Optional[str]
+    email: Optional[str]
+    dob: Optional[date]
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    digits = re.sub(r"\D", "", phone or "")
+    # Too short or one repeated digit: a placeholder, not a number
+    if len(digits) < 7 or len(set(digits)) == 1:
+        return None
+    return digits[-DEDUP_PHONE_DIGITS:]
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    email = (email or "").strip().lower()
+    local, _, domain = email.rpartition("@")
+    if not local or not domain:
+        return None
+    local = local.split("+", 1)[0]
+    if domain in DOTLESS_EMAIL_DOMAINS:
+        local, domain = local.replace(".", ""), DOTLESS_EMAIL_DOMAINS[domain]
+    return f"{local}@{domain}"
+
+
+def normalize_name(name: Optional[str]) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", (name or "").lower()).split())
+
+
+def keys_for(phone: Optional[str], email: Optional[str]) -> dict:
+    return {"phone_normalized": normalize_phone(phone), "email_normalized": normalize_email(email)}
+
+
+def match_key(c) -> MatchKey:
+    return MatchKey(c.id, c.branch_id, normalize_name(c.name), c.phone_normalized, c.email_normalized, c.dob)
+
+
+def name_similarity(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    # Token order varies ("Shah Anita" vs "Anita Shah")
+    sorted_a, sorted_b = " ".join(sorted(a.split())), " ".join(sorted(b.split()))
+    return max(SequenceMatcher(None, a, b).ratio(), SequenceMatcher(None, sorted_a, sorted_b).ratio())
+
+
+def score(a: MatchKey, b: MatchKey) -> Tuple[float, str]:
+    value, reasons = 0.0, []
+    if a.phone and a.phone == b.phone:
+        value += 0.4
+        reasons.append("phone")
+    if a.email and a.email == b.email:
+        value += 0.4
+        reasons.append("email")
+    similarity = name_similarity(a.name, b.name)
+    value += 0.3 * similarity
+    if similarity >= 0.85:
+        reasons.append("name")
+    if a.dob and b.dob:
+        if a.dob == b.dob:
+            value += 0.1
+            reasons.append("dob")
+        else:
+            value -= 0.3
+    return round(min(max(value, 0.0), 1.0), 3), ",".join(reasons)
+
+
+def blocking_keys(k: MatchKey):
+    if k.phone:
+        yield ("phone", k.branch_id, k.phone)
+    if k.email:
+        yield ("email", k.branch_id, k.email)
+    if k.name and k.dob:
+        yield ("name_dob", k.branch_id, " ".join(sorted(k.name.split())), k.dob)
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _stamp_keys(session, flush_context, instances):
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, models.Customer):
+            for column, value in keys_for(obj.phone, obj.email).items():
+                if getattr(obj, column) != value:
+                    setattr(obj, column, value)
+
+
+def ensure_schema(bind):
+    # Existing databases get the key columns and indexes; the dedup_customers job fills them in
+    added = add_missing_columns(bind, {"customers": {"phone_normalized": "VARCHAR(20)", "email_normalized": "VARCHAR(100)"}})
+    with bind.begin() as conn:
+        for index in Base.metadata.tables["customers"].indexes:
+            if index.name in ("ix_customers_branch_phone_norm", "ix_customers_branch_email_norm"):
+                index.create(conn, checkfirst=True)
+    return added
+
+
+def normalize_chunk(db: Session, after_id: int, limit: int = DEDUP_CHUNK_SIZE):
+    # Recomputes the keys for one id range; only rows whose keys changed are written
+    rows = db.query(
+        models.Customer.id, models.Customer.phone, models.Customer.email,
+        models.Customer.phone_normalized, models.Customer.email_normalized
+    ).filter(models.Customer.id > after_id).order_by(models.Customer.id).limit(limit).all()
+    changes = []
+    for r in rows:
+        keys = keys_for(r.phone, r.email)
+        if (keys["phone_normalized"], keys["email_normalized"]) != (r.phone_normalized, r.email_normalized):
+            changes.append({"_id": r.id, **keys})
+    if changes:
+        table = models.Customer.__table__
+        db.execute(
+            table.update().where(table.c.id == bindparam("_id")).values(
+                phone_normalized=bindparam("phone_normalized"), email_normalized=bindparam("email_normalized")
+            ),
+            changes
+        )
+    return [r.id for r in rows], len(changes)
+
+
+def find_pairs(db: Session, threshold: float = DEDUP_THRESHOLD) -> List[Tuple[int, int, Optional[int], float, str]]:
+    customers: Dict[int, MatchKey] = {}
+    blocks: Dict[tuple, List[int]] = {}
+    query = db.query(
+        models.Customer.id, models.Customer.branch_id, models.Customer.name,
+        models.Customer.phone_normalized, models.Customer.email_normalized, models.Customer.dob
+    ).execution_options(yield_per=DEDUP_CHUNK_SIZE)
+    for row in query:
+        key = match_key(row)
+        customers[key.id] = key
+        for block in blocking_keys(key):
+            blocks.setdefault(block, []).append(key.id)
+
+    seen, pairs = set(), []
+    for ids in blocks.values():
+        if len(ids) < 2 or len(ids) > DEDUP_MAX_BLOCK:
+            continue
+        for a, b in combinations(sorted(ids), 2):
+            if (a, b) in seen:
+                continue
+            seen.add((a, b))
+            value, reasons = score(customers[a], customers[b])
+            if value >= threshold:
+                pairs.append((a, b, customers[a].branch_id, value, reasons))
+    return pairs
+
+
+def record_pairs(db: Session, pairs: Iterable[Tuple[int, int, Optional[int], float, str]]) -> int:
+    # New pairs only; a pair that was merged or dismissed is not reopened
+    pairs = list(pairs)
+    if not pairs:
+        return 0
+    first_ids = sorted({p[0] for p in pairs})
+    existing = set()
+    for i in range(0, len(first_ids), DEDUP_CHUNK_SIZE):
+        existing.update(db.query(models.CustomerDuplicate.customer_id, models.CustomerDuplicate.duplicate_id).filter(
+            models.CustomerDuplicate.customer_id.in_(first_ids[i:i + DEDUP_CHUNK_SIZE])
+        ).execution_options(all_branches=True).all())
+    rows = [{
+        "branch_id": branch_id, "customer_id": a, "duplicate_id": b, "score": value, "reasons": reasons, "status": "open"
+    } for a, b, branch_id, value, reasons in pairs if (a, b) not in existing]
+    if rows:
+        db.execute(models.CustomerDuplicate.__table__.insert(), rows)
+    return len(rows)
+
+
+def possible_duplicates(db: Session, customer: models.Customer, limit: int = 5):
+    # Inline check for one customer, answered from the branch key indexes
+    conditions = [models.Customer.name == customer.name]
+    if customer.phone_normalized:
+        conditions.append(models.Customer.phone_normalized == customer.phone_normalized)
+    if customer.email_normalized:
+        conditions.append(models.Customer.email_normalized == customer.email_normalized)
+    candidates = db.query(models.Customer).filter(
+        models.Customer.branch_id == customer.branch_id,
+        models.Customer.id != customer.id,
+        or_(*conditions)
+    ).limit(DEDUP_MAX_BLOCK).all()
+    key = match_key(customer)
+    scored = [(c, *score(key, match_key(c))) for c in candidates]
+    scored = [s for s in scored if s[1] >= DEDUP_THRESHOLD]
+    return sorted(scored, key=lambda s: -s[1])[:limit]
+
+
+def merge(db: Session, keep: models.Customer, duplicates: List[models.Customer]) -> int:
+    # The caller checks that all customers exist and share a branch, and commits
+    duplicate_ids = [d.id for d in duplicates if d.id != keep.id]
+    if not duplicate_ids:
+        return 0
+    for model in CUSTOMER_REFERENCES:
+        values = {"customer_id": keep.id}
+        if model is models.Appointment:
+            # Open editors must reload the appointment
+            values["version"] = models.Appointment.version + 1
+        db.execute(
+            update(model).where(model.customer_id.in_(duplicate_ids)).values(**values).execution_options(synchronize_session=False)
+        )
+
+    # Details only the duplicates have are kept
+    fill = {}
+    for field in ("email", "dob", "phone"):
+        if not getattr(keep, field):
+            fill[field] = next((getattr(d, field) for d in duplicates if getattr(d, field)), None)
+    notes = [n for n in [keep.notes, *(d.notes for d in duplicates)] if n]
+    if len(notes) > 1:
+        fill["notes"] = "\n".join(dict.fromkeys(notes))
+
+    db.query(models.CustomerMetrics).filter(models.CustomerMetrics.customer_id.in_(duplicate_ids)).delete(synchronize_session=False)
+    db.query(models.Customer).filter(models.Customer.id.in_(duplicate_ids)).delete(synchronize_session=False)
+    for d in duplicates:
+        db.expunge(d)
+    for field, value in fill.items():
+        if value is not None:
+            setattr(keep, field, value)
+    db.query(models.CustomerDuplicate).filter(
+        or_(models.CustomerDuplicate.customer_id.in_(duplicate_ids), models.CustomerDuplicate.duplicate_id.in_(duplicate_ids))
+    ).update({"status": "merged"}, synchronize_session=False)
+    db.flush()
+    customer_metrics.refresh_customers(db, [keep.id])
+    events.record(db, "customer", "merged", keep.id, {**events.customer_payload(keep), "merged_ids": duplicate_ids})
+    for duplicate_id in duplicate_ids:
+        events.record(db, "customer", "deleted", duplicate_id, {"id": duplicate_id, "branch_id": keep.branch_id, "merged_into": keep.id})
+    return len(duplicate_ids)
+
+
+def auto_merge(db: Session, pairs, min_score: float = DEDUP_AUTO_MERGE_SCORE) -> int:
+    # Clusters of near-certain pairs merge into their oldest customer
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            parent[x] = parent.get(parent[x], parent[x])
+            x = parent[x]
+        return x
+
+    for a, b, _, value, _ in pairs:
+        if value >= min_score:
+            ra, rb = find(a), find(b)
+            if ra != rb:
+                parent[max(ra, rb)] = min(ra, rb)
+    clusters = {}
+    for x in parent:
+        clusters.setdefault(find(x), set()).add(x)
+
+    merged = 0
+    for keep_id, members in clusters.items():
+        customers = db.query(models.Customer).filter(models.Customer.id.in_(members | {keep_id})).all()
+        keep = next((c for c in customers if c.id == keep_id), None)
+        if keep is None:
+            continue
+        merged += merge(db, keep, [c for c in customers if c.id != keep_id])
+        db.commit()
+    return merged
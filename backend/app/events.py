@@ -0,0 +1,297 @@
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from datetime import date, datetime, timedelta
+from typing import Optional, Set
+import asyncio
+import json
+import os
+import time as clock
+
+from starlette.concurrency import run_in_threadpool
+
+from . import models
+from .database import SessionLocal
+
+# Change feed: write paths add an OutboxEvent in the same transaction as the
+# change (record), and one broadcaster task per process tails the outbox and
+# fans each event out to in-memory subscriber queues. The event is encoded
+# once and shared by every subscriber, so the database sees one poll per
+# interval regardless of how many screens are connected. Ids are handed out
+# when a transaction inserts its event, not when it commits, so a lower id
+# can become visible after a higher one: ids skipped over are re-polled for
+# EVENT_GAP_SECONDS and sent late if their transaction commits by then.
+EVENT_POLL_SECONDS = float(os.getenv("EVENT_POLL_SECONDS", "1.0"))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000"))
+EVENT_RETENTION_HOURS = int(os.getenv("EVENT_RETENTION_HOURS", "24"))
+EVENT_GAP_SECONDS = float(os.getenv("EVENT_GAP_SECONDS", "30"))
+EVENT_BATCH_SIZE = 500
+KEEPALIVE_SECONDS = 15
+
+_subscribers: Set["Subscriber"] = set()
+_wakeup: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_task: Optional[asyncio.Task] = None
+_last_id = 0
+_gaps = {} # skipped id -> when it was first missed
+
+
+def appointment_payload(a: models.Appointment):
+    return {
+        "id": a.id,
+        "branch_id": a.branch_id,
+        "customer_id": a.customer_id,
+        "staff_id": a.staff_id,
+        "date": str(a.date) if a.date else None,
+        "time": str(a.time) if a.time else None,
+        "status": a.status,
+        "payment_status": a.payment_status,
+        "total_amount": a.total_amount,
+        "version": a.version
+    }
+
+
+def customer_payload(c: models.Customer):
+    return {"id": c.id, "branch_id": c.branch_id, "name": c.name, "phone": c.phone, "email": c.email, "version": c.version}
+
+
+def service_payload(s: models.Service):
+    return {"id": s.id, "branch_id": s.branch_id, "name": s.name, "category": s.category, "price": s.price, "duration": s.duration}
+
+
+def series_payload(s: models.AppointmentSeries):
+    return {
+        "id": s.id,
+        "branch_id": s.branch_id,
+        "customer_id": s.customer_id,
+        "staff_id": s.staff_id,
+        "frequency": s.frequency,
+        "interval": s.interval,
+        "start_date": str(s.start_date) if s.start_date else None,
+        "time": str(s.time) if s.time else None,
+        "count": s.count,
+        "until": str(s.until) if s.until else None,
+        "status": s.status,
+        "parent_id": s.parent_id
+    }
+
+
+def waitlist_offer_payload(o: models.WaitlistOffer):
+    return {
+        "id": o.id,
+        "branch_id": o.branch_id,
+        "entry_id": o.entry_id,
+        "customer_id": o.customer_id,
+        "source_appointment_id": o.source_appointment_id,
+        "staff_id": o.staff_id,
+        "date": str(o.date) if o.date else None,
+        "time": str(o.time) if o.time else None,
+        "status": o.status
+    }
+
+
+def record(db: Session, topic: str, action: str, entity_id: int, payload: dict = None, event_date: date = None):
+    # Call before db.commit() so the event commits (or rolls back) with the change itself
+    db.add(models.OutboxEvent(
+        branch_id=(payload or {}).get("branch_id", db.info.get("branch_id")),
+        topic=topic,
+        action=action,
+        entity_id=entity_id,
+        event_date=event_date,
+        payload=payload or {"id": entity_id}
+    ))
+
+
+def notify():
+    # Called by writers after commit to wake the broadcaster instead of waiting for the next poll
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+class Subscriber:
+    def __init__(self, topics: Optional[Set[str]] = None, event_date: Optional[date] = None, branch_id: Optional[int] = None):
+        self.topics = topics
+        self.branch_id = branch_id
+        self.event_date = str(event_date) if event_date else None
+        self.queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event):
+        if self.topics and event["topic"] not in self.topics:
+            return False
+        if self.branch_id is not None and event["branch_id"] not in (None, self.branch_id):
+            return False
+        if self.event_date and event["event_date"]:
+            # Rescheduled appointments are also sent to the day they moved away from
+            previous = (event["payload"] or {}).get("previous_date")
+            if self.event_date not in (event["event_date"], previous):
+                return False
+        return True
+
+    def offer(self, event, message):
+        if self.overflowed or not self.wants(event):
+            return
+        try:
+            self.queue.put_nowait((event["id"], message))
+        except asyncio.QueueFull:
+            # A client that cannot keep up is told to reload instead of slowing everyone down
+            self.overflowed = True
+
+
+def _encode(event):
+    data = json.dumps({k: event[k] for k in ("id", "branch_id", "topic", "action", "entity_id", "event_date", "payload")}, default=str)
+    return f"id: {event['id']}\nevent: {event['topic']}\ndata: {data}\n\n"
+
+
+def _as_dict(e: models.OutboxEvent):
+    return {
+        "id": e.id,
+        "branch_id": e.branch_id,
+        "topic": e.topic,
+        "action": e.action,
+        "entity_id": e.entity_id,
+        "event_date": str(e.event_date) if e.event_date else None,
+        "payload": e.payload
+    }
+
+
+def _fetch_after(after_id: int, limit: int = EVENT_BATCH_SIZE, also_ids=()):
+    db = SessionLocal()
+    try:
+        query = db.query(models.OutboxEvent)
+        if also_ids:
+            query = query.filter(or_(models.OutboxEvent.id > after_id, models.OutboxEvent.id.in_(list(also_ids))))
+        else:
+            query = query.filter(models.OutboxEvent.id > after_id)
+        rows = query.order_by(models.OutboxEvent.id).limit(limit).all()
+        return [_as_dict(e) for e in rows]
+    finally:
+        db.close()
+
+
+def _max_id():
+    db = SessionLocal()
+    try:
+        return db.query(models.OutboxEvent.id).order_by(models.OutboxEvent.id.desc()).limit(1).scalar() or 0
+    finally:
+        db.close()
+
+
+def _purge():
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now() - timedelta(hours=EVENT_RETENTION_HOURS)
+        db.query(models.OutboxEvent).filter(models.OutboxEvent.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _advance(event_id: int):
+    # Moves the cursor past an event and returns whether it is new: beyond
+    # the cursor, or a late commit filling a gap
+    global _last_id
+    if event_id in _gaps:
+        del _gaps[event_id]
+        return True
+    if event_id <= _last_id:
+        return False
+    now = clock.monotonic()
+    # Past a batch worth of skipped ids they are sequence gaps, not open transactions
+    for missing in range(max(_last_id + 1, event_id - EVENT_BATCH_SIZE), event_id):
+        _gaps[missing] = now
+    _last_id = event_id
+    return True
+
+
+async def _broadcast():
+    global _last_id
+    _last_id = await run_in_threadpool(_max_id)
+    polls = 0
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=EVENT_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            while True:
+                events = await run_in_threadpool(_fetch_after, _last_id, EVENT_BATCH_SIZE, list(_gaps)) if _subscribers else []
+                for event in events:
+                    if not _advance(event["id"]):
+                        continue
+                    message = _encode(event)
+                    for subscriber in list(_subscribers):
+                        subscriber.offer(event, message)
+                if len(events) < EVENT_BATCH_SIZE:
+                    break
+            expired = clock.monotonic() - EVENT_GAP_SECONDS
+            for missing in [i for i, seen in _gaps.items() if seen < expired]:
+                # Rolled back, or never used
+                del _gaps[missing]
+            if not _subscribers:
+                _gaps.clear()
+                _last_id = await run_in_threadpool(_max_id)
+            polls += 1
+            if polls % 3600 == 0:
+                await run_in_threadpool(_purge)
+        except Exception:
+            # Keep the feed alive across transient database errors
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+
+
+def start():
+    global _wakeup, _loop, _task
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_broadcast())
+
+
+async def stop():
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+
+
+async def stream(subscriber: Subscriber, last_event_id: Optional[int] = None):
+    _subscribers.add(subscriber)
+    # From here on the broadcaster offers only ids past its cursor or in its
+    # gaps; replayed events among those are remembered so they are not sent twice
+    cursor, gaps = _last_id, set(_gaps)
+    replayed = set()
+    try:
+        if last_event_id is not None:
+            # Replay everything the client missed while reconnecting, then continue live
+            after = last_event_id
+            while True:
+                events = await run_in_threadpool(_fetch_after, after)
+                for event in events:
+                    if subscriber.wants(event):
+                        yield _encode(event)
+                    if event["id"] > cursor or event["id"] in gaps:
+                        replayed.add(event["id"])
+                if len(events) < EVENT_BATCH_SIZE:
+                    break
+                after = events[-1]["id"]
+        yield ": connected\n\n"
+        while True:
+            if subscriber.overflowed:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            try:
+                event_id, message = await asyncio.wait_for(subscriber.queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if event_id in replayed:
+                replayed.discard(event_id)
+                continue
+            yield message
+    finally:
+        _subscribers.discard(subscriber)
+
+
+def subscriber_count():
+    return len(_subscribers)
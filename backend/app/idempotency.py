@@ -0,0 +1,81 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import threading
+
+from . import models
+
+# Idempotency-Key support for create endpoints. The key row is inserted in
+# the same transaction as the entity it describes, so when two retries race
+# the loser's insert fails on the (user_id, key) unique constraint, its whole
+# transaction rolls back, and it answers with the winner's stored response.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+PURGE_EVERY = 100
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def fingerprint(payload: BaseModel) -> str:
+    body = json.dumps(payload.model_dump(mode="json"), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _replay(row: models.IdempotencyKey, scope: str, fp: str):
+    if row.scope != scope or row.fingerprint != fp:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return JSONResponse(content=row.response, status_code=row.status_code, headers={"Idempotent-Replayed": "true"})
+
+
+def lookup(db: Session, user_id: int, key: str, scope: str, fp: str):
+    # Returns the stored response for a completed request, or None to run the request
+    row = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.key == key
+    ).first()
+    if row is None:
+        return None
+    if row.expires_at <= datetime.now(row.expires_at.tzinfo):
+        db.delete(row)
+        db.flush()
+        return None
+    return _replay(row, scope, fp)
+
+
+def remember(db: Session, user_id: int, key: str, scope: str, fp: str, response: BaseModel, status_code: int = 200):
+    # Call after flush and before commit, with the response the request is about to return
+    global _writes
+    db.add(models.IdempotencyKey(
+        user_id=user_id,
+        key=key,
+        scope=scope,
+        fingerprint=fp,
+        status_code=status_code,
+        response=response.model_dump(mode="json"),
+        expires_at=datetime.now() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    ))
+    with _writes_lock:
+        _writes += 1
+        purge = _writes % PURGE_EVERY == 0
+    if purge:
+        purge_expired(db)
+
+
+def replay_after_conflict(db: Session, user_id: int, key: str, scope: str, fp: str, error: Exception):
+    # Call after rolling back an IntegrityError; re-raises when the conflict was not the key itself
+    row = db.query(models.IdempotencyKey).filter(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.key == key
+    ).first()
+    if row is None:
+        raise error
+    return _replay(row, scope, fp)
+
+
+def purge_expired(db: Session):
+    db.query(models.IdempotencyKey).filter(models.IdempotencyKey.expires_at < datetime.now()).delete(synchronize_session=False)
@@ -0,0 +1,361 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+import os
+import threading
+
+from . import models, reports, analytics, customer_metrics, archive, dedup, schedule, staff_reports, recurrence, events
+from .database import SessionLocal
+
+# Heavy maintenance/reporting work runs here instead of inside request threads.
+# Handlers work in chunks and store a cursor with every chunk commit, so a
+# retried or restarted job resumes where it stopped and never redoes a chunk.
+# A worker claims a job with a conditional queued -> running UPDATE, so with
+# several processes each job runs once; at startup only running jobs whose
+# heartbeat is older than JOB_STALE_SECONDS are taken back.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "500"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "600"))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job-worker")
+_handlers = {}
+_schedule_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_handler(kind: str):
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def is_known_kind(kind: str) -> bool:
+    return kind in _handlers
+
+
+class JobContext:
+    def __init__(self, db: Session, job: models.Job):
+        self.db = db
+        self.job = job
+        self.params = job.params or {}
+
+    @property
+    def cursor(self):
+        return self.job.cursor or 0
+
+    def set_total(self, total: int):
+        self.job.total = total
+        self.job.heartbeat_at = datetime.now()
+        self.db.commit()
+
+    def checkpoint(self, cursor: int, processed: int, **counters):
+        # Chunk work and the cursor are committed together so a chunk is applied exactly once
+        self.job.cursor = cursor
+        self.job.progress = (self.job.progress or 0) + processed
+        result = dict(self.job.result or {})
+        for key, value in counters.items():
+            result[key] = result.get(key, 0) + value
+        self.job.result = result
+        self.job.heartbeat_at = datetime.now()
+        self.db.commit()
+        cancelled = self.db.query(models.Job.cancel_requested).filter(models.Job.id == self.job.id).scalar()
+        if cancelled:
+            raise JobCancelled()
+
+
+def create_job(db: Session, kind: str, params: dict = None, created_by: int = None) -> models.Job:
+    job = models.Job(kind=kind, params=params or {}, result={}, status="queued", created_by=created_by)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def enqueue(job_id: int):
+    _executor.submit(run_job, job_id)
+
+
+def schedule_once(db: Session, kind: str, params: dict = None):
+    # Enqueues a job of this kind unless one is already queued or running
+    with _schedule_lock:
+        active = db.query(models.Job.id).filter(
+            models.Job.kind == kind,
+            models.Job.status.in_(["queued", "running"])
+        ).first()
+        if active:
+            return None
+        job = create_job(db, kind, params)
+    enqueue(job.id)
+    return job
+
+
+def run_job(job_id: int):
+    db = SessionLocal()
+    try:
+        # Only the worker whose UPDATE moves the job out of "queued" runs it
+        now = datetime.now()
+        claimed = db.query(models.Job).filter(models.Job.id == job_id, models.Job.status == "queued").update({
+            "status": "running",
+            "attempts": func.coalesce(models.Job.attempts, 0) + 1,
+            "started_at": now,
+            "claimed_at": now,
+            "heartbeat_at": now,
+            "error": None
+        }, synchronize_session=False)
+        db.commit()
+        if claimed != 1:
+            return
+        job = db.query(models.Job).filter(models.Job.id == job_id).first()
+        if job.cancel_requested:
+            job.status = "cancelled"
+            job.finished_at = datetime.now()
+            db.commit()
+            return
+
+        try:
+            _handlers[job.kind](JobContext(db, job))
+            job.status = "completed"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            db.rollback()
+            job.status = "failed"
+            job.error = repr(e)
+        job.finished_at = datetime.now()
+        db.commit()
+    finally:
+        db.close()
+
+
+def resume_pending_jobs():
+    # Queued jobs, and running jobs whose worker stopped sending heartbeats, are picked up again from their cursor
+    db = SessionLocal()
+    try:
+        last_seen = func.coalesce(models.Job.heartbeat_at, models.Job.claimed_at, models.Job.started_at)
+        db.query(models.Job).filter(
+            models.Job.status == "running",
+            or_(last_seen == None, last_seen < datetime.now() - timedelta(seconds=JOB_STALE_SECONDS))
+        ).update({"status": "queued"}, synchronize_session=False)
+        db.commit()
+        job_ids = [j.id for j in db.query(models.Job.id).filter(models.Job.status == "queued").all()]
+    finally:
+        db.close()
+    for job_id in job_ids:
+        enqueue(job_id)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+@job_handler("audit_revenue")
+def audit_revenue(ctx: JobContext):
+    # Recompute stored totals of completed appointments from their services
+    base = ctx.db.query(models.Appointment.id).filter(models.Appointment.status == "completed")
+    if ctx.job.total is None:
+        ctx.set_total(base.count())
+
+    while True:
+        ids = [r.id for r in base.filter(models.Appointment.id > ctx.cursor).order_by(models.Appointment.id).limit(JOB_CHUNK_SIZE).all()]
+        if not ids:
+            break
+        sums = dict(ctx.db.query(
+            models.appointment_services.c.appointment_id,
+            func.sum(models.Service.price)
+        ).join(models.Service, models.Service.id == models.appointment_services.c.service_id).filter(
+            models.appointment_services.c.appointment_id.in_(ids)
+        ).group_by(models.appointment_services.c.appointment_id).all())
+
+        corrected = 0
+        corrected_days, corrected_customers = set(), set()
+        for appointment in ctx.db.query(models.Appointment).filter(models.Appointment.id.in_(ids)).all():
+            service_sum = sums.get(appointment.id, 0) or 0
+            if appointment.total_amount != service_sum:
+                appointment.total_amount = service_sum
+                corrected += 1
+                corrected_days.add(appointment.date)
+                corrected_customers.add(appointment.customer_id)
+        ctx.db.flush()
+        analytics.refresh_days(ctx.db, corrected_days)
+        customer_metrics.refresh_customers(ctx.db, corrected_customers)
+        reports.mark_changed(ctx.db, corrected_days)
+        ctx.checkpoint(ids[-1], len(ids), checked=len(ids), corrected=corrected)
+        if corrected:
+            reports.note_write(ctx.db)
+
+
+@job_handler("relink_orphans")
+def relink_orphans(ctx: JobContext):
+    # Attach appointments without a customer to params["customer_id"] (default: first customer)
+    customer_id = ctx.params.get("customer_id")
+    if customer_id is None:
+        first_cust = ctx.db.query(models.Customer).order_by(models.Customer.id).first()
+        if not first_cust:
+            raise ValueError("No customers found in database to link appointments to")
+        customer_id = first_cust.id
+    elif not ctx.db.query(models.Customer).filter(models.Customer.id == customer_id).first():
+        raise ValueError("Customer not found")
+
+    base = ctx.db.query(models.Appointment.id).filter(models.Appointment.customer_id == None)
+    if ctx.job.total is None:
+        ctx.set_total(base.count())
+
+    while True:
+        ids = [r.id for r in base.order_by(models.Appointment.id).limit(JOB_CHUNK_SIZE).all()]
+        if not ids:
+            break
+        ctx.db.query(models.Appointment).filter(
+            models.Appointment.id.in_(ids),
+            models.Appointment.customer_id == None
+        ).update({"customer_id": customer_id, "version": models.Appointment.version + 1}, synchronize_session=False)
+        customer_metrics.refresh_customers(ctx.db, [customer_id])
+        ctx.checkpoint(ids[-1], len(ids), relinked=len(ids))
+        reports.note_write(ctx.db)
+
+
+@job_handler("refresh_reports")
+def refresh_reports(ctx: JobContext):
+    ctx.set_total(1)
+    snapshot = reports.refresh_snapshot(ctx.db)
+    ctx.job.result = {"version": snapshot.version}
+    ctx.checkpoint(0, 1)
+
+
+@job_handler("rebuild_revenue_rollups")
+def rebuild_revenue_rollups(ctx: JobContext):
+    # Rebuilds revenue_rollups one month at a time; the cursor is the ordinal of the last month done.
+    # The bounds cover archived appointments too.
+    history = archive.appointment_history()
+    bounds = ctx.db.query(func.min(history.c.date), func.max(history.c.date)).filter(
+        history.c.status == "completed"
+    ).first()
+    if not bounds or bounds[0] is None:
+        return
+    first, last = analytics.bucket_start(bounds[0], "month"), bounds[1]
+    months = analytics.bucket_range(first, last, "month")
+    if ctx.job.total is None:
+        ctx.set_total(len(months))
+
+    for month_start in months:
+        if month_start.toordinal() <= ctx.cursor:
+            continue
+        month_end = date.fromordinal(analytics.next_bucket(month_start, "month").toordinal() - 1)
+        analytics.rebuild_range(ctx.db, month_start, month_end)
+        ctx.checkpoint(month_start.toordinal(), 1)
+
+
+@job_handler("refresh_customer_metrics")
+def refresh_customer_metrics(ctx: JobContext):
+    # Full RFM batch: thresholds from one grouped query, rows written in customer id chunks
+    aggregates, thresholds, today = customer_metrics.prepare_full_refresh(ctx.db)
+    base = ctx.db.query(models.Customer.id)
+    if ctx.job.total is None:
+        ctx.set_total(base.count())
+
+    while True:
+        ids = [r.id for r in base.filter(models.Customer.id > ctx.cursor).order_by(models.Customer.id).limit(JOB_CHUNK_SIZE).all()]
+        if not ids:
+            break
+        customer_metrics.refresh_chunk(ctx.db, ids, aggregates, thresholds, today)
+        ctx.checkpoint(ids[-1], len(ids))
+
+
+@job_handler("archive_appointments")
+def archive_appointments(ctx: JobContext):
+    # Moves closed appointments older than params["months"] (default ARCHIVE_AFTER_MONTHS) to the cold tier.
+    # Rollups, metrics and snapshots already read both tiers, so nothing derived changes.
+    cutoff = archive.cutoff_date(int(ctx.params.get("months", archive.ARCHIVE_AFTER_MONTHS)))
+    if ctx.job.total is None:
+        ctx.set_total(ctx.db.query(models.Appointment.id).filter(
+            models.Appointment.date < cutoff,
+            models.Appointment.status.in_(archive.CLOSED_STATUSES)
+        ).count())
+
+    while True:
+        ids = archive.archive_chunk(ctx.db, cutoff, ctx.cursor, JOB_CHUNK_SIZE)
+        if not ids:
+            break
+        ctx.checkpoint(ids[-1], len(ids), archived=len(ids))
+        reports.note_write(ctx.db)
+
+
+@job_handler("dedup_customers")
+def dedup_customers(ctx: JobContext):
+    # Refreshes the matching keys in id chunks, then finds and records candidate pairs.
+    # params: threshold (default DEDUP_THRESHOLD), merge=true also merges pairs scoring
+    # at least merge_score (default DEDUP_AUTO_MERGE_SCORE)
+    if ctx.job.total is None:
+        ctx.set_total(ctx.db.query(models.Customer.id).count())
+    while True:
+        ids, changed = dedup.normalize_chunk(ctx.db, ctx.cursor)
+        if not ids:
+            break
+        ctx.checkpoint(ids[-1], len(ids), normalized=changed)
+
+    pairs = dedup.find_pairs(ctx.db, float(ctx.params.get("threshold", dedup.DEDUP_THRESHOLD)))
+    recorded = dedup.record_pairs(ctx.db, pairs)
+    ctx.db.commit()
+    merged = 0
+    if ctx.params.get("merge"):
+        merged = dedup.auto_merge(ctx.db, pairs, float(ctx.params.get("merge_score", dedup.DEDUP_AUTO_MERGE_SCORE)))
+        if merged:
+            reports.note_write(ctx.db)
+    ctx.checkpoint(ctx.cursor, 0, candidate_pairs=len(pairs), recorded=recorded, merged=merged)
+
+
+@job_handler("backfill_appointment_durations")
+def backfill_appointment_durations(ctx: JobContext):
+    # Fills duration_minutes/ends_at on appointments booked before the columns existed.
+    # The hot tier is walked by cursor; archived rows are picked up by their empty
+    # duration, so a restarted job skips whatever is already done.
+    if ctx.job.total is None:
+        ctx.set_total(sum(
+            ctx.db.query(model.id).filter(model.duration_minutes == None).count()
+            for model in (models.Appointment, models.ArchivedAppointment)
+        ))
+    while True:
+        ids = schedule.backfill_chunk(ctx.db, models.Appointment, ctx.cursor, JOB_CHUNK_SIZE)
+        if not ids:
+            break
+        ctx.checkpoint(ids[-1], len(ids), appointments=len(ids))
+    while True:
+        ids = schedule.backfill_chunk(ctx.db, models.ArchivedAppointment, 0, JOB_CHUNK_SIZE)
+        if not ids:
+            break
+        ctx.checkpoint(ctx.cursor, len(ids), archived=len(ids))
+    staff_reports.invalidate()
+
+
+@job_handler("expand_series")
+def expand_series(ctx: JobContext):
+    # Books the occurrences of active series up to the rolling horizon, one chunk of series per commit.
+    # Occurrences clashing with an existing booking are skipped and counted.
+    through = date.today() + timedelta(days=recurrence.SERIES_HORIZON_DAYS)
+    due = ctx.db.query(models.AppointmentSeries).filter(
+        models.AppointmentSeries.status == "active",
+        or_(models.AppointmentSeries.expanded_until == None, models.AppointmentSeries.expanded_until < through)
+    )
+    if ctx.job.total is None:
+        ctx.set_total(due.count())
+    while True:
+        chunk = due.filter(models.AppointmentSeries.id > ctx.cursor).order_by(models.AppointmentSeries.id).limit(JOB_CHUNK_SIZE).all()
+        if not chunk:
+            break
+        booked, conflicts, dates = 0, 0, set()
+        for series in chunk:
+            expansion = recurrence.expand(ctx.db, series, through)
+            booked += len(expansion.appointments)
+            conflicts += len(expansion.conflicts)
+            dates.update(a.date for a in expansion.appointments)
+        analytics.refresh_days(ctx.db, dates)
+        reports.mark_changed(ctx.db, dates)
+        ctx.checkpoint(chunk[-1].id, len(chunk), booked=booked, conflicts=conflicts)
+        if dates:
+            reports.note_write(ctx.db)
+            staff_reports.invalidate(dates)
+    events.notify()
@@ -1,13 +1,52 @@
 from fastapi import FastAPI
-from .routes import auth, customers, services, appointments, dashboard, users
-from .database import engine, Base
+from contextlib import asynccontextmanager
+from .routes import auth, customers, services, appointments, dashboard, users, jobs as jobs_routes, events as events_routes, branches, waitlist as waitlist_routes, series as series_routes
+from .database import engine, Base, SessionLocal, add_missing_columns
+from . import jobs, analytics, customer_metrics, events, tenancy, admission, concurrency, reminders, dedup, schedule, recurrence, reports, catalog
+from sqlalchemy.orm.exc import StaleDataError
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
 # Create tables (for development only)
 Base.metadata.create_all(bind=engine)
+tenancy.ensure_schema(engine)
+add_missing_columns(engine, {
+    "customers": {"version": "INTEGER NOT NULL DEFAULT 1"},
+    "appointments": {"version": "INTEGER NOT NULL DEFAULT 1"},
+    "jobs": {"claimed_at": "TIMESTAMP", "heartbeat_at": "TIMESTAMP"},
+})
+customer_keys_added = dedup.ensure_schema(engine)
+appointment_ends_added = schedule.ensure_schema(engine)
+recurrence.ensure_schema(engine)
+reports.ensure_schema(engine)
+catalog.ensure_state(engine)
 
-app = FastAPI(title="Salon Customer Management System API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    jobs.resume_pending_jobs()
+    db = SessionLocal()
+    try:
+        analytics.ensure_rollups(db)
+        customer_metrics.schedule_batch_if_due(db)
+        if customer_keys_added:
+            # Existing customers get their matching keys and a first duplicate scan
+            jobs.schedule_once(db, "dedup_customers")
+        if appointment_ends_added:
+            # Appointments booked before duration_minutes/ends_at existed get them filled in
+            jobs.schedule_once(db, "backfill_appointment_durations")
+        recurrence.schedule_expansion_if_due(db)
+        reports.schedule_if_pending(db)
+    finally:
+        db.close()
+    events.start()
+    reminders.start()
+    yield
+    reminders.stop()
+    await events.stop()
+    jobs.shutdown()
+
+app = FastAPI(title="Salon Customer Management System API", lifespan=lifespan)
+app.add_exception_handler(StaleDataError, concurrency.stale_data_handler)
 
 # Get frontend URL from environment variable
 FRONTEND_URL = os.getenv("FRONTEND_URL")
@@ -22,6 +61,9 @@ origins = [
 if FRONTEND_URL:
     origins.append(FRONTEND_URL)
 
+# Added before CORS so shed (503) responses still carry CORS headers
+app.add_middleware(admission.AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -36,6 +78,11 @@ app.include_router(services.router)
 app.include_router(appointments.router)
 app.include_router(dashboard.router)
 app.include_router(users.router)
+app.include_router(jobs_routes.router)
+app.include_router(events_routes.router)
+app.include_router(branches.router)
+app.include_router(waitlist_routes.router)
+app.include_router(series_routes.router)
 
 @app.get("/")
 async def root():
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Date, Time, ForeignKey, Float, Table
+from sqlalchemy import Column, Integer, String, Text, DateTime, Date, Time, ForeignKey, Float, Table, Boolean, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -21,10 +21,25 @@ staff_services = Table(
     Column("service_id", Integer, ForeignKey("services.id")),
 )
 
+class Branch(Base):
+    __tablename__ = "branches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100))
+    address = Column(Text, nullable=True)
+    phone = Column(String(20), nullable=True)
+    status = Column(String(50), default="active") # active, inactive
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Branch-owned tables carry branch_id; app/tenancy.py scopes queries to the request's branch
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_branch_role", "branch_id", "role"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=True) # NULL for chain-wide admins
     name = Column(String(100))
     email = Column(String(100), unique=True, index=True)
     phone = Column(String(20), nullable=True)
@@ -36,30 +51,66 @@ class User(Base):
 
 class Customer(Base):
     __tablename__ = "customers"
+    __table_args__ = (
+        Index("ix_customers_branch_name", "branch_id", "name"),
+        Index("ix_customers_branch_phone", "branch_id", "phone"),
+        Index("ix_customers_branch_phone_norm", "branch_id", "phone_normalized"),
+        Index("ix_customers_branch_email_norm", "branch_id", "email_normalized"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=True)
     name = Column(String(100))
     phone = Column(String(20))
     email = Column(String(100), unique=True, index=True)
     dob = Column(Date, nullable=True)
     notes = Column(Text, nullable=True)
+    phone_normalized = Column(String(20), nullable=True) # matching keys, see app/dedup.py
+    email_normalized = Column(String(100), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    version = Column(Integer, nullable=False, server_default="1") # optimistic concurrency, see app/concurrency.py
 
     appointments = relationship("Appointment", back_populates="customer")
+    metrics = relationship("CustomerMetrics", uselist=False, cascade="all, delete-orphan")
+
+    __mapper_args__ = {"version_id_col": version}
 
 class Service(Base):
     __tablename__ = "services"
+    __table_args__ = (
+        Index("ix_services_branch_category", "branch_id", "category"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=True)
     name = Column(String(100))
     category = Column(String(50))
     price = Column(Float)
     duration = Column(Integer) # in minutes
 
+class CatalogState(Base):
+    # Single row bumped in every transaction that changes services; see app/catalog.py
+    __tablename__ = "catalog_state"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)
+
 class Appointment(Base):
     __tablename__ = "appointments"
+    __table_args__ = (
+        Index("ix_appointments_date_status", "date", "status"),
+        Index("ix_appointments_customer_date", "customer_id", "date"),
+        Index("ix_appointments_branch_date_status", "branch_id", "date", "status"),
+        Index("ix_appointments_branch_staff_date", "branch_id", "staff_id", "date"),
+        Index("ix_appointments_staff_date_ends", "staff_id", "date", "ends_at"),
+        # Expanding a series twice never books an occurrence twice
+        Index("ux_appointments_series_occurrence", "series_id", "occurrence", unique=True),
+        # SQLite would otherwise hand out max(id) + 1 again, reusing ids already in the archive
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
     staff_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     date = Column(Date)
@@ -67,7 +118,278 @@ class Appointment(Base):
     status = Column(String(50)) # pending, completed, cancelled
     payment_status = Column(String(50), default="unpaid") # unpaid, paid
     total_amount = Column(Float)
+    duration_minutes = Column(Integer, nullable=True) # summed over the services, see app/schedule.py
+    ends_at = Column(DateTime, nullable=True) # date + time + duration_minutes
+    series_id = Column(Integer, ForeignKey("appointment_series.id"), nullable=True) # set for occurrences of a recurring series
+    occurrence = Column(Integer, nullable=True) # 0-based position in the series
+    version = Column(Integer, nullable=False, server_default="1") # optimistic concurrency, see app/concurrency.py
 
     customer = relationship("Customer", back_populates="appointments")
     staff = relationship("User")
     services = relationship("Service", secondary=appointment_services)
+
+    __mapper_args__ = {"version_id_col": version}
+
+series_services = Table(
+    "series_services",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("series_id", Integer, ForeignKey("appointment_series.id")),
+    Column("service_id", Integer, ForeignKey("services.id")),
+)
+
+class AppointmentSeries(Base):
+    # A recurring booking, expanded into appointments by app/recurrence.py
+    __tablename__ = "appointment_series"
+    __table_args__ = (
+        Index("ix_series_status_expanded", "status", "expanded_until"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    staff_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    frequency = Column(String(20)) # daily, weekly, monthly
+    interval = Column(Integer, default=1) # every n days/weeks/months
+    start_date = Column(Date)
+    time = Column(Time)
+    count = Column(Integer, nullable=True) # number of occurrences, or
+    until = Column(Date, nullable=True) # last possible date; neither means open-ended
+    total_amount = Column(Float, default=0) # per occurrence, 0 prices from the services
+    duration_minutes = Column(Integer, default=0)
+    status = Column(String(20), default="active") # active, ended, cancelled
+    expanded_until = Column(Date, nullable=True) # occurrences up to this date exist as appointments
+    parent_id = Column(Integer, nullable=True) # series this one was split from by a "this and following" edit
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    customer = relationship("Customer")
+    staff = relationship("User")
+    services = relationship("Service", secondary=series_services)
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), index=True)
+    status = Column(String(20), default="queued", index=True) # queued, running, completed, failed, cancelled
+    params = Column(JSON, default=dict)
+    result = Column(JSON, default=dict)
+    error = Column(Text, nullable=True)
+    cursor = Column(Integer, default=0) # last processed id, jobs resume from here on retry
+    progress = Column(Integer, default=0)
+    total = Column(Integer, nullable=True)
+    attempts = Column(Integer, default=0)
+    cancel_requested = Column(Boolean, default=False)
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    claimed_at = Column(DateTime(timezone=True), nullable=True) # set by the worker that won the queued -> running claim
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True) # refreshed at every checkpoint while running
+
+class ReportSnapshot(Base):
+    __tablename__ = "report_snapshots"
+    __table_args__ = (
+        # Two refreshes racing cannot both publish the same version
+        Index("ux_report_snapshots_version", "version", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    version = Column(Integer, index=True)
+    payload = Column(JSON)
+    generated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ReportChange(Base):
+    # A day whose revenue changed after the latest report snapshot; cleared by the refresh that covers it
+    __tablename__ = "report_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)
+
+class RevenueRollup(Base):
+    # Daily revenue per (staff, service), pre-bucketed by week/month/quarter start
+    __tablename__ = "revenue_rollups"
+    __table_args__ = (
+        Index("ix_revenue_rollups_day_staff", "day", "staff_id"),
+        Index("ix_revenue_rollups_week_staff", "week", "staff_id"),
+        Index("ix_revenue_rollups_month_staff", "month", "staff_id"),
+        Index("ix_revenue_rollups_quarter_staff", "quarter", "staff_id"),
+        Index("ix_revenue_rollups_branch_day", "branch_id", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, nullable=True)
+    day = Column(Date)
+    week = Column(Date)
+    month = Column(Date)
+    quarter = Column(Date)
+    staff_id = Column(Integer, nullable=True)
+    service_id = Column(Integer, nullable=True)
+    category = Column(String(50), nullable=True)
+    revenue = Column(Float, default=0)
+    bookings = Column(Integer, default=0)
+
+class CustomerMetrics(Base):
+    # RFM values per customer, maintained by app/customer_metrics.py
+    __tablename__ = "customer_metrics"
+
+    customer_id = Column(Integer, ForeignKey("customers.id"), primary_key=True)
+    visits = Column(Integer, default=0, index=True)
+    lifetime_spend = Column(Float, default=0, index=True)
+    first_visit = Column(Date, nullable=True)
+    last_visit = Column(Date, nullable=True, index=True)
+    recency_score = Column(Integer, nullable=True)
+    frequency_score = Column(Integer, nullable=True)
+    monetary_score = Column(Integer, nullable=True)
+    segment = Column(String(30), index=True) # champion, loyal, new, potential, at_risk, hibernating, prospect
+    churn_risk = Column(String(20), nullable=True, index=True) # low, medium, high
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# Cold tier for closed appointments moved out of the hot tables by app/archive.py.
+# Same shape as appointments/appointment_services, without foreign keys.
+class ArchivedAppointment(Base):
+    __tablename__ = "appointments_archive"
+    __table_args__ = (
+        Index("ix_appointments_archive_customer_date", "customer_id", "date"),
+        Index("ix_appointments_archive_branch_date", "branch_id", "date"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    branch_id = Column(Integer, nullable=True)
+    customer_id = Column(Integer)
+    staff_id = Column(Integer, nullable=True)
+    date = Column(Date, index=True)
+    time = Column(Time)
+    status = Column(String(50))
+    payment_status = Column(String(50))
+    total_amount = Column(Float)
+    duration_minutes = Column(Integer, nullable=True)
+    ends_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+appointment_services_archive = Table(
+    "appointment_services_archive",
+    Base.metadata,
+    Column("appointment_id", Integer, index=True),
+    Column("service_id", Integer),
+)
+
+class OutboxEvent(Base):
+    # Change events written in the same transaction as the change; fanned out by app/events.py
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, nullable=True)
+    topic = Column(String(30)) # appointment, customer, service
+    action = Column(String(30)) # created, updated, deleted
+    entity_id = Column(Integer)
+    event_date = Column(Date, nullable=True) # appointment date, used for per-day filtering
+    payload = Column(JSON)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class Reminder(Base):
+    # Scheduled customer notifications, dispatched by app/reminders.py
+    __tablename__ = "reminders"
+    __table_args__ = (
+        Index("ix_reminders_status_due", "status", "due_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    appointment_id = Column(Integer, index=True)
+    branch_id = Column(Integer, nullable=True)
+    kind = Column(String(20)) # reminder, follow_up
+    due_at = Column(DateTime) # local time, like appointment date/time
+    status = Column(String(20), default="scheduled") # scheduled, sending, sent, cancelled, failed
+    attempts = Column(Integer, default=0)
+    sent_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Services a waitlist entry asks for
+waitlist_services = Table(
+    "waitlist_services",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("entry_id", Integer, ForeignKey("waitlist_entries.id")),
+    Column("service_id", Integer, ForeignKey("services.id")),
+)
+
+class CustomerDuplicate(Base):
+    # Candidate duplicate pairs found by app/dedup.py; customer_id < duplicate_id
+    __tablename__ = "customer_duplicates"
+    __table_args__ = (
+        UniqueConstraint("customer_id", "duplicate_id", name="uq_customer_duplicates_pair"),
+        Index("ix_customer_duplicates_branch_status", "branch_id", "status"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, nullable=True)
+    customer_id = Column(Integer)
+    duplicate_id = Column(Integer, index=True)
+    score = Column(Float)
+    reasons = Column(String(100)) # phone, email, name, dob
+    status = Column(String(20), default="open") # open, merged, dismissed
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class WaitlistEntry(Base):
+    # A customer waiting for a slot; matched by app/waitlist.py when one frees up
+    __tablename__ = "waitlist_entries"
+    __table_args__ = (
+        Index("ix_waitlist_branch_status_dates", "branch_id", "status", "date_from", "date_to"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), index=True)
+    staff_id = Column(Integer, ForeignKey("users.id"), nullable=True) # None means any staff
+    date_from = Column(Date)
+    date_to = Column(Date)
+    time_from = Column(Time)
+    time_to = Column(Time) # latest time the visit may end
+    duration = Column(Integer, default=0) # minutes, summed over the services
+    status = Column(String(20), default="waiting") # waiting, booked, cancelled
+    notes = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    customer = relationship("Customer")
+    services = relationship("Service", secondary=waitlist_services)
+
+class WaitlistOffer(Base):
+    # A freed slot offered to a waitlist entry; the first accepted offer for a slot books it
+    __tablename__ = "waitlist_offers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    branch_id = Column(Integer, ForeignKey("branches.id"), nullable=True)
+    entry_id = Column(Integer, ForeignKey("waitlist_entries.id"), index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"))
+    source_appointment_id = Column(Integer, index=True) # the cancelled or moved appointment
+    staff_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    date = Column(Date)
+    time = Column(Time)
+    duration = Column(Integer, default=0) # minutes the freed slot had, 0 if unknown
+    status = Column(String(20), default="pending", index=True) # pending, accepted, declined, taken, withdrawn, expired
+    appointment_id = Column(Integer, nullable=True) # booked on accept
+    expires_at = Column(DateTime)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class IdempotencyKey(Base):
+    # Stored responses for retried POSTs carrying an Idempotency-Key header
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer)
+    key = Column(String(255))
+    scope = Column(String(100)) # method and path
+    fingerprint = Column(String(64))
+    status_code = Column(Integer, default=200)
+    response = Column(JSON)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), index=True)
+
+# Session listeners (branch scoping, catalog versioning, reminder pushes,
+# customer matching keys) must be active for every SessionLocal user, scripts
+# included
+from . import tenancy, catalog, reminders, dedup  # noqa: E402,F401
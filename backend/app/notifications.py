@@ -0,0 +1,93 @@
+from abc import ABC, abstractmethod
+from email.message import EmailMessage
+from typing import List, Optional
+import json
+import os
+import smtplib
+import threading
+
+# Delivery backends for reminders. A sender takes message dicts (to_email,
+# to_phone, subject, body, ...) and returns one error string or None per
+# message. NOTIFICATION_SENDER picks the backend: "file" (default) appends
+# JSON lines to NOTIFICATION_FILE as a local stand-in, "smtp" sends email.
+NOTIFICATION_SENDER = os.getenv("NOTIFICATION_SENDER", "file")
+NOTIFICATION_FILE = os.getenv("NOTIFICATION_FILE", "notifications_outbox.log")
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
+SMTP_FROM = os.getenv("SMTP_FROM", "salon@localhost")
+
+
+class Sender(ABC):
+    @abstractmethod
+    def send(self, message: dict):
+        ...
+
+    def send_many(self, messages: List[dict]) -> List[Optional[str]]:
+        errors = []
+        for message in messages:
+            try:
+                self.send(message)
+                errors.append(None)
+            except Exception as e:
+                errors.append(repr(e))
+        return errors
+
+
+class FileSender(Sender):
+    def __init__(self, path: str = NOTIFICATION_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send_many(self, messages):
+        lines = "".join(json.dumps(m, default=str) + "\n" for m in messages)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        return [None] * len(messages)
+
+    def send(self, message):
+        self.send_many([message])
+
+
+class SmtpSender(Sender):
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_USER:
+            server.login(SMTP_USER, SMTP_PASSWORD or "")
+        return server
+
+    def _email(self, message):
+        if not message.get("to_email"):
+            raise ValueError("Customer has no email address")
+        email = EmailMessage()
+        email["From"] = SMTP_FROM
+        email["To"] = message["to_email"]
+        email["Subject"] = message["subject"]
+        email.set_content(message["body"])
+        return email
+
+    def send(self, message):
+        with self._connect() as server:
+            server.send_message(self._email(message))
+
+    def send_many(self, messages):
+        # One connection per dispatch batch
+        errors = []
+        with self._connect() as server:
+            for message in messages:
+                try:
+                    server.send_message(self._email(message))
+                    errors.append(None)
+                except Exception as e:
+                    errors.append(repr(e))
+        return errors
+
+
+def get_sender() -> Sender:
+    if NOTIFICATION_SENDER == "smtp":
+        return SmtpSender()
+    return FileSender()
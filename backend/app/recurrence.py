@@ -0,0 +1,268 @@
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional
+import calendar
+import os
+import threading
+import time as clock
+
+from . import models, events, reminders, schedule
+from .database import Base, add_missing_columns
+
+# Recurring appointments. A series stores its rule once (daily, weekly or
+# monthly, every `interval`, limited by count or until) and expand() turns
+# the occurrences up to SERIES_HORIZON_DAYS ahead into ordinary appointments:
+# one busy-interval query checks the staff member's calendar for the whole
+# batch and the free occurrences go in with two bulk inserts. The
+# expand_series job moves expanded_until forward as the horizon rolls.
+# "This and following" edits end the series the day before and continue it
+# as a new series; cancelling following occurrences is one UPDATE. Earlier
+# occurrences are never rewritten.
+SERIES_HORIZON_DAYS = int(os.getenv("SERIES_HORIZON_DAYS", "56"))
+SERIES_EXPAND_SECONDS = int(os.getenv("SERIES_EXPAND_SECONDS", "3600"))
+FREQUENCIES = ("daily", "weekly", "monthly")
+
+_lock = threading.Lock()
+_expanded_at = None
+
+
+class Expansion(NamedTuple):
+    appointments: List[models.Appointment]
+    conflicts: List[date] # occurrences not booked because the staff member was busy
+
+
+def _nth(series, n: int) -> date:
+    start = series.start_date
+    if series.frequency == "monthly":
+        month = start.month - 1 + n * series.interval
+        year, month = start.year + month // 12, month % 12 + 1
+        # The 31st becomes the last day of shorter months
+        return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+    step = series.interval * (7 if series.frequency == "weekly" else 1)
+    return start + timedelta(days=n * step)
+
+
+def _first_after(series, after: Optional[date]) -> int:
+    # Position of the first occurrence after the given date
+    if after is None or after < series.start_date:
+        return 0
+    if series.frequency == "monthly":
+        n = ((after.year - series.start_date.year) * 12 + after.month - series.start_date.month) // series.interval
+    else:
+        n = (after - series.start_date).days // (series.interval * (7 if series.frequency == "weekly" else 1))
+    while _nth(series, n) <= after:
+        n += 1
+    return n
+
+
+def _in_rule(series, n: int) -> bool:
+    return (series.count is None or n < series.count) and (series.until is None or _nth(series, n) <= series.until)
+
+
+def occurrences(series, after: Optional[date], through: date):
+    # (position, date) of the occurrences in (after, through]
+    result = []
+    n = _first_after(series, after)
+    while _in_rule(series, n) and _nth(series, n) <= through:
+        result.append((n, _nth(series, n)))
+        n += 1
+    return result
+
+
+def _conflicts(db: Session, series, pending):
+    if series.staff_id is None or not pending:
+        return set()
+    minutes = max(series.duration_minutes or 0, 1)
+    first = datetime.combine(pending[0][1], series.time)
+    last = datetime.combine(pending[-1][1], series.time) + timedelta(minutes=minutes)
+    # One scan over the staff member's bookings for the whole batch, bucketed by day
+    taken = {}
+    for r in schedule.busy(db, [series.staff_id], first, last):
+        starts = datetime.combine(r.date, r.time)
+        for day in {r.date, r.ends_at.date()}:
+            taken.setdefault(day, []).append((starts, r.ends_at))
+    clashes = set()
+    for _, day in pending:
+        starts = datetime.combine(day, series.time)
+        ends = starts + timedelta(minutes=minutes)
+        if any(s < ends and e > starts for s, e in taken.get(day, ())):
+            clashes.add(day)
+    return clashes
+
+
+def _kept_by_ancestors(db: Session, series, pending):
+    # Dates on which a series this one was split from still has an occurrence.
+    # A split removes only pending occurrences, so these were completed or
+    # cancelled one by one and must not be booked again.
+    if series.parent_id is None or not pending:
+        return set()
+    ancestors, parent_id = [], series.parent_id
+    while parent_id is not None and parent_id not in ancestors:
+        ancestors.append(parent_id)
+        parent_id = db.query(models.AppointmentSeries.parent_id).filter(models.AppointmentSeries.id == parent_id).scalar()
+    return {r[0] for r in db.query(models.Appointment.date).filter(
+        models.Appointment.series_id.in_(ancestors),
+        models.Appointment.date >= pending[0][1],
+        models.Appointment.date <= pending[-1][1]
+    )}
+
+
+def expand(db: Session, series: models.AppointmentSeries, through: Optional[date] = None, skip_conflicts: bool = True) -> Expansion:
+    # Books the occurrences after expanded_until up to through (default: the
+    # horizon). With skip_conflicts=False nothing is booked if any occurrence
+    # clashes. The caller commits.
+    through = through or date.today() + timedelta(days=SERIES_HORIZON_DAYS)
+    pending = occurrences(series, series.expanded_until, through)
+    kept = _kept_by_ancestors(db, series, pending)
+    pending = [(n, day) for n, day in pending if day not in kept]
+    clashes = _conflicts(db, series, pending)
+    if clashes and not skip_conflicts:
+        return Expansion([], sorted(clashes))
+
+    rows = [{
+        "branch_id": series.branch_id,
+        "customer_id": series.customer_id,
+        "staff_id": series.staff_id,
+        "date": day,
+        "time": series.time,
+        "status": "pending",
+        "payment_status": "unpaid",
+        "total_amount": series.total_amount,
+        "duration_minutes": series.duration_minutes,
+        "ends_at": schedule.ends_at(day, series.time, series.duration_minutes),
+        "series_id": series.id,
+        "occurrence": n
+    } for n, day in pending if day not in clashes]
+    ids = []
+    if rows:
+        ids = db.execute(
+            insert(models.Appointment).returning(models.Appointment.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        service_ids = service_ids_of(db, series)
+        if service_ids:
+            db.execute(models.appointment_services.insert(), [
+                {"appointment_id": i, "service_id": s} for i in ids for s in service_ids
+            ])
+
+    series.expanded_until = max(through, series.expanded_until or through)
+    if not _in_rule(series, _first_after(series, series.expanded_until)):
+        series.status = "ended"
+    appointments = db.query(models.Appointment).filter(models.Appointment.id.in_(ids)).order_by(models.Appointment.date).all() if ids else []
+    for a in appointments:
+        events.record(db, "appointment", "created", a.id, events.appointment_payload(a), a.date)
+    reminders.sync_many(db, appointments)
+    return Expansion(appointments, sorted(clashes))
+
+
+def service_ids_of(db: Session, series: models.AppointmentSeries):
+    return [r[0] for r in db.query(models.series_services.c.service_id).filter(
+        models.series_services.c.series_id == series.id
+    ).order_by(models.series_services.c.id)]
+
+
+def set_services(db: Session, series_id: int, service_ids):
+    if service_ids:
+        db.execute(models.series_services.insert(), [{"series_id": series_id, "service_id": s} for s in service_ids])
+
+
+def following(db: Session, series: models.AppointmentSeries, from_date: date):
+    # Booked occurrences on or after from_date that have not been completed or cancelled
+    return db.query(models.Appointment).filter(
+        models.Appointment.series_id == series.id,
+        models.Appointment.date >= from_date,
+        models.Appointment.status == "pending"
+    ).order_by(models.Appointment.date).all()
+
+
+def _end_before(series: models.AppointmentSeries, from_date: date, status: str):
+    if series.until is None or series.until >= from_date:
+        series.until = from_date - timedelta(days=1)
+    # Occurrences before from_date that are not booked yet still get booked
+    if not _in_rule(series, _first_after(series, series.expanded_until)):
+        series.status = status
+
+
+def cancel_following(db: Session, series: models.AppointmentSeries, from_date: date):
+    # Cancels from_date onwards with one UPDATE and returns the cancelled
+    # appointments, refreshed; the caller releases their slots and commits
+    ids = [a.id for a in following(db, series, from_date)]
+    _end_before(series, from_date, "cancelled" if from_date <= series.start_date else "ended")
+    if not ids:
+        return []
+    cancelled = db.execute(
+        update(models.Appointment).where(
+            models.Appointment.id.in_(ids), models.Appointment.status == "pending"
+        ).values(status="cancelled", version=models.Appointment.version + 1).returning(models.Appointment).execution_options(
+            synchronize_session=False, populate_existing=True
+        )
+    ).scalars().all()
+    for a in cancelled:
+        events.record(db, "appointment", "status", a.id, {**events.appointment_payload(a), "previous_date": str(a.date)}, a.date)
+    reminders.cancel(db, [a.id for a in cancelled])
+    return cancelled
+
+
+def split(db: Session, series: models.AppointmentSeries, from_date: date, changes: dict, service_ids=None):
+    # "This and following": the series ends the day before from_date and a new
+    # series with the changes takes over the remaining occurrences. Pending
+    # occurrences from from_date on are removed and rebooked from the new
+    # series; completed and cancelled ones stay and their dates are skipped
+    # when the new series expands. Returns (new series, removed appointments); the caller expands
+    # the new series and commits.
+    n = _first_after(series, from_date - timedelta(days=1))
+    if not _in_rule(series, n):
+        return None, []
+    removed = following(db, series, from_date)
+    ids = [a.id for a in removed]
+    if ids:
+        db.execute(models.appointment_services.delete().where(models.appointment_services.c.appointment_id.in_(ids)))
+        db.query(models.Appointment).filter(models.Appointment.id.in_(ids)).delete(synchronize_session=False)
+        reminders.cancel(db, ids)
+        for a in removed:
+            events.record(db, "appointment", "deleted", a.id, event_date=a.date)
+
+    successor = models.AppointmentSeries(
+        branch_id=series.branch_id,
+        customer_id=series.customer_id,
+        staff_id=series.staff_id,
+        frequency=series.frequency,
+        interval=series.interval,
+        start_date=_nth(series, n),
+        time=series.time,
+        count=series.count - n if series.count is not None else None,
+        until=series.until,
+        total_amount=series.total_amount,
+        duration_minutes=series.duration_minutes,
+        status="active",
+        parent_id=series.id
+    )
+    for field, value in changes.items():
+        setattr(successor, field, value)
+    if service_ids is None:
+        service_ids = service_ids_of(db, series)
+    _end_before(series, from_date, "ended")
+    db.add(successor)
+    db.flush()
+    set_services(db, successor.id, service_ids)
+    return successor, removed
+
+
+def schedule_expansion_if_due(db: Session):
+    # The horizon moves with the calendar, so expansion reruns periodically
+    global _expanded_at
+    from . import jobs
+    with _lock:
+        if _expanded_at is not None and clock.monotonic() - _expanded_at < SERIES_EXPAND_SECONDS:
+            return
+        _expanded_at = clock.monotonic()
+    jobs.schedule_once(db, "expand_series")
+
+
+def ensure_schema(bind):
+    added = add_missing_columns(bind, {"appointments": {"series_id": "INTEGER", "occurrence": "INTEGER"}})
+    with bind.begin() as conn:
+        for index in Base.metadata.tables["appointments"].indexes:
+            if index.name == "ux_appointments_series_occurrence":
+                index.create(conn, checkfirst=True)
+    return added
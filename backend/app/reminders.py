@@ -0,0 +1,371 @@
+from sqlalchemy import event, tuple_, update
+from sqlalchemy.orm import Session
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+import heapq
+import logging
+import os
+import threading
+import time
+
+from . import models, notifications
+from .database import RoutingSession, SessionLocal
+
+# Appointment reminders and follow-ups. Write paths call sync() before
+# commit, which re-plans an appointment's reminder rows in the same
+# transaction. Delivery runs on two threads per process:
+#   - the loader keeps an in-memory heap filled with (due_at, id) for
+#     everything due before loaded_until, extending that window in keyset
+#     pages over ix_reminders_status_due as time moves on, and sweeps for
+#     overdue rows another process created;
+#   - the dispatcher sleeps until the top of the heap is due, claims the due
+#     rows with one UPDATE ... WHERE status = 'scheduled' RETURNING id (so
+#     a reminder is sent once even with several processes, and cancelled or
+#     rescheduled ones left in the heap are simply skipped), sends them in a
+#     batch and marks them sent.
+# Reminders committed in this process inside the loaded window are pushed
+# into the heap right after commit, so they do not wait for the next load.
+# Reminders are scheduled on the primary database, which holds every branch.
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1") != "0"
+REMINDER_OFFSETS_MINUTES = [int(m) for m in os.getenv("REMINDER_OFFSETS_MINUTES", "1440,120").split(",") if m.strip()]
+REMINDER_FOLLOW_UP_MINUTES = int(os.getenv("REMINDER_FOLLOW_UP_MINUTES", "1440")) # 0 disables follow-ups
+REMINDER_HORIZON_SECONDS = int(os.getenv("REMINDER_HORIZON_SECONDS", "600"))
+REMINDER_SWEEP_SECONDS = int(os.getenv("REMINDER_SWEEP_SECONDS", "60"))
+REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "3"))
+REMINDER_RETRY_SECONDS = 60
+REMINDER_LOAD_BATCH = 5000
+REMINDER_SEND_BATCH = 500
+LAG_SAMPLES = 10000
+
+logger = logging.getLogger(__name__)
+
+_heap = []
+_cond = threading.Condition()
+_loaded_until: Optional[datetime] = None
+_stopping = False
+_threads: List[threading.Thread] = []
+_sender: Optional[notifications.Sender] = None
+_stats = {"sent": 0, "failed": 0, "retried": 0, "skipped": 0}
+_lag = deque(maxlen=LAG_SAMPLES)
+
+
+def set_sender(sender: notifications.Sender):
+    global _sender
+    _sender = sender
+
+
+# Scheduling, called from request transactions
+
+def cancel(db: Session, appointment_ids: Iterable[int], kinds=("reminder", "follow_up")):
+    appointment_ids = list(appointment_ids)
+    if not appointment_ids:
+        return
+    db.query(models.Reminder).filter(
+        models.Reminder.appointment_id.in_(appointment_ids),
+        models.Reminder.status == "scheduled",
+        models.Reminder.kind.in_(kinds)
+    ).update({"status": "cancelled"}, synchronize_session=False)
+
+
+def sync_many(db: Session, appointments: Iterable[models.Appointment]):
+    appointments = [a for a in appointments if a.id is not None]
+    if not appointments:
+        return
+    # Reminders before the visit are always re-planned from the current date and time
+    cancel(db, [a.id for a in appointments], kinds=("reminder",))
+    cancel(db, [a.id for a in appointments if a.status == "cancelled"], kinds=("follow_up",))
+
+    completed = [a.id for a in appointments if a.status == "completed"]
+    has_follow_up = set()
+    if completed and REMINDER_FOLLOW_UP_MINUTES:
+        has_follow_up = {r[0] for r in db.query(models.Reminder.appointment_id).filter(
+            models.Reminder.appointment_id.in_(completed),
+            models.Reminder.kind == "follow_up",
+            models.Reminder.status.in_(["scheduled", "sending", "sent"])
+        )}
+
+    now = datetime.now()
+    for a in appointments:
+        if a.status == "completed":
+            if REMINDER_FOLLOW_UP_MINUTES and a.id not in has_follow_up:
+                db.add(models.Reminder(
+                    appointment_id=a.id, branch_id=a.branch_id, kind="follow_up",
+                    due_at=now + timedelta(minutes=REMINDER_FOLLOW_UP_MINUTES)
+                ))
+        elif a.status != "cancelled" and a.date and a.time:
+            starts_at = datetime.combine(a.date, a.time)
+            for offset in REMINDER_OFFSETS_MINUTES:
+                due_at = starts_at - timedelta(minutes=offset)
+                if due_at > now:
+                    db.add(models.Reminder(appointment_id=a.id, branch_id=a.branch_id, kind="reminder", due_at=due_at))
+
+
+def sync(db: Session, appointment: models.Appointment):
+    sync_many(db, [appointment])
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _collect_new(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, models.Reminder):
+            session.info.setdefault("new_reminders", []).append((obj.due_at, obj.id))
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _push_committed(session):
+    due = session.info.pop("new_reminders", None)
+    if due:
+        _push(due)
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop("new_reminders", None)
+
+
+# Delivery
+
+def _push(items):
+    with _cond:
+        if _loaded_until is None:
+            return
+        pushed = False
+        for due_at, reminder_id in items:
+            # Beyond the window the loader picks it up when the window gets there
+            if due_at < _loaded_until:
+                heapq.heappush(_heap, (due_at, reminder_id))
+                pushed = True
+        if pushed:
+            _cond.notify_all()
+
+
+def _load_window():
+    global _loaded_until
+    until = datetime.now() + timedelta(seconds=REMINDER_HORIZON_SECONDS)
+    with _cond:
+        start = _loaded_until
+        if start is not None and start - datetime.now() > timedelta(seconds=REMINDER_HORIZON_SECONDS / 2):
+            return
+        # Moved first, so commits during the load push into the heap themselves
+        _loaded_until = until
+
+    after = None
+    while True:
+        db = SessionLocal()
+        try:
+            query = db.query(models.Reminder.due_at, models.Reminder.id).filter(
+                models.Reminder.status == "scheduled",
+                models.Reminder.due_at < until
+            )
+            if start is not None:
+                query = query.filter(models.Reminder.due_at >= start)
+            if after is not None:
+                query = query.filter(tuple_(models.Reminder.due_at, models.Reminder.id) > after)
+            rows = [tuple(r) for r in query.order_by(models.Reminder.due_at, models.Reminder.id).limit(REMINDER_LOAD_BATCH)]
+        finally:
+            db.close()
+        if rows:
+            _push(rows)
+            after = rows[-1]
+        if len(rows) < REMINDER_LOAD_BATCH:
+            return
+
+
+def _sweep():
+    # Overdue rows nobody picked up, e.g. created by another process inside our window
+    cutoff = datetime.now() - timedelta(seconds=REMINDER_SWEEP_SECONDS)
+    db = SessionLocal()
+    try:
+        rows = db.query(models.Reminder.due_at, models.Reminder.id).filter(
+            models.Reminder.status == "scheduled",
+            models.Reminder.due_at < cutoff
+        ).order_by(models.Reminder.due_at).limit(REMINDER_LOAD_BATCH).all()
+    finally:
+        db.close()
+    if rows:
+        _push([tuple(r) for r in rows])
+
+
+def _message(reminder: models.Reminder, appointment: models.Appointment, customer: Optional[models.Customer]):
+    when = f"{appointment.date} at {appointment.time.strftime('%H:%M')}" if appointment.time else str(appointment.date)
+    name = customer.name if customer else "there"
+    if reminder.kind == "follow_up":
+        subject = "Thank you for visiting"
+        body = f"Hi {name}, thank you for your visit on {appointment.date}. We hope to see you again soon."
+    else:
+        subject = "Appointment reminder"
+        body = f"Hi {name}, this is a reminder of your appointment on {when}."
+    return {
+        "reminder_id": reminder.id,
+        "appointment_id": appointment.id,
+        "kind": reminder.kind,
+        "to_email": customer.email if customer else None,
+        "to_phone": customer.phone if customer else None,
+        "subject": subject,
+        "body": body
+    }
+
+
+def _dispatch(batch):
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            update(models.Reminder)
+            .where(models.Reminder.id.in_([reminder_id for _, reminder_id in batch]), models.Reminder.status == "scheduled")
+            .values(status="sending", attempts=models.Reminder.attempts + 1)
+            .returning(models.Reminder.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        db.commit()
+        if not claimed:
+            return
+
+        rows = db.query(models.Reminder, models.Appointment, models.Customer).outerjoin(
+            models.Appointment, models.Appointment.id == models.Reminder.appointment_id
+        ).outerjoin(
+            models.Customer, models.Customer.id == models.Appointment.customer_id
+        ).filter(models.Reminder.id.in_(claimed)).all()
+
+        orphaned = [r.id for r, a, _ in rows if a is None]
+        deliverable = [(r.id, r.attempts, r.due_at) for r, a, _ in rows if a is not None]
+        messages = [_message(r, a, c) for r, a, c in rows if a is not None]
+        # Nothing is held open while the sender talks to the outside world
+        db.rollback()
+        try:
+            errors = (_sender or notifications.get_sender()).send_many(messages) if messages else []
+        except Exception as e:
+            # The whole batch counts as a failed attempt so no claimed row is left "sending"
+            logger.exception("Reminder sender failed")
+            errors = [repr(e)] * len(messages)
+
+        now = datetime.now()
+        sent, retry = [], []
+        for (reminder_id, attempts, due_at), error in zip(deliverable, errors):
+            if error is None:
+                sent.append(reminder_id)
+                _lag.append((now - due_at).total_seconds())
+                continue
+            values = {"status": "failed", "error": error}
+            if attempts < REMINDER_MAX_ATTEMPTS:
+                values = {"status": "scheduled", "error": error, "due_at": now + timedelta(seconds=REMINDER_RETRY_SECONDS * attempts)}
+                retry.append((values["due_at"], reminder_id))
+            else:
+                _stats["failed"] += 1
+                logger.warning("Reminder %s failed: %s", reminder_id, error)
+            db.query(models.Reminder).filter(models.Reminder.id == reminder_id).update(values, synchronize_session=False)
+        if sent:
+            db.query(models.Reminder).filter(models.Reminder.id.in_(sent)).update(
+                {"status": "sent", "sent_at": now}, synchronize_session=False
+            )
+        if orphaned:
+            db.query(models.Reminder).filter(models.Reminder.id.in_(orphaned)).update(
+                {"status": "cancelled"}, synchronize_session=False
+            )
+        db.commit()
+        _stats["sent"] += len(sent)
+        _stats["retried"] += len(retry)
+        _stats["skipped"] += len(orphaned)
+        if retry:
+            _push(retry)
+    except Exception:
+        logger.exception("Reminder dispatch failed")
+        db.rollback()
+    finally:
+        db.close()
+
+
+def _loader_loop():
+    next_sweep = 0.0
+    while True:
+        try:
+            _load_window()
+            if time.monotonic() >= next_sweep:
+                _sweep()
+                next_sweep = time.monotonic() + REMINDER_SWEEP_SECONDS
+        except Exception:
+            logger.exception("Reminder loader failed")
+        with _cond:
+            if _stopping:
+                return
+            _cond.wait(min(REMINDER_HORIZON_SECONDS / 4, REMINDER_SWEEP_SECONDS))
+            if _stopping:
+                return
+
+
+def _dispatcher_loop():
+    while True:
+        with _cond:
+            while True:
+                if _stopping:
+                    return
+                now = datetime.now()
+                if _heap and _heap[0][0] <= now:
+                    break
+                timeout = (_heap[0][0] - now).total_seconds() if _heap else None
+                _cond.wait(timeout)
+            batch = []
+            while _heap and _heap[0][0] <= now and len(batch) < REMINDER_SEND_BATCH:
+                batch.append(heapq.heappop(_heap))
+        _dispatch(batch)
+
+
+def start():
+    global _stopping
+    if not REMINDERS_ENABLED or _threads:
+        return
+    db = SessionLocal()
+    try:
+        # Left over from a process that stopped mid-send
+        db.query(models.Reminder).filter(models.Reminder.status == "sending").update(
+            {"status": "scheduled"}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+    _stopping = False
+    for target, name in ((_loader_loop, "reminder-loader"), (_dispatcher_loop, "reminder-dispatcher")):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+
+def stop():
+    global _stopping, _loaded_until
+    with _cond:
+        _stopping = True
+        _cond.notify_all()
+    for thread in _threads:
+        thread.join(timeout=10)
+    _threads.clear()
+    with _cond:
+        _heap.clear()
+        _loaded_until = None
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def metrics():
+    lag = list(_lag)
+    with _cond:
+        heap_size = len(_heap)
+        next_due = _heap[0][0] if _heap else None
+        loaded_until = _loaded_until
+    return {
+        "enabled": REMINDERS_ENABLED,
+        "running": bool(_threads),
+        "heap_size": heap_size,
+        "next_due": next_due,
+        "loaded_until": loaded_until,
+        **_stats,
+        "lag_ms": {
+            "p50": round(_percentile(lag, 50) * 1000, 1) if lag else None,
+            "p99": round(_percentile(lag, 99) * 1000, 1) if lag else None,
+            "max": round(max(lag) * 1000, 1) if lag else None,
+        }
+    }
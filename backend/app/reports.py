@@ -0,0 +1,217 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, extract
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, date
+from typing import Optional
+import os
+import threading
+
+from . import models, archive
+from .database import Base
+
+# Detailed reports are served from versioned snapshots instead of being
+# aggregated on every page view. A snapshot is refreshed in the background
+# after REPORT_REFRESH_WRITES writes or once it is older than
+# REPORT_REFRESH_SECONDS; only months touched since the last snapshot are
+# re-aggregated, earlier months are carried over. Writers record the days they
+# touched in report_changes inside their own transaction, so the marker
+# survives restarts and is shared by every process; a refresh deletes exactly
+# the rows it covered in the transaction that publishes the snapshot. Refreshes
+# in a process run one at a time, and the unique version index turns a race
+# between processes into a rollback. A forced refresh re-aggregates every
+# month.
+REPORT_REFRESH_WRITES = int(os.getenv("REPORT_REFRESH_WRITES", "50"))
+REPORT_REFRESH_SECONDS = int(os.getenv("REPORT_REFRESH_SECONDS", "900"))
+REPORT_SNAPSHOTS_KEPT = int(os.getenv("REPORT_SNAPSHOTS_KEPT", "5"))
+
+_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_writes_since_refresh = 0
+
+
+def _daily_revenue(db: Session):
+    # 1. Daily Revenue (Last 30 Days)
+    thirty_days_ago = datetime.now().date() - timedelta(days=30)
+    daily_revenue = db.query(
+        models.Appointment.date,
+        func.sum(models.Appointment.total_amount).label("revenue")
+    ).filter(
+        models.Appointment.status == "completed",
+        models.Appointment.date >= thirty_days_ago
+    ).group_by(models.Appointment.date).order_by(models.Appointment.date).all()
+    return [{"date": str(r.date), "revenue": r.revenue} for r in daily_revenue]
+
+
+def _monthly_revenue(db: Session, since: Optional[date] = None):
+    # 2. Monthly Revenue (extract() works on PostgreSQL and SQLite alike), archived months included
+    history = archive.appointment_history()
+    year = extract("year", history.c.date)
+    month = extract("month", history.c.date)
+    query = db.query(
+        year.label("year"),
+        month.label("month"),
+        func.sum(history.c.total_amount).label("revenue")
+    ).filter(
+        history.c.status == "completed"
+    )
+    if since:
+        query = query.filter(history.c.date >= since)
+    monthly_revenue = query.group_by(year, month).order_by(year, month).all()
+    return [{"month": f"{int(r.year):04d}-{int(r.month):02d}", "revenue": r.revenue} for r in monthly_revenue]
+
+
+def _popular_services(db: Session):
+    # 3. Most Popular Services
+    lines = archive.appointment_service_history()
+    popular_services = db.query(
+        models.Service.name,
+        models.Service.category,
+        func.count(lines.c.service_id).label("total_bookings"),
+        func.sum(models.Service.price).label("total_revenue")
+    ).join(lines, lines.c.service_id == models.Service.id).group_by(models.Service.id).order_by(func.count(lines.c.service_id).desc()).all()
+    return [{"name": r.name, "category": r.category, "bookings": r.total_bookings, "revenue": r.total_revenue} for r in popular_services]
+
+
+def _frequent_customers(db: Session):
+    # 4. Frequent Customers
+    history = archive.appointment_history()
+    frequent_customers = db.query(
+        models.Customer.name,
+        models.Customer.phone,
+        func.count(history.c.id).label("visit_count"),
+        func.sum(history.c.total_amount).label("total_spent")
+    ).join(history, history.c.customer_id == models.Customer.id).filter(
+        history.c.status == "completed"
+    ).group_by(models.Customer.id).order_by(func.count(history.c.id).desc()).limit(10).all()
+    return [{"name": r.name, "phone": r.phone, "visits": r.visit_count, "spent": r.total_spent} for r in frequent_customers]
+
+
+def build_detailed_reports(db: Session):
+    return {
+        "daily_revenue": _daily_revenue(db),
+        "monthly_revenue": _monthly_revenue(db),
+        "popular_services": _popular_services(db),
+        "frequent_customers": _frequent_customers(db)
+    }
+
+
+def latest_snapshot(db: Session) -> Optional[models.ReportSnapshot]:
+    return db.query(models.ReportSnapshot).order_by(models.ReportSnapshot.version.desc()).first()
+
+
+def refresh_snapshot(db: Session, full: bool = False) -> models.ReportSnapshot:
+    with _refresh_lock:
+        return _refresh_snapshot(db, full)
+
+
+def _refresh_snapshot(db: Session, full: bool) -> models.ReportSnapshot:
+    global _writes_since_refresh
+    with _lock:
+        writes = _writes_since_refresh
+    changes = db.query(models.ReportChange.id, models.ReportChange.day).all()
+    dirty_from = min((c.day for c in changes), default=None)
+
+    previous = latest_snapshot(db)
+    if previous is None or full:
+        payload = build_detailed_reports(db)
+    else:
+        # Re-aggregate from the earliest touched month (at least the current one) and keep older months
+        month_start = datetime.now().date().replace(day=1)
+        if dirty_from and dirty_from < month_start:
+            month_start = dirty_from.replace(day=1)
+        since_month = month_start.strftime("%Y-%m")
+        kept_months = [m for m in previous.payload.get("monthly_revenue", []) if m["month"] < since_month]
+        payload = {
+            "daily_revenue": _daily_revenue(db),
+            "monthly_revenue": kept_months + _monthly_revenue(db, since=month_start),
+            "popular_services": _popular_services(db),
+            "frequent_customers": _frequent_customers(db)
+        }
+
+    snapshot = models.ReportSnapshot(
+        version=(previous.version + 1) if previous else 1,
+        payload=payload,
+        generated_at=datetime.now()
+    )
+    db.add(snapshot)
+    db.flush()
+    stale_ids = [s.id for s in db.query(models.ReportSnapshot.id).order_by(models.ReportSnapshot.version.desc()).offset(REPORT_SNAPSHOTS_KEPT).all()]
+    if stale_ids:
+        db.query(models.ReportSnapshot).filter(models.ReportSnapshot.id.in_(stale_ids)).delete(synchronize_session=False)
+    # Days recorded while this snapshot was built stay for the next one
+    change_ids = [c.id for c in changes]
+    for i in range(0, len(change_ids), 500):
+        db.query(models.ReportChange).filter(models.ReportChange.id.in_(change_ids[i:i + 500])).delete(synchronize_session=False)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another process published this version first; the changed days stay for the next refresh
+        db.rollback()
+        return latest_snapshot(db)
+    with _lock:
+        # Writes noted while this snapshot was built count towards the next one
+        _writes_since_refresh = max(_writes_since_refresh - writes, 0)
+    db.refresh(snapshot)
+    return snapshot
+
+
+def ensure_schema(bind):
+    # Existing databases get the unique version index; duplicate versions left by earlier races are dropped first
+    table = models.ReportSnapshot.__table__
+    with bind.begin() as conn:
+        keep = {r[0] for r in conn.execute(table.select().with_only_columns(func.max(table.c.id)).group_by(table.c.version))}
+        duplicates = [r[0] for r in conn.execute(table.select().with_only_columns(table.c.id)) if r[0] not in keep]
+        if duplicates:
+            conn.execute(table.delete().where(table.c.id.in_(duplicates)))
+        for index in Base.metadata.tables["report_snapshots"].indexes:
+            if index.name == "ux_report_snapshots_version":
+                index.create(conn, checkfirst=True)
+
+
+def mark_changed(db: Session, dates):
+    # Called before the commit of any write that moves revenue; the days commit with the write
+    days = {d for d in dates if d}
+    if days:
+        db.execute(models.ReportChange.__table__.insert(), [{"day": d} for d in days])
+
+
+def note_write(db: Session):
+    # Called after the commit of write paths; schedules a background refresh every REPORT_REFRESH_WRITES writes
+    global _writes_since_refresh
+    with _lock:
+        _writes_since_refresh += 1
+        due = _writes_since_refresh >= REPORT_REFRESH_WRITES
+    if due:
+        schedule_refresh(db)
+
+
+def schedule_if_pending(db: Session):
+    # At startup: days changed before a restart are folded in without waiting for new writes
+    if db.query(models.ReportChange.id).first() is not None:
+        schedule_refresh(db)
+
+
+def schedule_refresh(db: Session):
+    from . import jobs
+    jobs.schedule_once(db, "refresh_reports")
+
+
+def snapshot_response(snapshot: models.ReportSnapshot):
+    return {
+        **snapshot.payload,
+        "version": snapshot.version,
+        "generated_at": snapshot.generated_at
+    }
+
+
+def get_reports(db: Session, force_refresh: bool = False):
+    if db.info.get("branch_id") is not None:
+        # Snapshots cover the whole chain; a single branch is aggregated on demand
+        return build_detailed_reports(db)
+    snapshot = None if force_refresh else latest_snapshot(db)
+    if snapshot is None:
+        snapshot = refresh_snapshot(db, full=force_refresh)
+    elif datetime.now(snapshot.generated_at.tzinfo) - snapshot.generated_at > timedelta(seconds=REPORT_REFRESH_SECONDS):
+        # Serve the stale snapshot now and refresh it in the background
+        schedule_refresh(db)
+    return snapshot_response(snapshot)
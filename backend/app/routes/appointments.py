@@ -1,23 +1,58 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, select
 from typing import List, Optional
-from datetime import date
-from .. import models, schemas, database
+from datetime import date, datetime, timedelta
+from .. import models, schemas, database, reports, analytics, staff_reports, customer_metrics, events, idempotency, concurrency, catalog, tenancy, reminders, waitlist, schedule, recurrence
 from .auth import get_current_user
 
 router = APIRouter(prefix="/appointments", tags=["appointments"])
 
+BATCH_STATUS_MAX = 500
+
+def _refresh_derived(db: Session, dates, customer_ids=()):
+    # Revenue rollups, customer metrics and the report change marker are written before the commit, so they commit with the appointment write
+    analytics.refresh_days(db, dates)
+    customer_metrics.refresh_customers(db, customer_ids)
+    reports.mark_changed(db, dates)
+
+def _after_write(db: Session, dates):
+    # After the commit: report snapshots, staff report cache, background batches and the live feed
+    reports.note_write(db)
+    customer_metrics.schedule_batch_if_due(db)
+    recurrence.schedule_expansion_if_due(db)
+    staff_reports.invalidate(dates)
+    events.notify()
+
+def _price_services(db: Session, service_ids):
+    # Validated and priced from the in-memory catalog; snapshot() re-checks its version in this transaction
+    priced = catalog.snapshot(db).price(service_ids, tenancy.current_branch(db))
+    if priced is None:
+        raise HTTPException(status_code=400, detail="One or more services not found")
+    return priced
+
+def _set_services(db: Session, appointment_id: int, priced):
+    if priced.services:
+        db.execute(models.appointment_services.insert(), [{"appointment_id": appointment_id, "service_id": s.id} for s in priced.services])
+
 @router.post("/", response_model=schemas.AppointmentResponse)
-def create_appointment(appointment: schemas.AppointmentCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def create_appointment(appointment: schemas.AppointmentCreate, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"), db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    # A retried request returns the stored response without re-validating or inserting
+    scope = "POST /appointments/"
+    if idempotency_key:
+        fingerprint = idempotency.fingerprint(appointment)
+        replay = idempotency.lookup(db, current_user.id, idempotency_key, scope, fingerprint)
+        if replay:
+            return replay
+
     # Verify customer exists
     customer = db.query(models.Customer).filter(models.Customer.id == appointment.customer_id).first()
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
     # Verify services exist and calculate total amount if not provided
-    services = db.query(models.Service).filter(models.Service.id.in_(appointment.service_ids)).all()
-    if len(services) != len(appointment.service_ids):
-        raise HTTPException(status_code=400, detail="One or more services not found")
+    priced = _price_services(db, appointment.service_ids)
     
     db_appointment = models.Appointment(
         customer_id=appointment.customer_id,
@@ -26,55 +61,198 @@ def create_appointment(appointment: schemas.AppointmentCreate, db: Session = Dep
         time=appointment.time,
         status=appointment.status,
         payment_status=appointment.payment_status,
-        total_amount=sum(s.price for s in services) if appointment.total_amount == 0 else appointment.total_amount
+        total_amount=priced.total_price if appointment.total_amount == 0 else appointment.total_amount,
+        duration_minutes=priced.total_duration,
+        ends_at=schedule.ends_at(appointment.date, appointment.time, priced.total_duration)
     )
-    db_appointment.services = services
     db.add(db_appointment)
-    db.commit()
+    db.flush()
+    _set_services(db, db_appointment.id, priced)
+    events.record(db, "appointment", "created", db_appointment.id, events.appointment_payload(db_appointment), db_appointment.date)
+    reminders.sync(db, db_appointment)
+    if idempotency_key:
+        idempotency.remember(db, current_user.id, idempotency_key, scope, fingerprint, schemas.AppointmentResponse.model_validate(db_appointment))
+    _refresh_derived(db, [db_appointment.date], [db_appointment.customer_id])
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if not idempotency_key:
+            raise
+        return idempotency.replay_after_conflict(db, current_user.id, idempotency_key, scope, fingerprint, e)
     db.refresh(db_appointment)
+    _after_write(db, [db_appointment.date])
     return db_appointment
 
 @router.get("/", response_model=List[schemas.AppointmentResponse])
-def get_appointments(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    return db.query(models.Appointment).all()
+def get_appointments(start_date: Optional[date] = None, end_date: Optional[date] = None, series_id: Optional[int] = None, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    query = db.query(models.Appointment)
+    if series_id:
+        query = query.filter(models.Appointment.series_id == series_id)
+    if start_date:
+        query = query.filter(models.Appointment.date >= start_date)
+    if end_date:
+        query = query.filter(models.Appointment.date <= end_date)
+    return query.all()
+
+@router.get("/busy", response_model=List[schemas.BusyInterval])
+def get_busy(start_date: date, end_date: Optional[date] = None, staff_id: Optional[int] = None, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    # Calendar/availability view: booked intervals per staff member, one scan over ix_appointments_staff_date_ends
+    end_date = end_date or start_date
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    start = datetime.combine(start_date, datetime.min.time())
+    rows = schedule.busy(db, [staff_id] if staff_id else None, start, datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+    return [{"id": r.id, "staff_id": r.staff_id, "starts_at": datetime.combine(r.date, r.time), "ends_at": r.ends_at} for r in rows]
 
 @router.get("/{appointment_id}", response_model=schemas.AppointmentResponse)
-def get_appointment(appointment_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_appointment(appointment_id: int, response: Response, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
     appointment = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
     if appointment is None:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    response.headers["ETag"] = concurrency.etag(appointment.version)
     return appointment
 
+def _services_total():
+    # Sum of the appointment's service prices, evaluated inside the UPDATE itself
+    return select(func.coalesce(func.sum(models.Service.price), 0)).select_from(
+        models.appointment_services.join(models.Service, models.Service.id == models.appointment_services.c.service_id)
+    ).where(models.appointment_services.c.appointment_id == models.Appointment.id).scalar_subquery()
+
+def _current_version(db: Session, appointment_id: int, expected: Optional[int]):
+    # Reads what the write needs to know about the previous state, pinned to the version it saw
+    current = db.query(
+        models.Appointment.date, models.Appointment.time, models.Appointment.staff_id, models.Appointment.status,
+        models.Appointment.customer_id, models.Appointment.duration_minutes, models.Appointment.version
+    ).filter(
+        models.Appointment.id == appointment_id
+    ).first()
+    if current is None:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    if expected is not None and current.version != expected:
+        concurrency.raise_conflict(db, models.Appointment, appointment_id, "Appointment")
+    return current
+
 @router.put("/{appointment_id}/status")
-def update_appointment_status(appointment_id: int, status: str, payment_status: Optional[str] = None, date: Optional[date] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def update_appointment_status(appointment_id: int, status: str, response: Response, payment_status: Optional[str] = None, date: Optional[date] = None, version: Optional[int] = None, if_match: Optional[str] = Header(None), db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    db_appointment = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
-    if db_appointment is None:
-        raise HTTPException(status_code=404, detail="Appointment not found")
-    
-    db_appointment.status = status
+    expected = concurrency.expected_version(if_match, version)
+    values = {"status": status}
     if payment_status:
-        db_appointment.payment_status = payment_status
-    if date:
-        db_appointment.date = date
+        values["payment_status"] = payment_status
     
     # If completed, ensure total_amount is calculated and mark as paid if not already
     if status == "completed":
-        db_appointment.total_amount = sum(s.price for s in db_appointment.services)
+        values["total_amount"] = _services_total()
         if not payment_status:
-            db_appointment.payment_status = "paid"
-        
+            values["payment_status"] = "paid"
+
+    current = _current_version(db, appointment_id, expected)
+    old_date = None
+    if date:
+        # Rescheduling also refreshes the day the appointment moves away from
+        old_date = current.date
+        values["date"] = date
+        if current.duration_minutes is not None:
+            values["ends_at"] = schedule.ends_at(date, current.time, current.duration_minutes)
+
+    db_appointment = concurrency.conditional_update(db, models.Appointment, appointment_id, expected, values, "Appointment")
+    old_date = old_date or db_appointment.date
+    events.record(db, "appointment", "status", db_appointment.id, {**events.appointment_payload(db_appointment), "previous_date": str(old_date)}, db_appointment.date)
+    reminders.sync(db, db_appointment)
+    if current.status != "cancelled" and (status == "cancelled" or old_date != db_appointment.date):
+        # The slot it held goes to the waitlist, once
+        waitlist.release(db, [(db_appointment, old_date, db_appointment.time, db_appointment.staff_id, db_appointment.duration_minutes)])
+    new_date, new_version, customer_id = db_appointment.date, db_appointment.version, db_appointment.customer_id
+    _refresh_derived(db, [old_date, new_date], [customer_id])
+    db.commit()
+    _after_write(db, [old_date, new_date])
+    response.headers["ETag"] = concurrency.etag(new_version)
+    return {"message": "Appointment status updated", "version": new_version}
+
+@router.post("/status:batch", response_model=schemas.AppointmentStatusBatchResponse)
+def update_appointment_statuses(batch: schemas.AppointmentStatusBatch, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    # End-of-day close-out: many status changes, one query per step and one commit
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    if len(batch.items) > BATCH_STATUS_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_STATUS_MAX} appointments per batch")
+
+    ids = [item.id for item in batch.items]
+    appointments = {a.id: a for a in db.query(models.Appointment).filter(models.Appointment.id.in_(ids)).all()}
+
+    # Totals for appointments being completed, summed over their services in one grouped query
+    completing = [item.id for item in batch.items if item.status == "completed" and item.id in appointments]
+    totals = {}
+    if completing:
+        totals = dict(db.query(
+            models.appointment_services.c.appointment_id,
+            func.sum(models.Service.price)
+        ).join(models.Service, models.Service.id == models.appointment_services.c.service_id).filter(
+            models.appointment_services.c.appointment_id.in_(completing)
+        ).group_by(models.appointment_services.c.appointment_id).all())
+
+    results, seen, dates, customer_ids, freed = [], set(), set(), set(), []
+    for item in batch.items:
+        if item.id in seen:
+            results.append({"id": item.id, "result": "duplicate"})
+            continue
+        seen.add(item.id)
+        db_appointment = appointments.get(item.id)
+        if db_appointment is None:
+            results.append({"id": item.id, "result": "not_found"})
+            continue
+        if item.version is not None and item.version != db_appointment.version:
+            results.append({"id": item.id, "result": "conflict", "version": db_appointment.version})
+            continue
+        old_date = db_appointment.date
+        if item.status == "cancelled" or (item.new_date and item.new_date != old_date):
+            freed.append((db_appointment, old_date, db_appointment.time, db_appointment.staff_id, db_appointment.duration_minutes))
+
+        db_appointment.status = item.status
+        if item.payment_status:
+            db_appointment.payment_status = item.payment_status
+        if item.new_date:
+            db_appointment.date = item.new_date
+            if db_appointment.duration_minutes is not None:
+                db_appointment.ends_at = schedule.ends_at(item.new_date, db_appointment.time, db_appointment.duration_minutes)
+        if item.status == "completed":
+            db_appointment.total_amount = totals.get(item.id) or 0
+            if not item.payment_status:
+                db_appointment.payment_status = "paid"
+
+        events.record(db, "appointment", "status", db_appointment.id, {**events.appointment_payload(db_appointment), "previous_date": str(old_date)}, db_appointment.date)
+        dates.update((old_date, db_appointment.date))
+        customer_ids.add(db_appointment.customer_id)
+        results.append({
+            "id": item.id,
+            "result": "updated",
+            "status": db_appointment.status,
+            "payment_status": db_appointment.payment_status,
+            "total_amount": db_appointment.total_amount
+        })
+
+    # The flush re-checks every version, so a concurrent edit fails the whole batch with 409
+    db.flush()
+    for r in results:
+        if r["result"] == "updated":
+            r["version"] = appointments[r["id"]].version
+    reminders.sync_many(db, [appointments[r["id"]] for r in results if r["result"] == "updated"])
+    waitlist.release(db, freed)
+    if customer_ids:
+        _refresh_derived(db, dates, customer_ids)
     db.commit()
-    return {"message": "Appointment status updated"}
+    if customer_ids:
+        _after_write(db, list(dates))
+    return {"updated": sum(1 for r in results if r["result"] == "updated"), "results": results}
 
 @router.put("/{appointment_id}", response_model=schemas.AppointmentResponse)
-def update_appointment(appointment_id: int, appointment: schemas.AppointmentCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def update_appointment(appointment_id: int, appointment: schemas.AppointmentUpdate, response: Response, if_match: Optional[str] = Header(None), db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    db_appointment = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
-    if db_appointment is None:
-        raise HTTPException(status_code=404, detail="Appointment not found")
+    expected = concurrency.expected_version(if_match, appointment.version)
+    current = _current_version(db, appointment_id, expected)
     
     # Verify customer exists
     customer = db.query(models.Customer).filter(models.Customer.id == appointment.customer_id).first()
@@ -82,22 +260,35 @@ def update_appointment(appointment_id: int, appointment: schemas.AppointmentCrea
         raise HTTPException(status_code=404, detail="Customer not found")
     
     # Verify services exist and calculate total amount if not provided
-    services = db.query(models.Service).filter(models.Service.id.in_(appointment.service_ids)).all()
-    if len(services) != len(appointment.service_ids):
-        raise HTTPException(status_code=400, detail="One or more services not found")
+    priced = _price_services(db, appointment.service_ids)
     
-    db_appointment.customer_id = appointment.customer_id
-    db_appointment.staff_id = appointment.staff_id
-    db_appointment.date = appointment.date
-    db_appointment.time = appointment.time
-    db_appointment.status = appointment.status
-    db_appointment.payment_status = appointment.payment_status
-    db_appointment.total_amount = sum(s.price for s in services) if appointment.total_amount == 0 else appointment.total_amount
-    db_appointment.services = services
+    old_date, old_customer_id = current.date, current.customer_id
+    # Without If-Match or a version the edit is last-writer-wins, as it was before versions existed
+    db_appointment = concurrency.conditional_update(db, models.Appointment, appointment_id, expected, {
+        "customer_id": appointment.customer_id,
+        "staff_id": appointment.staff_id,
+        "date": appointment.date,
+        "time": appointment.time,
+        "status": appointment.status,
+        "payment_status": appointment.payment_status,
+        "total_amount": priced.total_price if appointment.total_amount == 0 else appointment.total_amount,
+        "duration_minutes": priced.total_duration,
+        "ends_at": schedule.ends_at(appointment.date, appointment.time, priced.total_duration)
+    }, "Appointment")
+    moved = (current.date, current.time, current.staff_id) != (db_appointment.date, db_appointment.time, db_appointment.staff_id)
+    if current.status != "cancelled" and (moved or db_appointment.status == "cancelled"):
+        waitlist.release(db, [(db_appointment, current.date, current.time, current.staff_id, current.duration_minutes)])
+    db.execute(models.appointment_services.delete().where(models.appointment_services.c.appointment_id == appointment_id))
+    _set_services(db, appointment_id, priced)
+    events.record(db, "appointment", "updated", db_appointment.id, {**events.appointment_payload(db_appointment), "previous_date": str(old_date)}, db_appointment.date)
+    reminders.sync(db, db_appointment)
+    result = schemas.AppointmentResponse.model_validate(db_appointment)
     
+    _refresh_derived(db, [old_date, result.date], [old_customer_id, result.customer_id])
     db.commit()
-    db.refresh(db_appointment)
-    return db_appointment
+    _after_write(db, [old_date, result.date])
+    response.headers["ETag"] = concurrency.etag(result.version)
+    return result
 
 @router.delete("/{appointment_id}")
 def delete_appointment(appointment_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
@@ -106,6 +297,11 @@ def delete_appointment(appointment_id: int, db: Session = Depends(database.get_d
     appointment = db.query(models.Appointment).filter(models.Appointment.id == appointment_id).first()
     if appointment is None:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    old_date, old_customer_id = appointment.date, appointment.customer_id
     db.delete(appointment)
+    events.record(db, "appointment", "deleted", appointment_id, event_date=old_date)
+    reminders.cancel(db, [appointment_id])
+    _refresh_derived(db, [old_date], [old_customer_id])
     db.commit()
+    _after_write(db, [old_date])
     return {"message": "Appointment deleted successfully"}
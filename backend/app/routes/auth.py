@@ -1,15 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Header, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
+from typing import Optional
 from jose import JWTError, jwt
-from .. import models, schemas, authutils, database
+from .. import models, schemas, authutils, database, tenancy
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+def get_current_user(token: str = Depends(oauth2_scheme), x_branch_id: Optional[int] = Header(None), db: Session = Depends(database.get_db)):
+    # The request session is scoped to the user's branch for the rest of the request
+    user = user_from_token(token, db)
+    tenancy.scope_session(db, user, x_branch_id)
+    return user
+
+def user_from_token(token: str, db: Session):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -45,7 +52,8 @@ def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
         email=user.email,
         phone=user.phone,
         password=hashed_password,
-        role=user.role
+        role=user.role,
+        branch_id=user.branch_id
     )
     db.add(new_user)
     db.commit()
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from .. import models, schemas, database, tenancy
+from .auth import get_current_user, get_admin_user
+
+router = APIRouter(prefix="/branches", tags=["branches"])
+
+def _chain_admin(current_user: models.User):
+    if current_user.role != "admin" or current_user.branch_id is not None:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+@router.post("/", response_model=schemas.BranchResponse)
+def create_branch(branch: schemas.BranchCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_admin_user)):
+    _chain_admin(current_user)
+    db_branch = models.Branch(**branch.dict())
+    db.add(db_branch)
+    db.commit()
+    db.refresh(db_branch)
+    return db_branch
+
+@router.get("/", response_model=List[schemas.BranchResponse])
+def get_branches(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    query = db.query(models.Branch)
+    if tenancy.current_branch(db) is not None:
+        query = query.filter(models.Branch.id == tenancy.current_branch(db))
+    return query.order_by(models.Branch.id).all()
+
+@router.get("/{branch_id}", response_model=schemas.BranchResponse)
+def get_branch(branch_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.branch_id not in (None, branch_id):
+        raise HTTPException(status_code=404, detail="Branch not found")
+    branch = db.query(models.Branch).filter(models.Branch.id == branch_id).first()
+    if branch is None:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    return branch
+
+@router.put("/{branch_id}", response_model=schemas.BranchResponse)
+def update_branch(branch_id: int, branch_update: schemas.BranchCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_admin_user)):
+    _chain_admin(current_user)
+    db_branch = db.query(models.Branch).filter(models.Branch.id == branch_id).first()
+    if db_branch is None:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    for key, value in branch_update.dict().items():
+        setattr(db_branch, key, value)
+    db.commit()
+    db.refresh(db_branch)
+    return db_branch
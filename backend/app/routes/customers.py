@@ -1,13 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
-from .. import models, schemas, database
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
+from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import or_
+from typing import List, Optional
+from .. import models, schemas, database, reports, events, idempotency, concurrency, dedup
 from .auth import get_current_user
 
 router = APIRouter(prefix="/customers", tags=["customers"])
 
-@router.post("/", response_model=schemas.CustomerResponse)
-def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def _matches(db: Session, customer: models.Customer):
+    return [schemas.CustomerMatch(id=c.id, name=c.name, phone=c.phone, email=c.email, score=value, reasons=reasons)
+            for c, value, reasons in dedup.possible_duplicates(db, customer)]
+
+@router.post("/", response_model=schemas.CustomerCreateResponse)
+def create_customer(customer: schemas.CustomerCreate, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"), db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    # A retried request returns the stored response without inserting a duplicate
+    scope = "POST /customers/"
+    if idempotency_key:
+        fingerprint = idempotency.fingerprint(customer)
+        replay = idempotency.lookup(db, current_user.id, idempotency_key, scope, fingerprint)
+        if replay:
+            return replay
+
     data = customer.dict()
     # Convert empty strings to None for optional fields
     if data.get("email") == "": data["email"] = None
@@ -16,36 +30,111 @@ def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(data
     
     db_customer = models.Customer(**data)
     db.add(db_customer)
-    db.commit()
-    db.refresh(db_customer)
-    return db_customer
+    db.flush()
+    events.record(db, "customer", "created", db_customer.id, events.customer_payload(db_customer))
+    # Likely duplicates are returned for the front desk and queued for review
+    matches = _matches(db, db_customer)
+    dedup.record_pairs(db, [(min(m.id, db_customer.id), max(m.id, db_customer.id), db_customer.branch_id, m.score, m.reasons) for m in matches])
+    db.refresh(db_customer, ["created_at"])
+    result = schemas.CustomerCreateResponse.model_validate(db_customer).model_copy(update={"possible_duplicates": matches})
+    if idempotency_key:
+        idempotency.remember(db, current_user.id, idempotency_key, scope, fingerprint, result)
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if not idempotency_key:
+            raise
+        return idempotency.replay_after_conflict(db, current_user.id, idempotency_key, scope, fingerprint, e)
+    events.notify()
+    return result
+
+SORT_COLUMNS = {
+    "id": models.Customer.id,
+    "name": models.Customer.name,
+    "created_at": models.Customer.created_at,
+    "visits": models.CustomerMetrics.visits,
+    "lifetime_spend": models.CustomerMetrics.lifetime_spend,
+    "last_visit": models.CustomerMetrics.last_visit,
+}
 
 @router.get("/", response_model=List[schemas.CustomerResponse])
-def get_customers(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
-    customers = db.query(models.Customer).offset(skip).limit(limit).all()
+def get_customers(skip: int = 0, limit: int = 100, segment: Optional[str] = None, churn_risk: Optional[str] = None, min_spend: Optional[float] = None, min_visits: Optional[int] = None, sort_by: str = "id", order: str = "asc", db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    if sort_by not in SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail="Invalid sort_by")
+    query = db.query(models.Customer).outerjoin(models.Customer.metrics).options(contains_eager(models.Customer.metrics))
+    if segment == "prospect":
+        # Customers without a metrics row have no completed visits yet
+        query = query.filter(or_(models.CustomerMetrics.segment == segment, models.CustomerMetrics.customer_id == None))
+    elif segment:
+        query = query.filter(models.CustomerMetrics.segment == segment)
+    if churn_risk:
+        query = query.filter(models.CustomerMetrics.churn_risk == churn_risk)
+    if min_spend is not None:
+        query = query.filter(models.CustomerMetrics.lifetime_spend >= min_spend)
+    if min_visits is not None:
+        query = query.filter(models.CustomerMetrics.visits >= min_visits)
+    column = SORT_COLUMNS[sort_by]
+    query = query.order_by(column.desc() if order == "desc" else column.asc(), models.Customer.id)
+    customers = query.offset(skip).limit(limit).all()
     return customers
 
+def _brief(c: Optional[models.Customer]):
+    if c is None:
+        return None
+    return schemas.CustomerMatch(id=c.id, name=c.name, phone=c.phone, email=c.email, score=1.0)
+
+@router.get("/duplicates", response_model=List[schemas.CustomerDuplicateResponse])
+def get_duplicates(status: str = "open", min_score: float = 0, skip: int = 0, limit: int = 100, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    pairs = db.query(models.CustomerDuplicate).filter(
+        models.CustomerDuplicate.status == status,
+        models.CustomerDuplicate.score >= min_score
+    ).order_by(models.CustomerDuplicate.score.desc(), models.CustomerDuplicate.id).offset(skip).limit(limit).all()
+    ids = {p.customer_id for p in pairs} | {p.duplicate_id for p in pairs}
+    customers = {c.id: c for c in db.query(models.Customer).filter(models.Customer.id.in_(ids)).all()} if ids else {}
+    return [schemas.CustomerDuplicateResponse(
+        id=p.id, branch_id=p.branch_id, customer_id=p.customer_id, duplicate_id=p.duplicate_id,
+        score=p.score, reasons=p.reasons, status=p.status, created_at=p.created_at,
+        customer=_brief(customers.get(p.customer_id)), duplicate=_brief(customers.get(p.duplicate_id))
+    ) for p in pairs]
+
+@router.post("/duplicates/{pair_id}/dismiss")
+def dismiss_duplicate(pair_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    pair = db.query(models.CustomerDuplicate).filter(models.CustomerDuplicate.id == pair_id).first()
+    if pair is None:
+        raise HTTPException(status_code=404, detail="Duplicate pair not found")
+    pair.status = "dismissed"
+    db.commit()
+    return {"message": "Marked as not a duplicate"}
+
 @router.get("/{customer_id}", response_model=schemas.CustomerResponse)
-def get_customer(customer_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_customer(customer_id: int, response: Response, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
     customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
     if customer is None:
         raise HTTPException(status_code=404, detail="Customer not found")
+    response.headers["ETag"] = concurrency.etag(customer.version)
     return customer
 
 @router.put("/{customer_id}", response_model=schemas.CustomerResponse)
-def update_customer(customer_id: int, customer_update: schemas.CustomerCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def update_customer(customer_id: int, customer_update: schemas.CustomerUpdate, response: Response, if_match: Optional[str] = Header(None), db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    db_customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
-    if db_customer is None:
-        raise HTTPException(status_code=404, detail="Customer not found")
-    
-    for key, value in customer_update.dict().items():
-        setattr(db_customer, key, value)
+    expected = concurrency.expected_version(if_match, customer_update.version)
+    values = customer_update.dict(exclude={"version"})
+    values.update(dedup.keys_for(values["phone"], values["email"]))
+    db_customer = concurrency.conditional_update(db, models.Customer, customer_id, expected, values, "Customer")
+    events.record(db, "customer", "updated", db_customer.id, events.customer_payload(db_customer))
+    result = schemas.CustomerResponse.model_validate(db_customer)
     
     db.commit()
-    db.refresh(db_customer)
-    return db_customer
+    reports.note_write(db)
+    events.notify()
+    response.headers["ETag"] = concurrency.etag(result.version)
+    return result
 
 @router.delete("/{customer_id}")
 def delete_customer(customer_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
@@ -56,11 +145,35 @@ def delete_customer(customer_id: int, db: Session = Depends(database.get_db), cu
         raise HTTPException(status_code=404, detail="Customer not found")
     
     db.delete(db_customer)
+    events.record(db, "customer", "deleted", customer_id)
     db.commit()
+    reports.note_write(db)
+    events.notify()
     return {"message": "Customer deleted successfully"}
 
+@router.post("/{customer_id}/merge", response_model=schemas.CustomerResponse)
+def merge_customers(customer_id: int, merge: schemas.CustomerMerge, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    # Keeps customer_id; the duplicates' appointments, archive and waitlist move to it
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    duplicate_ids = set(merge.duplicate_ids) - {customer_id}
+    if not duplicate_ids:
+        raise HTTPException(status_code=400, detail="No customers to merge")
+    customers = {c.id: c for c in db.query(models.Customer).filter(models.Customer.id.in_(duplicate_ids | {customer_id})).all()}
+    if len(customers) != len(duplicate_ids) + 1:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    keep = customers.pop(customer_id)
+    if any(c.branch_id != keep.branch_id for c in customers.values()):
+        raise HTTPException(status_code=400, detail="Customers from different branches cannot be merged")
+    dedup.merge(db, keep, list(customers.values()))
+    db.commit()
+    db.refresh(keep)
+    reports.note_write(db)
+    events.notify()
+    return keep
+
 @router.get("/{customer_id}/profile")
-def get_customer_profile(customer_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_customer_profile(customer_id: int, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
     customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
@@ -69,12 +182,50 @@ def get_customer_profile(customer_id: int, db: Session = Depends(database.get_db
     appointments = db.query(models.Appointment).filter(
         models.Appointment.customer_id == customer_id
     ).order_by(models.Appointment.date.desc()).all()
+    history = [{
+        "id": a.id,
+        "date": a.date,
+        "time": a.time,
+        "status": a.status,
+        "payment_status": a.payment_status,
+        "total_amount": a.total_amount,
+        "services": [s.name for s in a.services],
+        "staff_name": a.staff.name if a.staff else "Not Assigned",
+        "archived": False
+    } for a in appointments]
+
+    # Older appointments live in the archive tier
+    archived = db.query(models.ArchivedAppointment).filter(
+        models.ArchivedAppointment.customer_id == customer_id
+    ).order_by(models.ArchivedAppointment.date.desc()).all()
+    if archived:
+        archived_ids = [a.id for a in archived]
+        service_names = {}
+        for appointment_id, name in db.query(
+            models.appointment_services_archive.c.appointment_id, models.Service.name
+        ).join(models.Service, models.Service.id == models.appointment_services_archive.c.service_id).filter(
+            models.appointment_services_archive.c.appointment_id.in_(archived_ids)
+        ).all():
+            service_names.setdefault(appointment_id, []).append(name)
+        staff_ids = {a.staff_id for a in archived if a.staff_id}
+        staff_names = dict(db.query(models.User.id, models.User.name).filter(models.User.id.in_(staff_ids)).all()) if staff_ids else {}
+        history += [{
+            "id": a.id,
+            "date": a.date,
+            "time": a.time,
+            "status": a.status,
+            "payment_status": a.payment_status,
+            "total_amount": a.total_amount,
+            "services": service_names.get(a.id, []),
+            "staff_name": staff_names.get(a.staff_id, "Not Assigned"),
+            "archived": True
+        } for a in archived]
     
     # Calculate stats
-    completed_apps = [a for a in appointments if a.status == "completed"]
+    completed_apps = [a for a in history if a["status"] == "completed"]
     total_visits = len(completed_apps)
-    total_spent = sum(a.total_amount for a in completed_apps)
-    last_visit = completed_apps[0].date if completed_apps else None
+    total_spent = sum(a["total_amount"] for a in completed_apps)
+    last_visit = completed_apps[0]["date"] if completed_apps else None
     
     return {
         "customer": customer,
@@ -83,14 +234,5 @@ def get_customer_profile(customer_id: int, db: Session = Depends(database.get_db
             "total_spent": total_spent,
             "last_visit": last_visit
         },
-        "history": [{
-            "id": a.id,
-            "date": a.date,
-            "time": a.time,
-            "status": a.status,
-            "payment_status": a.payment_status,
-            "total_amount": a.total_amount,
-            "services": [s.name for s in a.services],
-            "staff_name": a.staff.name if a.staff else "Not Assigned"
-        } for a in appointments]
+        "history": history
     }
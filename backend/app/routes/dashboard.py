@@ -1,38 +1,41 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from datetime import datetime, timedelta
-from .. import models, database
+from datetime import datetime, timedelta, date
+from typing import Optional
+from .. import models, database, reports, analytics, staff_reports, admission, reminders, archive
 from .auth import get_current_user
-from typing import Dict, List
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
 @router.get("/summary")
-def get_summary(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_summary(db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         from fastapi import HTTPException
         raise HTTPException(status_code=403, detail="Not enough permissions")
     total_customers = db.query(models.Customer).count()
     total_appointments = db.query(models.Appointment).filter(models.Appointment.status == "pending").count()
+    # Completed appointments may have moved to the archive, so totals read both tiers
+    history = archive.appointment_history()
     
     # Revenue today
     today = datetime.now().date()
-    revenue_today = db.query(func.sum(models.Appointment.total_amount)).filter(
-        models.Appointment.date == today,
-        models.Appointment.status == "completed"
+    revenue_today = db.query(func.sum(history.c.total_amount)).filter(
+        history.c.date == today,
+        history.c.status == "completed"
     ).scalar() or 0
     
     # Total revenue (all completed appointments)
-    total_revenue = db.query(func.sum(models.Appointment.total_amount)).filter(
-        models.Appointment.status == "completed"
+    total_revenue = db.query(func.sum(history.c.total_amount)).filter(
+        history.c.status == "completed"
     ).scalar() or 0
     
     # Popular services (top 5)
+    service_lines = archive.appointment_service_history()
     popular_services = db.query(
         models.Service.name,
-        func.count(models.appointment_services.c.service_id).label("count")
-    ).join(models.appointment_services).group_by(models.Service.id).order_by(func.count(models.appointment_services.c.service_id).desc()).limit(5).all()
+        func.count(service_lines.c.service_id).label("count")
+    ).join(service_lines, service_lines.c.service_id == models.Service.id).group_by(models.Service.id).order_by(func.count(service_lines.c.service_id).desc()).limit(5).all()
     
     return {
         "total_customers": total_customers,
@@ -43,7 +46,7 @@ def get_summary(db: Session = Depends(database.get_db), current_user: models.Use
     }
 
 @router.get("/revenue")
-def get_revenue_report(period: str = "monthly", db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_revenue_report(period: str = "monthly", db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         from fastapi import HTTPException
         raise HTTPException(status_code=403, detail="Not enough permissions")
@@ -55,60 +58,66 @@ def get_revenue_report(period: str = "monthly", db: Session = Depends(database.g
         
     start_date = datetime.now().date() - timedelta(days=days)
     
+    history = archive.appointment_history()
     revenue_data = db.query(
-        models.Appointment.date,
-        func.sum(models.Appointment.total_amount).label("revenue")
+        history.c.date,
+        func.sum(history.c.total_amount).label("revenue")
     ).filter(
-        models.Appointment.date >= start_date,
-        models.Appointment.status == "completed"
-    ).group_by(models.Appointment.date).order_by(models.Appointment.date).all()
+        history.c.date >= start_date,
+        history.c.status == "completed"
+    ).group_by(history.c.date).order_by(history.c.date).all()
     
     return [{"date": str(r.date), "revenue": r.revenue} for r in revenue_data]
 
 @router.get("/reports")
-def get_detailed_reports(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_detailed_reports(refresh: bool = False, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
         from fastapi import HTTPException
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    # 1. Daily Revenue (Last 30 Days)
-    thirty_days_ago = datetime.now().date() - timedelta(days=30)
-    daily_revenue = db.query(
-        models.Appointment.date,
-        func.sum(models.Appointment.total_amount).label("revenue")
-    ).filter(
-        models.Appointment.status == "completed",
-        models.Appointment.date >= thirty_days_ago
-    ).group_by(models.Appointment.date).order_by(models.Appointment.date).all()
-
-    # 2. Monthly Revenue (PostgreSQL compatible)
-    monthly_revenue = db.query(
-        func.to_char(models.Appointment.date, "YYYY-MM").label("month"),
-        func.sum(models.Appointment.total_amount).label("revenue")
-    ).filter(
-        models.Appointment.status == "completed"
-    ).group_by(func.to_char(models.Appointment.date, "YYYY-MM")).order_by("month").all()
+    return reports.get_reports(db, force_refresh=refresh)
 
-    # 3. Most Popular Services
-    popular_services = db.query(
-        models.Service.name,
-        models.Service.category,
-        func.count(models.appointment_services.c.service_id).label("total_bookings"),
-        func.sum(models.Service.price).label("total_revenue")
-    ).join(models.appointment_services).group_by(models.Service.id).order_by(func.count(models.appointment_services.c.service_id).desc()).all()
 
-    # 4. Frequent Customers
-    frequent_customers = db.query(
-        models.Customer.name,
-        models.Customer.phone,
-        func.count(models.Appointment.id).label("visit_count"),
-        func.sum(models.Appointment.total_amount).label("total_spent")
-    ).join(models.Appointment).filter(
-        models.Appointment.status == "completed"
-    ).group_by(models.Customer.id).order_by(func.count(models.Appointment.id).desc()).limit(10).all()
+@router.get("/analytics/revenue")
+def get_revenue_analytics(start_date: Optional[date] = None, end_date: Optional[date] = None, granularity: str = "day", breakdown: Optional[str] = None, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    end_date = end_date or datetime.now().date()
+    start_date = start_date or end_date - timedelta(days=30)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
+    try:
+        return analytics.revenue_series(db, start_date, end_date, granularity, breakdown)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/staff")
+def get_staff_performance(start_date: Optional[date] = None, end_date: Optional[date] = None, staff_id: Optional[int] = None, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    end_date = end_date or datetime.now().date()
+    start_date = start_date or end_date.replace(day=1)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
     return {
-        "daily_revenue": [{"date": str(r.date), "revenue": r.revenue} for r in daily_revenue],
-        "monthly_revenue": [{"month": r.month, "revenue": r.revenue} for r in monthly_revenue],
-        "popular_services": [{"name": r.name, "category": r.category, "bookings": r.total_bookings, "revenue": r.total_revenue} for r in popular_services],
-        "frequent_customers": [{"name": r.name, "phone": r.phone, "visits": r.visit_count, "spent": r.total_spent} for r in frequent_customers]
+        "start": str(start_date),
+        "end": str(end_date),
+        "staff": staff_reports.staff_performance(db, start_date, end_date, staff_id)
     }
+
+@router.get("/engines")
+def get_engine_metrics(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return database.engine_metrics()
+
+@router.get("/admission")
+def get_admission_metrics(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return admission.metrics()
+
+@router.get("/reminders")
+def get_reminder_metrics(current_user: models.User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    return reminders.metrics()
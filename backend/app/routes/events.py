@@ -0,0 +1,47 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from datetime import date
+from .. import database, events, tenancy
+from .auth import user_from_token
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+def _authorize(token: str, requested_branch: Optional[int]):
+    db = database.SessionLocal()
+    try:
+        user = user_from_token(token, db)
+        return tenancy.scope_session(db, user, requested_branch)
+    finally:
+        db.close()
+
+@router.get("/stream")
+async def stream_events(
+    topics: Optional[str] = None,
+    date: Optional[date] = None,
+    token: Optional[str] = Query(None),
+    authorization: Optional[str] = Header(None),
+    x_branch_id: Optional[int] = Header(None),
+    branch_id: Optional[int] = None,
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID")
+):
+    # EventSource cannot send headers, so the token may also come as ?token=
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    # Authenticate with a short-lived session; the stream itself holds no connection.
+    # The lookup blocks, so it runs off the event loop.
+    branch = await run_in_threadpool(_authorize, token, x_branch_id or branch_id)
+
+    subscriber = events.Subscriber(
+        topics={t.strip() for t in topics.split(",") if t.strip()} if topics else None,
+        event_date=date,
+        branch_id=branch
+    )
+    return StreamingResponse(
+        events.stream(subscriber, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from .. import models, schemas, database, jobs, tenancy
+from .auth import get_admin_user
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+@router.post("/", response_model=schemas.JobResponse)
+def create_job(job: schemas.JobCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_admin_user)):
+    # Maintenance jobs run across every branch
+    if tenancy.current_branch(db) is not None:
+        raise HTTPException(status_code=403, detail="Jobs can only be started by chain-wide admins")
+    if not jobs.is_known_kind(job.kind):
+        raise HTTPException(status_code=400, detail="Unknown job kind")
+    db_job = jobs.create_job(db, job.kind, job.params, created_by=current_user.id)
+    jobs.enqueue(db_job.id)
+    return db_job
+
+@router.get("/", response_model=List[schemas.JobResponse])
+def get_jobs(status: Optional[str] = None, skip: int = 0, limit: int = 50, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_admin_user)):
+    query = db.query(models.Job)
+    if status:
+        query = query.filter(models.Job.status == status)
+    return query.order_by(models.Job.id.desc()).offset(skip).limit(limit).all()
+
+@router.get("/{job_id}", response_model=schemas.JobResponse)
+def get_job(job_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_admin_user)):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/{job_id}/cancel", response_model=schemas.JobResponse)
+def cancel_job(job_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_admin_user)):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status not in ("queued", "running"):
+        raise HTTPException(status_code=400, detail="Job is not active")
+    # Running jobs stop at their next chunk checkpoint
+    job.cancel_requested = True
+    db.commit()
+    db.refresh(job)
+    return job
+
+@router.post("/{job_id}/retry", response_model=schemas.JobResponse)
+def retry_job(job_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_admin_user)):
+    job = db.query(models.Job).filter(models.Job.id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status not in ("failed", "cancelled"):
+        raise HTTPException(status_code=400, detail="Only failed or cancelled jobs can be retried")
+    job.status = "queued"
+    job.cancel_requested = False
+    job.finished_at = None
+    db.commit()
+    db.refresh(job)
+    jobs.enqueue(job.id)
+    return job
@@ -0,0 +1,124 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import date
+from .. import models, schemas, database, recurrence, waitlist, events
+from .auth import get_current_user
+from .appointments import _after_write, _price_services, _refresh_derived
+
+router = APIRouter(prefix="/series", tags=["series"])
+
+def _check_rule(frequency: str, interval: int, count: Optional[int], until: Optional[date], start_date: date):
+    if frequency not in recurrence.FREQUENCIES:
+        raise HTTPException(status_code=400, detail="frequency must be daily, weekly or monthly")
+    if interval < 1 or (count is not None and count < 1):
+        raise HTTPException(status_code=400, detail="interval and count must be at least 1")
+    if until is not None and until < start_date:
+        raise HTTPException(status_code=400, detail="until must not be before the start date")
+
+def _get_series(db: Session, series_id: int) -> models.AppointmentSeries:
+    series = db.query(models.AppointmentSeries).filter(models.AppointmentSeries.id == series_id).first()
+    if series is None:
+        raise HTTPException(status_code=404, detail="Series not found")
+    return series
+
+@router.post("/", response_model=schemas.SeriesExpansionResponse)
+def create_series(series: schemas.SeriesCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    _check_rule(series.frequency, series.interval, series.count, series.until, series.start_date)
+    customer = db.query(models.Customer).filter(models.Customer.id == series.customer_id).first()
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    priced = _price_services(db, series.service_ids)
+
+    db_series = models.AppointmentSeries(
+        **series.dict(exclude={"service_ids", "skip_conflicts", "total_amount"}),
+        total_amount=priced.total_price if series.total_amount == 0 else series.total_amount,
+        duration_minutes=priced.total_duration,
+        status="active"
+    )
+    db.add(db_series)
+    db.flush()
+    recurrence.set_services(db, db_series.id, [s.id for s in priced.services])
+    events.record(db, "series", "created", db_series.id, events.series_payload(db_series), db_series.start_date)
+    # Occurrences within the horizon are booked now, the rest by the expand_series job as the horizon rolls
+    expansion = recurrence.expand(db, db_series, skip_conflicts=series.skip_conflicts)
+    if expansion.conflicts and not series.skip_conflicts:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Staff member is already booked on " + ", ".join(str(d) for d in expansion.conflicts))
+
+    ids, dates = [a.id for a in expansion.appointments], [a.date for a in expansion.appointments]
+    _refresh_derived(db, dates, [series.customer_id])
+    db.commit()
+    _after_write(db, dates)
+    db.refresh(db_series)
+    return {"series": db_series, "appointment_ids": ids, "conflicts": expansion.conflicts}
+
+@router.get("/", response_model=List[schemas.SeriesResponse])
+def get_series_list(status: Optional[str] = None, customer_id: Optional[int] = None, skip: int = 0, limit: int = 100, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    query = db.query(models.AppointmentSeries)
+    if status:
+        query = query.filter(models.AppointmentSeries.status == status)
+    if customer_id:
+        query = query.filter(models.AppointmentSeries.customer_id == customer_id)
+    return query.order_by(models.AppointmentSeries.id).offset(skip).limit(limit).all()
+
+@router.get("/{series_id}", response_model=schemas.SeriesResponse)
+def get_series(series_id: int, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    return _get_series(db, series_id)
+
+@router.put("/{series_id}", response_model=schemas.SeriesExpansionResponse)
+def update_following(series_id: int, update: schemas.SeriesUpdate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    # "This and following": earlier occurrences keep the old details, the
+    # occurrence on from_date and later ones move to a new series with the changes
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    db_series = _get_series(db, series_id)
+    if db_series.status == "cancelled":
+        raise HTTPException(status_code=409, detail="Series is cancelled")
+
+    changes = update.dict(exclude_unset=True, exclude={"from_date", "service_ids", "new_time"})
+    if update.new_time is not None:
+        changes["time"] = update.new_time
+    service_ids = None
+    if update.service_ids is not None:
+        priced = _price_services(db, update.service_ids)
+        service_ids = [s.id for s in priced.services]
+        changes["duration_minutes"] = priced.total_duration
+        if not changes.get("total_amount"):
+            changes["total_amount"] = priced.total_price
+    _check_rule(
+        changes.get("frequency", db_series.frequency), changes.get("interval", db_series.interval),
+        changes.get("count"), changes.get("until", db_series.until), changes.get("start_date", update.from_date)
+    )
+
+    successor, removed = recurrence.split(db, db_series, update.from_date, changes, service_ids)
+    if successor is None:
+        raise HTTPException(status_code=400, detail="The series has no occurrences on or after from_date")
+    events.record(db, "series", "updated", db_series.id, events.series_payload(db_series), update.from_date)
+    events.record(db, "series", "created", successor.id, events.series_payload(successor), successor.start_date)
+    expansion = recurrence.expand(db, successor)
+
+    ids = [a.id for a in expansion.appointments]
+    dates = [a.date for a in removed] + [a.date for a in expansion.appointments]
+    _refresh_derived(db, dates, [db_series.customer_id])
+    db.commit()
+    _after_write(db, dates)
+    db.refresh(successor)
+    return {"series": successor, "appointment_ids": ids, "conflicts": expansion.conflicts, "removed": len(removed)}
+
+@router.post("/{series_id}/cancel")
+def cancel_following(series_id: int, from_date: Optional[date] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    # Cancels the occurrence on from_date (default today) and every later one
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    db_series = _get_series(db, series_id)
+    from_date = from_date or date.today()
+    cancelled = recurrence.cancel_following(db, db_series, from_date)
+    # The freed slots go to the waitlist
+    waitlist.release(db, [(a, a.date, a.time, a.staff_id, a.duration_minutes) for a in cancelled])
+    events.record(db, "series", "cancelled", db_series.id, events.series_payload(db_series), from_date)
+    dates = [a.date for a in cancelled]
+    _refresh_derived(db, dates, [db_series.customer_id])
+    db.commit()
+    _after_write(db, dates)
+    return {"message": "Series cancelled", "cancelled": len(dates)}
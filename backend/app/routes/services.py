@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
-from .. import models, schemas, database
+from .. import models, schemas, database, reports, analytics, staff_reports, events, catalog
 from .auth import get_current_user
 
 router = APIRouter(prefix="/services", tags=["services"])
@@ -14,17 +14,21 @@ def create_service(service: schemas.ServiceCreate, db: Session = Depends(databas
         
     db_service = models.Service(**service.dict())
     db.add(db_service)
+    db.flush()
+    events.record(db, "service", "created", db_service.id, events.service_payload(db_service))
     db.commit()
+    catalog.reload(db)
     db.refresh(db_service)
+    events.notify()
     return db_service
 
 @router.get("/", response_model=List[schemas.ServiceResponse])
-def get_services(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_services(db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
     services = db.query(models.Service).all()
     return services
 
 @router.get("/{service_id}", response_model=schemas.ServiceResponse)
-def get_service(service_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+def get_service(service_id: int, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
     service = db.query(models.Service).filter(models.Service.id == service_id).first()
     if service is None:
         raise HTTPException(status_code=404, detail="Service not found")
@@ -41,9 +45,15 @@ def update_service(service_id: int, service_update: schemas.ServiceCreate, db: S
     
     for key, value in service_update.dict().items():
         setattr(db_service, key, value)
+    analytics.update_service_category(db, db_service.id, db_service.category)
+    events.record(db, "service", "updated", db_service.id, events.service_payload(db_service))
     
     db.commit()
+    catalog.reload(db)
     db.refresh(db_service)
+    reports.note_write(db)
+    staff_reports.invalidate()
+    events.notify()
     return db_service
 
 @router.delete("/{service_id}")
@@ -56,5 +66,10 @@ def delete_service(service_id: int, db: Session = Depends(database.get_db), curr
         raise HTTPException(status_code=404, detail="Service not found")
     
     db.delete(db_service)
+    events.record(db, "service", "deleted", service_id)
     db.commit()
+    catalog.reload(db)
+    reports.note_write(db)
+    staff_reports.invalidate()
+    events.notify()
     return {"message": "Service deleted successfully"}
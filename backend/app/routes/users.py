@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
-from .. import models, schemas, database, authutils
+from .. import models, schemas, database, authutils, staff_reports, tenancy
 from .auth import get_current_user, get_admin_user
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -11,6 +11,8 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)
     db_user = db.query(models.User).filter(models.User.email == user.email).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
+    if user.branch_id is not None and db.query(models.Branch).filter(models.Branch.id == user.branch_id).first() is None:
+        raise HTTPException(status_code=404, detail="Branch not found")
     
     hashed_password = authutils.get_password_hash(user.password)
     new_user = models.User(
@@ -19,7 +21,9 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)
         phone=user.phone,
         password=hashed_password,
         role=user.role,
-        status=user.status
+        status=user.status,
+        # Branch admins can only add users to their own branch
+        branch_id=tenancy.current_branch(db) or user.branch_id
     )
     
     if user.service_ids:
@@ -29,6 +33,7 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    staff_reports.invalidate()
     return new_user
 
 @router.get("/", response_model=List[schemas.UserResponse])
@@ -55,6 +60,10 @@ def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Dep
         del update_data["password"]
     
     service_ids = update_data.pop("service_ids", None)
+    if tenancy.current_branch(db) is not None:
+        update_data.pop("branch_id", None)
+    elif update_data.get("branch_id") is not None and db.query(models.Branch).filter(models.Branch.id == update_data["branch_id"]).first() is None:
+        raise HTTPException(status_code=404, detail="Branch not found")
     
     for key, value in update_data.items():
         setattr(db_user, key, value)
@@ -65,6 +74,7 @@ def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Dep
     
     db.commit()
     db.refresh(db_user)
+    staff_reports.invalidate()
     return db_user
 
 @router.delete("/{user_id}")
@@ -78,4 +88,5 @@ def delete_user(user_id: int, db: Session = Depends(database.get_db), current_us
     
     db.delete(db_user)
     db.commit()
+    staff_reports.invalidate()
     return {"message": "User deleted successfully"}
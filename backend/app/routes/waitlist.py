@@ -0,0 +1,118 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import datetime
+from .. import models, schemas, database, catalog, tenancy, waitlist, events, schedule
+from .auth import get_current_user
+from .appointments import create_appointment
+
+router = APIRouter(prefix="/waitlist", tags=["waitlist"])
+
+@router.post("/", response_model=schemas.WaitlistEntryResponse)
+def create_entry(entry: schemas.WaitlistEntryCreate, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    if entry.date_to < entry.date_from or entry.time_to <= entry.time_from:
+        raise HTTPException(status_code=400, detail="Invalid date or time window")
+    customer = db.query(models.Customer).filter(models.Customer.id == entry.customer_id).first()
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    priced = catalog.snapshot(db).price(entry.service_ids, tenancy.current_branch(db))
+    if priced is None:
+        raise HTTPException(status_code=400, detail="One or more services not found")
+
+    db_entry = models.WaitlistEntry(
+        **entry.dict(exclude={"service_ids"}),
+        branch_id=customer.branch_id,
+        duration=priced.total_duration,
+        status="waiting"
+    )
+    db.add(db_entry)
+    db.flush()
+    if priced.services:
+        db.execute(models.waitlist_services.insert(), [{"entry_id": db_entry.id, "service_id": s.id} for s in priced.services])
+    db.commit()
+    db.refresh(db_entry)
+    return db_entry
+
+@router.get("/", response_model=List[schemas.WaitlistEntryResponse])
+def get_entries(status: Optional[str] = "waiting", customer_id: Optional[int] = None, skip: int = 0, limit: int = 100, db: Session = Depends(database.get_read_db), current_user: models.User = Depends(get_current_user)):
+    query = db.query(models.WaitlistEntry)
+    if status:
+        query = query.filter(models.WaitlistEntry.status == status)
+    if customer_id:
+        query = query.filter(models.WaitlistEntry.customer_id == customer_id)
+    return query.order_by(models.WaitlistEntry.created_at, models.WaitlistEntry.id).offset(skip).limit(limit).all()
+
+@router.delete("/{entry_id}")
+def cancel_entry(entry_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    db_entry = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.id == entry_id).first()
+    if db_entry is None:
+        raise HTTPException(status_code=404, detail="Waitlist entry not found")
+    db_entry.status = "cancelled"
+    db.query(models.WaitlistOffer).filter(
+        models.WaitlistOffer.entry_id == entry_id,
+        models.WaitlistOffer.status == "pending"
+    ).update({"status": "withdrawn"}, synchronize_session=False)
+    db.commit()
+    return {"message": "Waitlist entry cancelled"}
+
+@router.get("/offers", response_model=List[schemas.WaitlistOfferResponse])
+def get_offers(status: Optional[str] = "pending", customer_id: Optional[int] = None, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    if waitlist.expire_offers(db):
+        db.commit()
+    query = db.query(models.WaitlistOffer)
+    if status:
+        query = query.filter(models.WaitlistOffer.status == status)
+    if customer_id:
+        query = query.filter(models.WaitlistOffer.customer_id == customer_id)
+    return query.order_by(models.WaitlistOffer.date, models.WaitlistOffer.time, models.WaitlistOffer.id).limit(500).all()
+
+def _open_offer(db: Session, offer_id: int) -> models.WaitlistOffer:
+    offer = db.query(models.WaitlistOffer).filter(models.WaitlistOffer.id == offer_id).first()
+    if offer is None:
+        raise HTTPException(status_code=404, detail="Offer not found")
+    if offer.status == "pending" and offer.expires_at < datetime.now():
+        offer.status = "expired"
+        db.commit()
+    if offer.status != "pending":
+        raise HTTPException(status_code=409, detail=f"Offer is {offer.status}")
+    return offer
+
+@router.post("/offers/{offer_id}/accept", response_model=schemas.AppointmentResponse)
+def accept_offer(offer_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    offer = _open_offer(db, offer_id)
+    # Any booking overlapping the offered time, not just one starting at the same minute
+    taken = schedule.conflicts(db, offer.staff_id, offer.date, offer.time, offer.duration)
+    if taken:
+        raise HTTPException(status_code=409, detail="Slot is no longer available")
+    if not waitlist.claim(db, offer):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Slot was taken by another offer")
+
+    entry = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.id == offer.entry_id).first()
+    events.record(db, "waitlist", "accepted", offer.id, {**events.waitlist_offer_payload(offer), "status": "accepted"}, offer.date)
+    # Books through the regular create path (pricing, reminders, events, rollups); the claim commits with it
+    appointment = create_appointment(schemas.AppointmentCreate(
+        customer_id=offer.customer_id,
+        staff_id=offer.staff_id,
+        date=offer.date,
+        time=offer.time,
+        status="pending",
+        total_amount=0,
+        service_ids=[s.id for s in entry.services]
+    ), None, db, current_user)
+    db.query(models.WaitlistOffer).filter(models.WaitlistOffer.id == offer_id).update(
+        {"appointment_id": appointment.id}, synchronize_session=False
+    )
+    db.commit()
+    return appointment
+
+@router.post("/offers/{offer_id}/decline")
+def decline_offer(offer_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
+    offer = _open_offer(db, offer_id)
+    offer.status = "declined"
+    db.flush()
+    events.record(db, "waitlist", "declined", offer.id, events.waitlist_offer_payload(offer), offer.date)
+    offered = waitlist.reoffer(db, offer)
+    db.commit()
+    events.notify()
+    return {"message": "Offer declined", "offered": offered}
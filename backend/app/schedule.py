@@ -0,0 +1,86 @@
+from sqlalchemy import bindparam, func
+from sqlalchemy.orm import Session
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+
+from . import models
+from .database import Base, add_missing_columns
+
+# Appointments carry their own length: duration_minutes (summed over the
+# services when they were booked) and ends_at are written with every create,
+# update, reschedule and service change, so calendar, overlap and utilization
+# queries read one row instead of joining appointment_services to services.
+# Rows from before the columns existed are filled in by the
+# backfill_appointment_durations job. Overlap lookups scan
+# ix_appointments_staff_date_ends; an appointment may run past midnight, so
+# the scan starts a day early.
+
+
+def ends_at(day: Optional[date], at: Optional[time], minutes: Optional[int]) -> Optional[datetime]:
+    if day is None or at is None or minutes is None:
+        return None
+    return datetime.combine(day, at) + timedelta(minutes=minutes)
+
+
+def busy(db: Session, staff_ids: Optional[Iterable[int]], start: datetime, end: datetime, exclude_ids=()):
+    # Appointments overlapping [start, end), cancelled ones excluded; staff_ids=None means every staff member
+    query = db.query(
+        models.Appointment.id, models.Appointment.staff_id, models.Appointment.date,
+        models.Appointment.time, models.Appointment.ends_at
+    )
+    if staff_ids is not None:
+        query = query.filter(models.Appointment.staff_id.in_(list(staff_ids)))
+    rows = query.filter(
+        models.Appointment.staff_id != None,
+        models.Appointment.date >= start.date() - timedelta(days=1),
+        models.Appointment.date <= end.date(),
+        models.Appointment.ends_at > start,
+        models.Appointment.status != "cancelled"
+    ).order_by(models.Appointment.staff_id, models.Appointment.ends_at).all()
+    exclude = set(exclude_ids)
+    return [r for r in rows if r.id not in exclude and datetime.combine(r.date, r.time) < end]
+
+
+def conflicts(db: Session, staff_id: Optional[int], day: date, at: time, minutes: int, exclude_ids=()):
+    if staff_id is None:
+        return []
+    start = datetime.combine(day, at)
+    # A zero-length booking still occupies its start minute
+    return busy(db, [staff_id], start, start + timedelta(minutes=max(minutes or 0, 1)), exclude_ids)
+
+
+def ensure_schema(bind):
+    # Existing databases get the columns and index; the backfill_appointment_durations job fills them in
+    added = add_missing_columns(bind, {
+        "appointments": {"duration_minutes": "INTEGER", "ends_at": "TIMESTAMP"},
+        "appointments_archive": {"duration_minutes": "INTEGER", "ends_at": "TIMESTAMP"},
+    })
+    with bind.begin() as conn:
+        for index in Base.metadata.tables["appointments"].indexes:
+            if index.name == "ix_appointments_staff_date_ends":
+                index.create(conn, checkfirst=True)
+    return added
+
+
+def backfill_chunk(db: Session, model, after_id: int, limit: int):
+    # Fills duration_minutes and ends_at for the next rows of appointments or
+    # archived appointments that lack them, from their service lines; the caller commits
+    lines = models.appointment_services if model is models.Appointment else models.appointment_services_archive
+    ids = [r[0] for r in db.query(model.id).filter(
+        model.id > after_id, model.duration_minutes == None
+    ).order_by(model.id).limit(limit)]
+    if not ids:
+        return ids
+    rows = db.query(
+        model.id, model.date, model.time, func.coalesce(func.sum(models.Service.duration), 0)
+    ).outerjoin(lines, lines.c.appointment_id == model.id).outerjoin(
+        models.Service, models.Service.id == lines.c.service_id
+    ).filter(model.id.in_(ids)).group_by(model.id, model.date, model.time).all()
+    table = model.__table__
+    db.execute(
+        table.update().where(table.c.id == bindparam("_id")).values(
+            duration_minutes=bindparam("minutes"), ends_at=bindparam("ends")
+        ),
+        [{"_id": i, "minutes": int(m), "ends": ends_at(d, t, int(m))} for i, d, t, m in rows]
+    )
+    return ids
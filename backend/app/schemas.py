@@ -1,7 +1,23 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional, Dict, Any
 from datetime import date, time, datetime
 
+# Branch schemas
+class BranchBase(BaseModel):
+    name: str
+    address: Optional[str] = None
+    phone: Optional[str] = None
+    status: str = "active"
+
+class BranchCreate(BranchBase):
+    pass
+
+class BranchResponse(BranchBase):
+    id: int
+    created_at: datetime
+    class Config:
+        from_attributes = True
+
 # User schemas
 class UserBase(BaseModel):
     name: str
@@ -9,6 +25,7 @@ class UserBase(BaseModel):
     phone: Optional[str] = None
     role: str
     status: str = "active"
+    branch_id: Optional[int] = None
 
 class UserCreate(UserBase):
     password: str
@@ -22,6 +39,7 @@ class UserUpdate(BaseModel):
     status: Optional[str] = None
     password: Optional[str] = None
     service_ids: Optional[List[int]] = None
+    branch_id: Optional[int] = None
 
 
 # Service schemas
@@ -36,6 +54,7 @@ class ServiceCreate(ServiceBase):
 
 class ServiceResponse(ServiceBase):
     id: int
+    branch_id: Optional[int] = None
     class Config:
         from_attributes = True
 
@@ -56,12 +75,57 @@ class CustomerBase(BaseModel):
 class CustomerCreate(CustomerBase):
     pass
 
+class CustomerUpdate(CustomerBase):
+    version: Optional[int] = None # expected version; If-Match works too
+
+class CustomerMetricsResponse(BaseModel):
+    visits: int
+    lifetime_spend: float
+    first_visit: Optional[date] = None
+    last_visit: Optional[date] = None
+    recency_score: Optional[int] = None
+    frequency_score: Optional[int] = None
+    monetary_score: Optional[int] = None
+    segment: str
+    churn_risk: Optional[str] = None
+    class Config:
+        from_attributes = True
+
 class CustomerResponse(CustomerBase):
     id: int
+    branch_id: Optional[int] = None
+    version: int = 1
     created_at: datetime
+    metrics: Optional[CustomerMetricsResponse] = None
     class Config:
         from_attributes = True
 
+class CustomerMatch(BaseModel):
+    id: int
+    name: str
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    score: float
+    reasons: str = ""
+
+class CustomerCreateResponse(CustomerResponse):
+    possible_duplicates: List[CustomerMatch] = []
+
+class CustomerMerge(BaseModel):
+    duplicate_ids: List[int]
+
+class CustomerDuplicateResponse(BaseModel):
+    id: int
+    branch_id: Optional[int] = None
+    customer_id: int
+    duplicate_id: int
+    score: float
+    reasons: Optional[str] = None
+    status: str
+    created_at: Optional[datetime] = None
+    customer: Optional[CustomerMatch] = None
+    duplicate: Optional[CustomerMatch] = None
+
 # Appointment schemas
 class AppointmentBase(BaseModel):
     customer_id: Optional[int] = None
@@ -75,13 +139,113 @@ class AppointmentBase(BaseModel):
 class AppointmentCreate(AppointmentBase):
     service_ids: List[int]
 
+class AppointmentUpdate(AppointmentCreate):
+    version: Optional[int] = None # expected version; If-Match works too
+
 class AppointmentResponse(AppointmentBase):
     id: int
+    branch_id: Optional[int] = None
+    duration_minutes: Optional[int] = None
+    ends_at: Optional[datetime] = None
+    series_id: Optional[int] = None
+    occurrence: Optional[int] = None
+    version: int = 1
     services: List[ServiceResponse]
     staff: Optional[UserResponse] = None
     class Config:
         from_attributes = True
 
+class BusyInterval(BaseModel):
+    id: int
+    staff_id: int
+    starts_at: datetime
+    ends_at: Optional[datetime] = None
+
+class AppointmentStatusChange(BaseModel):
+    id: int
+    status: str
+    payment_status: Optional[str] = None
+    # Sent as "date", like the single status route; renamed here so it does not shadow the type
+    new_date: Optional[date] = Field(None, alias="date")
+    version: Optional[int] = None
+
+class AppointmentStatusBatch(BaseModel):
+    items: List[AppointmentStatusChange]
+
+class AppointmentStatusResult(BaseModel):
+    id: int
+    result: str # updated, not_found, duplicate, conflict
+    status: Optional[str] = None
+    payment_status: Optional[str] = None
+    total_amount: Optional[float] = None
+    version: Optional[int] = None
+
+class AppointmentStatusBatchResponse(BaseModel):
+    updated: int
+    results: List[AppointmentStatusResult]
+
+# Waitlist schemas
+class WaitlistEntryBase(BaseModel):
+    customer_id: int
+    staff_id: Optional[int] = None
+    date_from: date
+    date_to: date
+    time_from: time
+    time_to: time
+    notes: Optional[str] = None
+
+class WaitlistEntryCreate(WaitlistEntryBase):
+    service_ids: List[int]
+
+class WaitlistEntryResponse(WaitlistEntryBase):
+    id: int
+    branch_id: Optional[int] = None
+    duration: int = 0
+    status: str
+    created_at: datetime
+    services: List[ServiceResponse]
+    class Config:
+        from_attributes = True
+
+class WaitlistOfferResponse(BaseModel):
+    id: int
+    branch_id: Optional[int] = None
+    entry_id: int
+    customer_id: int
+    source_appointment_id: Optional[int] = None
+    staff_id: Optional[int] = None
+    date: date
+    time: time
+    duration: int = 0
+    status: str
+    appointment_id: Optional[int] = None
+    expires_at: datetime
+    created_at: datetime
+    class Config:
+        from_attributes = True
+
+# Job schemas
+class JobCreate(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    params: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    progress: int = 0
+    total: Optional[int] = None
+    attempts: int = 0
+    cancel_requested: bool = False
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 # Token schemas
 class Token(BaseModel):
     access_token: str
@@ -89,3 +253,51 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Optional[str] = None
+
+# Recurring series schemas
+class SeriesBase(BaseModel):
+    customer_id: int
+    staff_id: Optional[int] = None
+    frequency: str = "weekly" # daily, weekly, monthly
+    interval: int = 1
+    start_date: date
+    time: time
+    count: Optional[int] = None
+    until: Optional[date] = None
+    total_amount: float = 0
+
+class SeriesCreate(SeriesBase):
+    service_ids: List[int]
+    skip_conflicts: bool = True # False rejects the series if any occurrence in the horizon clashes
+
+class SeriesUpdate(BaseModel):
+    # Applies to the occurrence on from_date and every later one
+    from_date: date
+    staff_id: Optional[int] = None
+    frequency: Optional[str] = None
+    interval: Optional[int] = None
+    start_date: Optional[date] = None # new date of the first changed occurrence
+    # Sent as "time"; renamed here so it does not shadow the type
+    new_time: Optional[time] = Field(None, alias="time")
+    count: Optional[int] = None # occurrences from from_date on
+    until: Optional[date] = None
+    total_amount: Optional[float] = None
+    service_ids: Optional[List[int]] = None
+
+class SeriesResponse(SeriesBase):
+    id: int
+    branch_id: Optional[int] = None
+    duration_minutes: int = 0
+    status: str
+    expanded_until: Optional[date] = None
+    parent_id: Optional[int] = None
+    created_at: datetime
+    services: List[ServiceResponse]
+    class Config:
+        from_attributes = True
+
+class SeriesExpansionResponse(BaseModel):
+    series: SeriesResponse
+    appointment_ids: List[int] = []
+    conflicts: List[date] = []
+    removed: int = 0
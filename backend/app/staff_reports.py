@@ -0,0 +1,133 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, case, or_, select
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Iterable, Optional
+import os
+import threading
+import time
+
+from . import models, archive
+
+# Per-staff utilization and performance over a date range. All numbers come
+# from one grouped statement (users LEFT JOIN per-staff aggregates), and the
+# result is cached per branch and period; writes only evict periods containing the
+# dates they touched.
+STAFF_DAY_MINUTES = int(os.getenv("STAFF_DAY_MINUTES", "540"))
+STAFF_WORKING_DAYS = {int(d) for d in os.getenv("STAFF_WORKING_DAYS", "0,1,2,3,4,5").split(",") if d.strip()}
+STAFF_REPORT_CACHE_SECONDS = int(os.getenv("STAFF_REPORT_CACHE_SECONDS", "300"))
+STAFF_REPORT_CACHE_SIZE = 128
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def available_minutes(start: date, end: date) -> int:
+    days = (end - start).days + 1
+    full_weeks, remainder = divmod(days, 7)
+    working = full_weeks * len(STAFF_WORKING_DAYS)
+    working += sum(1 for i in range(remainder) if (start + timedelta(days=full_weeks * 7 + i)).weekday() in STAFF_WORKING_DAYS)
+    return working * STAFF_DAY_MINUTES
+
+
+def _compute(db: Session, start: date, end: date):
+    history = archive.appointment_history()
+    # Booked minutes are stored on each appointment; only rows the backfill
+    # has not reached yet fall back to summing their services
+    lines = archive.appointment_service_history()
+    service_minutes = select(func.coalesce(func.sum(models.Service.duration), 0)).select_from(
+        lines.join(models.Service, models.Service.id == lines.c.service_id)
+    ).where(lines.c.appointment_id == history.c.id).scalar_subquery()
+    per_appointment = db.query(
+        history.c.id,
+        history.c.staff_id,
+        history.c.status,
+        history.c.total_amount,
+        func.coalesce(history.c.duration_minutes, service_minutes).label("minutes")
+    ).filter(
+        history.c.date >= start,
+        history.c.date <= end,
+        history.c.staff_id != None
+    ).subquery()
+
+    completed = per_appointment.c.status == "completed"
+    cancelled = per_appointment.c.status == "cancelled"
+    per_staff = db.query(
+        per_appointment.c.staff_id.label("staff_id"),
+        func.count(per_appointment.c.id).label("appointments"),
+        func.sum(case((completed, 1), else_=0)).label("completed"),
+        func.sum(case((cancelled, 1), else_=0)).label("cancelled"),
+        func.sum(case((completed, per_appointment.c.total_amount), else_=0)).label("revenue"),
+        func.sum(case((cancelled, 0), else_=per_appointment.c.minutes)).label("booked_minutes")
+    ).group_by(per_appointment.c.staff_id).subquery()
+
+    rows = db.query(
+        models.User.id,
+        models.User.name,
+        per_staff.c.appointments,
+        per_staff.c.completed,
+        per_staff.c.cancelled,
+        per_staff.c.revenue,
+        per_staff.c.booked_minutes
+    ).outerjoin(per_staff, per_staff.c.staff_id == models.User.id).filter(
+        or_(models.User.role == "staff", per_staff.c.staff_id != None)
+    ).order_by(models.User.name).all()
+
+    available = available_minutes(start, end)
+    result = OrderedDict()
+    for r in rows:
+        total = r.appointments or 0
+        done = r.completed or 0
+        revenue = r.revenue or 0
+        booked = r.booked_minutes or 0
+        result[r.id] = {
+            "staff_id": r.id,
+            "name": r.name,
+            "appointments": total,
+            "completed": done,
+            "cancelled": r.cancelled or 0,
+            "completion_rate": round(done / total, 4) if total else 0,
+            "cancellation_rate": round((r.cancelled or 0) / total, 4) if total else 0,
+            "revenue": revenue,
+            "average_ticket": round(revenue / done, 2) if done else 0,
+            "booked_minutes": booked,
+            "available_minutes": available,
+            "utilization": round(booked / available, 4) if available else 0
+        }
+    return result
+
+
+def staff_performance(db: Session, start: date, end: date, staff_id: Optional[int] = None):
+    key = (db.info.get("branch_id"), start, end)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and now - cached[0] < STAFF_REPORT_CACHE_SECONDS:
+            _cache.move_to_end(key)
+            result = cached[1]
+        else:
+            result = None
+    if result is None:
+        result = _compute(db, start, end)
+        with _cache_lock:
+            _cache[key] = (now, result)
+            _cache.move_to_end(key)
+            while len(_cache) > STAFF_REPORT_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    if staff_id is not None:
+        return [result[staff_id]] if staff_id in result else []
+    return list(result.values())
+
+
+def invalidate(dates: Optional[Iterable[Optional[date]]] = None):
+    # Without dates (staff or catalog changes) every cached period is dropped
+    with _cache_lock:
+        if dates is None:
+            _cache.clear()
+            return
+        dates = [d for d in dates if d]
+        for key in list(_cache):
+            _, start, end = key
+            if any(start <= d <= end for d in dates):
+                del _cache[key]
@@ -0,0 +1,111 @@
+from fastapi import HTTPException
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session, with_loader_criteria
+from typing import Optional
+
+from . import models
+from .database import Base, RoutingSession, SessionLocal, add_missing_columns
+
+# Multi-branch support. A session whose info["branch_id"] is set (see
+# scope_session) only sees its branch: every ORM SELECT, UPDATE and DELETE on
+# a branch-owned model gets a branch_id filter, and new rows are stamped with
+# the branch on flush. Sessions without a branch (background jobs, chain-wide
+# admins) see every branch. All branches share the one database.
+BRANCH_SCOPED = (
+    models.User,
+    models.Customer,
+    models.Service,
+    models.Appointment,
+    models.ArchivedAppointment,
+    models.RevenueRollup,
+    models.WaitlistEntry,
+    models.WaitlistOffer,
+    models.AppointmentSeries,
+    models.CustomerDuplicate,
+)
+BRANCH_TABLES = ("users", "customers", "services", "appointments", "appointments_archive", "revenue_rollups", "outbox_events")
+
+_default_branch_id: Optional[int] = None
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _filter_by_branch(state):
+    branch_id = state.session.info.get("branch_id")
+    if branch_id is None or state.is_relationship_load or state.is_column_load:
+        return
+    if state.execution_options.get("all_branches"):
+        return
+    if not (state.is_select or state.is_update or state.is_delete):
+        return
+    state.statement = state.statement.options(*[
+        with_loader_criteria(cls, lambda c: c.branch_id == branch_id, include_aliases=True, propagate_to_loaders=False)
+        for cls in BRANCH_SCOPED
+    ])
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _stamp_branch(session, flush_context, instances):
+    branch_id = session.info.get("branch_id")
+    for obj in session.new:
+        if not isinstance(obj, BRANCH_SCOPED) or obj.branch_id is not None:
+            continue
+        if branch_id is not None:
+            obj.branch_id = branch_id
+        elif not isinstance(obj, models.User):
+            # Users created outside a branch are chain-wide
+            obj.branch_id = default_branch_id(session)
+
+
+def default_branch_id(db: Session) -> int:
+    global _default_branch_id
+    if _default_branch_id is None:
+        branch_id = db.query(models.Branch.id).order_by(models.Branch.id).limit(1).scalar()
+        if branch_id is None:
+            # A statement rather than db.flush(), which is not allowed while the session is flushing
+            branch_id = db.execute(insert(models.Branch).values(name="Main").returning(models.Branch.id)).scalar_one()
+        _default_branch_id = branch_id
+    return _default_branch_id
+
+
+def scope_session(db: Session, user: models.User, requested_branch_id: Optional[int] = None):
+    # Branch users are pinned to their branch; chain-wide users may pick one with X-Branch-Id
+    branch_id = user.branch_id
+    if branch_id is None and requested_branch_id is not None:
+        if db.query(models.Branch.id).filter(models.Branch.id == requested_branch_id).first() is None:
+            raise HTTPException(status_code=404, detail="Branch not found")
+        branch_id = requested_branch_id
+    elif branch_id is not None and requested_branch_id not in (None, branch_id):
+        raise HTTPException(status_code=403, detail="Not enough permissions for this branch")
+    db.info["branch_id"] = branch_id
+    return branch_id
+
+
+def current_branch(db: Session) -> Optional[int]:
+    return db.info.get("branch_id")
+
+
+def ensure_schema(bind):
+    # create_all() does not alter existing tables: add branch_id where it is missing,
+    # create the branch indexes, make sure the default branch exists and put
+    # existing rows in it
+    added = add_missing_columns(bind, {table: {"branch_id": "INTEGER"} for table in BRANCH_TABLES})
+    with bind.begin() as conn:
+        for table in BRANCH_TABLES:
+            for index in Base.metadata.tables[table].indexes:
+                if "branch_id" in index.columns.keys():
+                    index.create(conn, checkfirst=True)
+
+    db = SessionLocal()
+    try:
+        branch_id = default_branch_id(db)
+        for model in BRANCH_SCOPED:
+            if model.__tablename__ not in added:
+                continue
+            query = db.query(model).filter(model.branch_id == None)
+            if model is models.User:
+                # Existing admins stay chain-wide
+                query = query.filter(models.User.role != "admin")
+            query.update({"branch_id": branch_id}, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,189 @@
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, NamedTuple, Optional, Tuple
+import heapq
+import os
+
+from . import models, events
+
+# Waitlist backfill. When an appointment is cancelled or moved, release()
+# turns the slot it held into offers for waiting customers, inside the same
+# transaction as the status change. Candidates come from one query over
+# ix_waitlist_branch_status_dates (branch, waiting, date in range, time
+# window, staff, duration), and the best WAITLIST_OFFERS_PER_SLOT are picked
+# with a heap, ordered by request time or, with WAITLIST_PRIORITY=loyalty,
+# by visits and lifetime spend from customer_metrics. The first offer
+# accepted for a slot books it and the others are marked taken.
+WAITLIST_PRIORITY = os.getenv("WAITLIST_PRIORITY", "request_time") # request_time, loyalty
+WAITLIST_OFFERS_PER_SLOT = int(os.getenv("WAITLIST_OFFERS_PER_SLOT", "3"))
+WAITLIST_OFFER_MINUTES = int(os.getenv("WAITLIST_OFFER_MINUTES", "60"))
+
+
+class Slot(NamedTuple):
+    appointment_id: int
+    branch_id: Optional[int]
+    customer_id: Optional[int]
+    staff_id: Optional[int]
+    date: date
+    time: time
+    duration: int # minutes, 0 when the appointment had no services
+
+
+def _priority(row):
+    created = row.created_at or datetime.min
+    if WAITLIST_PRIORITY == "loyalty":
+        return (-(row.visits or 0), -(row.lifetime_spend or 0), created, row.id)
+    return (created, row.id)
+
+
+def _fits(row, slot: Slot) -> bool:
+    starts_at = datetime.combine(slot.date, slot.time)
+    return starts_at + timedelta(minutes=row.duration or 0) <= datetime.combine(slot.date, row.time_to)
+
+
+def candidates(db: Session, slot: Slot, limit: int, exclude_entry_ids=()):
+    # Plain column rows rather than entities: thousands may match before the heap picks a few
+    query = db.query(
+        models.WaitlistEntry.id, models.WaitlistEntry.customer_id, models.WaitlistEntry.created_at,
+        models.WaitlistEntry.duration, models.WaitlistEntry.time_to,
+        models.CustomerMetrics.visits, models.CustomerMetrics.lifetime_spend
+    ).outerjoin(
+        models.CustomerMetrics, models.CustomerMetrics.customer_id == models.WaitlistEntry.customer_id
+    ).filter(
+        models.WaitlistEntry.branch_id == slot.branch_id,
+        models.WaitlistEntry.status == "waiting",
+        models.WaitlistEntry.date_from <= slot.date,
+        models.WaitlistEntry.date_to >= slot.date,
+        models.WaitlistEntry.time_from <= slot.time,
+        models.WaitlistEntry.time_to > slot.time,
+        or_(models.WaitlistEntry.staff_id.is_(None), models.WaitlistEntry.staff_id == slot.staff_id)
+    )
+    if slot.duration:
+        query = query.filter(models.WaitlistEntry.duration <= slot.duration)
+    if slot.customer_id is not None:
+        query = query.filter(models.WaitlistEntry.customer_id != slot.customer_id)
+    exclude = set(exclude_entry_ids)
+    rows = [r for r in query.all() if r.id not in exclude and _fits(r, slot)]
+    return heapq.nsmallest(limit, rows, key=_priority)
+
+
+def _offer(db: Session, slot: Slot, entries, now: datetime):
+    offers = [models.WaitlistOffer(
+        branch_id=slot.branch_id,
+        entry_id=entry.id,
+        customer_id=entry.customer_id,
+        source_appointment_id=slot.appointment_id,
+        staff_id=slot.staff_id,
+        date=slot.date,
+        time=slot.time,
+        duration=slot.duration,
+        status="pending",
+        expires_at=now + timedelta(minutes=WAITLIST_OFFER_MINUTES)
+    ) for entry in entries]
+    if not offers:
+        return offers
+    db.add_all(offers)
+    db.flush()
+    for offer in offers:
+        events.record(db, "waitlist", "offered", offer.id, events.waitlist_offer_payload(offer), offer.date)
+    return offers
+
+
+def _service_minutes(db: Session, appointment_ids):
+    # Only for appointments booked before duration_minutes existed and not backfilled yet
+    return dict(db.query(
+        models.appointment_services.c.appointment_id,
+        func.sum(models.Service.duration)
+    ).join(models.Service, models.Service.id == models.appointment_services.c.service_id).filter(
+        models.appointment_services.c.appointment_id.in_(appointment_ids)
+    ).group_by(models.appointment_services.c.appointment_id).all())
+
+
+def release(db: Session, freed: Iterable[Tuple[models.Appointment, date, time, Optional[int], Optional[int]]]) -> int:
+    # freed: (appointment, date, time, staff_id, duration_minutes) of the slot each
+    # appointment gave up, as stored before the write. Call before commit.
+    now = datetime.now()
+    freed = [f for f in freed if f[1] and f[2] and datetime.combine(f[1], f[2]) > now]
+    if not freed:
+        return 0
+    ids = [a.id for a, _, _, _, _ in freed]
+    unknown = [a.id for a, _, _, _, minutes in freed if minutes is None]
+    durations = _service_minutes(db, unknown) if unknown else {}
+    # Slots that already have offers (a repeated cancel) are not offered again
+    offered = set(db.query(
+        models.WaitlistOffer.source_appointment_id, models.WaitlistOffer.date, models.WaitlistOffer.time
+    ).filter(models.WaitlistOffer.source_appointment_id.in_(ids)).all())
+
+    count = 0
+    for appointment, slot_date, slot_time, staff_id, minutes in freed:
+        if (appointment.id, slot_date, slot_time) in offered:
+            continue
+        if minutes is None:
+            minutes = durations.get(appointment.id) or 0
+        slot = Slot(appointment.id, appointment.branch_id, appointment.customer_id, staff_id, slot_date, slot_time, minutes)
+        count += len(_offer(db, slot, candidates(db, slot, WAITLIST_OFFERS_PER_SLOT), now))
+    return count
+
+
+def reoffer(db: Session, offer: models.WaitlistOffer) -> int:
+    # After a decline, the slot goes to the next entry that has not been offered it yet
+    now = datetime.now()
+    if datetime.combine(offer.date, offer.time) <= now:
+        return 0
+    offered = [r[0] for r in db.query(models.WaitlistOffer.entry_id).filter(
+        models.WaitlistOffer.source_appointment_id == offer.source_appointment_id,
+        models.WaitlistOffer.date == offer.date,
+        models.WaitlistOffer.time == offer.time
+    )]
+    pending = db.query(models.WaitlistOffer.id).filter(
+        models.WaitlistOffer.source_appointment_id == offer.source_appointment_id,
+        models.WaitlistOffer.date == offer.date,
+        models.WaitlistOffer.time == offer.time,
+        models.WaitlistOffer.status.in_(["pending", "accepted"])
+    ).count()
+    if pending >= WAITLIST_OFFERS_PER_SLOT:
+        return 0
+    source_customer_id = db.query(models.Appointment.customer_id).filter(models.Appointment.id == offer.source_appointment_id).scalar()
+    slot = Slot(offer.source_appointment_id, offer.branch_id, source_customer_id, offer.staff_id, offer.date, offer.time, offer.duration or 0)
+    return len(_offer(db, slot, candidates(db, slot, WAITLIST_OFFERS_PER_SLOT - pending, offered), now))
+
+
+def claim(db: Session, offer: models.WaitlistOffer) -> bool:
+    # This offer is accepted only while it is still pending and unexpired; the
+    # other offers for the slot are closed only after that succeeded, so a
+    # concurrent accept of another offer finds this one taken and loses.
+    # The slot's offers are locked in id order first (PostgreSQL) so two
+    # accepts queue instead of deadlocking on each other's rows.
+    slot_offers = db.query(models.WaitlistOffer).filter(
+        models.WaitlistOffer.source_appointment_id == offer.source_appointment_id,
+        models.WaitlistOffer.date == offer.date,
+        models.WaitlistOffer.time == offer.time
+    )
+    slot_offers.with_entities(models.WaitlistOffer.id).order_by(models.WaitlistOffer.id).with_for_update().all()
+    accepted = db.execute(
+        update(models.WaitlistOffer).where(
+            models.WaitlistOffer.id == offer.id,
+            models.WaitlistOffer.status == "pending",
+            models.WaitlistOffer.expires_at > datetime.now()
+        ).values(status="accepted").returning(models.WaitlistOffer.id).execution_options(synchronize_session=False)
+    ).first()
+    if accepted is None:
+        return False
+    slot_offers.filter(models.WaitlistOffer.status == "pending").update({"status": "taken"}, synchronize_session=False)
+    # The customer is booked, so their offers for other slots are withdrawn
+    db.query(models.WaitlistOffer).filter(
+        models.WaitlistOffer.entry_id == offer.entry_id,
+        models.WaitlistOffer.status == "pending"
+    ).update({"status": "withdrawn"}, synchronize_session=False)
+    db.query(models.WaitlistEntry).filter(models.WaitlistEntry.id == offer.entry_id).update(
+        {"status": "booked"}, synchronize_session=False
+    )
+    return True
+
+
+def expire_offers(db: Session):
+    return db.query(models.WaitlistOffer).filter(
+        models.WaitlistOffer.status == "pending",
+        models.WaitlistOffer.expires_at < datetime.now()
+    ).update({"status": "expired"}, synchronize_session=False)
@@ -1,28 +1,31 @@
 from app.database import SessionLocal
-from app.models import Appointment, Service
+from app.models import Appointment
+from app import jobs
+from sqlalchemy import func
 from datetime import datetime
 
+# Runs the chunked "audit_revenue" job in this process. The same job can be
+# started from the API with POST /jobs/ {"kind": "audit_revenue"}.
 db = SessionLocal()
-
-completed_apps = db.query(Appointment).filter(Appointment.status == "completed").all()
-
-print(f"Auditing {len(completed_apps)} completed appointments:")
+job = jobs.create_job(db, "audit_revenue")
+print(f"Auditing completed appointments (job {job.id}):")
 print("-" * 50)
 
-for app in completed_apps:
-    service_sum = sum(s.price for s in app.services)
-    print(f"ID: {app.id} | Date: {app.date} | Stored: ₹{app.total_amount} | Calculated: ₹{service_sum}")
-    if app.total_amount != service_sum:
-        print(f"  >>> DISCREPANCY FOUND! Updating stored amount...")
-        app.total_amount = service_sum
-
-db.commit()
+jobs.run_job(job.id)
+db.refresh(job)
+result = job.result or {}
+print(f"Status: {job.status} | Checked: {result.get('checked', 0)} | Corrected: {result.get('corrected', 0)}")
+if job.error:
+    print(f"Error: {job.error}")
 print("-" * 50)
 print("Audit and correction complete.")
 
 # Check Revenue Today logic
 today = datetime.now().date()
-rev_today = sum(app.total_amount for app in completed_apps if app.date == today)
+rev_today = db.query(func.sum(Appointment.total_amount)).filter(
+    Appointment.status == "completed",
+    Appointment.date == today
+).scalar() or 0
 print(f"Calculated Revenue Today ({today}): ₹{rev_today}")
 
 db.close()
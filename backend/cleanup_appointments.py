@@ -1,18 +1,17 @@
 from app.database import SessionLocal
-from app.models import Appointment, Customer
+from app import jobs
 
+# Runs the chunked "relink_orphans" job in this process. The same job can be
+# started from the API with POST /jobs/ {"kind": "relink_orphans"}.
 db = SessionLocal()
-first_cust = db.query(Customer).first()
+job = jobs.create_job(db, "relink_orphans")
+jobs.run_job(job.id)
+db.refresh(job)
 
-if first_cust:
-    orphans = db.query(Appointment).filter(Appointment.customer_id == None).all()
-    print(f"Found {len(orphans)} appointments with missing customer ID.")
-    for o in orphans:
-        o.customer_id = first_cust.id
-        print(f"Linked appointment {o.id} to customer {first_cust.name} (ID: {first_cust.id})")
-    db.commit()
+if job.status == "completed":
+    print(f"Linked {(job.result or {}).get('relinked', 0)} appointments with missing customer ID.")
     print("Database cleanup complete.")
 else:
-    print("No customers found in database to link appointments to.")
+    print(f"Cleanup {job.status}: {job.error}")
 
 db.close()
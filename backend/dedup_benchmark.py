@@ -0,0 +1,101 @@
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+# Benchmark for customer de-duplication: generates DEDUP_BENCH_COUNT customers,
+# DEDUP_BENCH_DUPLICATE_RATE of them re-entered with different phone/email
+# formatting and small name typos, then times key normalization and pair
+# finding and checks how many planted duplicates were found. Runs against a
+# scratch SQLite file unless DATABASE_URL is set; use an empty database.
+#   python dedup_benchmark.py
+os.environ.setdefault("DATABASE_URL", "sqlite:///./dedup_benchmark.db")
+COUNT = int(os.getenv("DEDUP_BENCH_COUNT", "500000"))
+DUPLICATE_RATE = float(os.getenv("DEDUP_BENCH_DUPLICATE_RATE", "0.05"))
+
+from app import database, models, dedup  # noqa: E402
+
+FIRST = ["anita", "rohan", "priya", "amit", "neha", "vikram", "sara", "karan", "meera", "arjun", "divya", "rahul", "pooja", "sanjay", "kavya"]
+LAST = ["shah", "patel", "mehta", "desai", "joshi", "iyer", "rao", "singh", "gupta", "kapoor", "nair", "bose", "reddy", "jain", "das"]
+
+
+def typo(name):
+    i = random.randrange(len(name))
+    return name[:i] + name[i + 1:] if random.random() < 0.5 else name.title()
+
+
+def reformat_phone(digits):
+    return random.choice([f"+91 {digits[:5]} {digits[5:]}", f"0{digits}", f"{digits[:3]}-{digits[3:6]}-{digits[6:]}"])
+
+
+def reformat_email(email):
+    local, domain = email.split("@")
+    return random.choice([email.upper(), f"{local}+walkin@{domain}", f"{local[:3]}.{local[3:]}@{domain}"])
+
+
+def main():
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    branch = db.query(models.Branch.id).order_by(models.Branch.id).limit(1).scalar()
+    if branch is None:
+        db.add(models.Branch(name="Main"))
+        db.flush()
+        branch = db.query(models.Branch.id).order_by(models.Branch.id).limit(1).scalar()
+    if db.query(models.Customer.id).first():
+        print("The benchmark database must be empty")
+        sys.exit(1)
+
+    random.seed(42)
+    rows, planted = [], []
+    originals = int(COUNT / (1 + DUPLICATE_RATE))
+    for i in range(originals):
+        first, last = random.choice(FIRST), random.choice(LAST)
+        rows.append({
+            "branch_id": branch,
+            "name": f"{first.title()} {last.title()}",
+            "phone": str(7000000000 + i * 7 % 2999999999),
+            "email": f"{first}{last}{i}@gmail.com",
+            "dob": date(1970, 1, 1) + timedelta(days=random.randrange(15000)) if random.random() < 0.3 else None,
+            "version": 1
+        })
+    for i in random.sample(range(originals), COUNT - originals):
+        original = rows[i]
+        rows.append({
+            **original,
+            "name": typo(original["name"]),
+            "phone": reformat_phone(original["phone"]) if random.random() < 0.8 else None,
+            "email": reformat_email(original["email"]) if random.random() < 0.6 else None
+        })
+        planted.append((i + 1, len(rows)))
+
+    started = time.perf_counter()
+    for i in range(0, len(rows), 10000):
+        db.execute(models.Customer.__table__.insert(), rows[i:i + 10000])
+    db.commit()
+    print(f"inserted {len(rows)} customers ({len(planted)} planted duplicates) in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    cursor = 0
+    while True:
+        ids, _ = dedup.normalize_chunk(db, cursor)
+        if not ids:
+            break
+        db.commit()
+        cursor = ids[-1]
+    print(f"normalized keys in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    pairs = dedup.find_pairs(db)
+    print(f"found {len(pairs)} candidate pairs in {time.perf_counter() - started:.1f}s")
+
+    found = {(a, b) for a, b, _, _, _ in pairs}
+    planted = set(planted)
+    recall = len(found & planted) / len(planted) if planted else 1
+    precision = len(found & planted) / len(found) if found else 1
+    print(f"recall {recall:.3f}, precision {precision:.3f}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
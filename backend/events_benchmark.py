@@ -0,0 +1,83 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+
+# Fan-out benchmark for the change feed: opens EVENT_BENCH_SUBSCRIBERS
+# concurrent /events/stream connections against one server process, creates
+# EVENT_BENCH_EVENTS customers through the API and measures how long each
+# event takes to reach every subscriber (from the POST being sent to the
+# event arriving). Run against a live single-worker server, e.g.
+#   uvicorn app.main:app --port 8000 --workers 1
+#   python events_benchmark.py http://127.0.0.1:8000 admin@example.com password
+# The customers it creates are deleted afterwards.
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else os.getenv("BASE_URL", "http://127.0.0.1:8000")
+EMAIL = sys.argv[2] if len(sys.argv) > 2 else os.getenv("LOAD_TEST_EMAIL", "admin@example.com")
+PASSWORD = sys.argv[3] if len(sys.argv) > 3 else os.getenv("LOAD_TEST_PASSWORD", "admin123")
+SUBSCRIBERS = int(os.getenv("EVENT_BENCH_SUBSCRIBERS", "1000"))
+EVENTS = int(os.getenv("EVENT_BENCH_EVENTS", "50"))
+EVENT_INTERVAL = float(os.getenv("EVENT_BENCH_INTERVAL", "0.2"))
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def subscribe(client, token, connected, received):
+    async with client.stream("GET", "/events/stream", params={"topics": "customer", "token": token}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith(": connected"):
+                connected.release()
+            elif line.startswith("data: "):
+                event = json.loads(line[6:])
+                received.setdefault(event["entity_id"], []).append(time.perf_counter())
+
+
+async def main():
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=30) as api:
+        token = (await api.post("/auth/login", data={"username": EMAIL, "password": PASSWORD})).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    limits = httpx.Limits(max_connections=SUBSCRIBERS + 10, max_keepalive_connections=SUBSCRIBERS + 10)
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=httpx.Timeout(30, read=None), limits=limits) as client:
+        connected = asyncio.Semaphore(0)
+        received = {}
+        started = time.perf_counter()
+        streams = [asyncio.create_task(subscribe(client, token, connected, received)) for _ in range(SUBSCRIBERS)]
+        for _ in range(SUBSCRIBERS):
+            await asyncio.wait_for(connected.acquire(), timeout=120)
+        print(f"{SUBSCRIBERS} subscribers connected in {time.perf_counter() - started:.1f}s")
+
+        sent_at = {}
+        for i in range(EVENTS):
+            before = time.perf_counter()
+            response = await client.post("/customers/", json={"name": f"Event benchmark {i}", "phone": f"7{i:09d}"}, headers=headers)
+            response.raise_for_status()
+            sent_at[response.json()["id"]] = before
+            await asyncio.sleep(EVENT_INTERVAL)
+        deadline = time.perf_counter() + 30
+        while time.perf_counter() < deadline and sum(len(received.get(i, [])) for i in sent_at) < SUBSCRIBERS * EVENTS:
+            await asyncio.sleep(0.5)
+
+        for stream in streams:
+            stream.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+        for customer_id in sent_at:
+            await client.delete(f"/customers/{customer_id}", headers=headers)
+
+    lags = [(t - sent_at[i]) * 1000 for i in sent_at for t in received.get(i, [])]
+    delivered = len(lags)
+    print(f"delivered {delivered}/{SUBSCRIBERS * EVENTS} events, lag p50 {percentile(lags, 50):.0f} ms, p99 {percentile(lags, 99):.0f} ms, max {max(lags, default=0):.0f} ms")
+    ok = delivered == SUBSCRIBERS * EVENTS and percentile(lags, 99) < 1000
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import os
+import sys
+import threading
+import time
+from datetime import date
+
+import httpx
+
+# Load test for admission control: measures booking-path latency alone, then
+# again while report endpoints are saturated, and prints the shed counts.
+# Run against a live server, e.g.
+#   uvicorn app.main:app --port 8000
+#   python load_test_admission.py http://127.0.0.1:8000 admin@example.com password
+BASE_URL = sys.argv[1] if len(sys.argv) > 1 else os.getenv("BASE_URL", "http://127.0.0.1:8000")
+EMAIL = sys.argv[2] if len(sys.argv) > 2 else os.getenv("LOAD_TEST_EMAIL", "admin@example.com")
+PASSWORD = sys.argv[3] if len(sys.argv) > 3 else os.getenv("LOAD_TEST_PASSWORD", "admin123")
+PHASE_SECONDS = int(os.getenv("LOAD_TEST_SECONDS", "15"))
+BOOKING_THREADS = int(os.getenv("LOAD_TEST_BOOKING_THREADS", "8"))
+REPORT_THREADS = int(os.getenv("LOAD_TEST_REPORT_THREADS", "60"))
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def worker(client, method, url, stop, latencies, statuses, **kwargs):
+    while not stop.is_set():
+        started = time.perf_counter()
+        retry_after = 0
+        try:
+            response = client.request(method, url, **kwargs)
+            status = response.status_code
+            if status == 503:
+                retry_after = float(response.headers.get("Retry-After", 1))
+        except httpx.HTTPError:
+            status = "error"
+        latencies.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+        # Well-behaved clients back off as told
+        stop.wait(retry_after)
+
+
+def run_phase(headers, with_reports):
+    stop = threading.Event()
+    booking_latencies, booking_statuses = [], {}
+    report_latencies, report_statuses = [], {}
+    threads = []
+    today = str(date.today())
+    for _ in range(BOOKING_THREADS):
+        client = httpx.Client(base_url=BASE_URL, headers=headers, timeout=30)
+        threads.append(threading.Thread(target=worker, args=(client, "GET", "/appointments/", stop, booking_latencies, booking_statuses), kwargs={"params": {"start_date": today, "end_date": today}}))
+    if with_reports:
+        for _ in range(REPORT_THREADS):
+            client = httpx.Client(base_url=BASE_URL, headers=headers, timeout=30)
+            threads.append(threading.Thread(target=worker, args=(client, "GET", "/dashboard/reports", stop, report_latencies, report_statuses), kwargs={"params": {"refresh": "true"}}))
+    for t in threads:
+        t.start()
+    time.sleep(PHASE_SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+    return booking_latencies, booking_statuses, report_latencies, report_statuses
+
+
+def main():
+    token = httpx.post(f"{BASE_URL}/auth/login", data={"username": EMAIL, "password": PASSWORD}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for label, with_reports in (("baseline", False), ("reports saturated", True)):
+        booking, booking_statuses, report, report_statuses = run_phase(headers, with_reports)
+        print(f"{label}:")
+        print(f"  bookings: {len(booking)} requests, p50 {percentile(booking, 50) * 1000:.1f} ms, p99 {percentile(booking, 99) * 1000:.1f} ms, statuses {booking_statuses}")
+        if with_reports:
+            print(f"  reports:  {len(report)} requests, p50 {percentile(report, 50) * 1000:.1f} ms, statuses {report_statuses}")
+
+    print("admission:", httpx.get(f"{BASE_URL}/dashboard/admission", headers=headers).json())
+
+
+if __name__ == "__main__":
+    main()
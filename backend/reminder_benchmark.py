@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta, time as dtime
+
+# Delivery benchmark for the reminder scheduler: inserts REMINDER_BENCH_COUNT
+# reminders due over the next REMINDER_BENCH_SPREAD seconds, runs the
+# scheduler in this process with a counting sender and reports how late each
+# one went out. The horizon is kept short so the run also exercises the
+# incremental window loads. Uses DATABASE_URL like the app; rows it creates
+# are removed afterwards.
+#   python reminder_benchmark.py
+os.environ.setdefault("REMINDER_HORIZON_SECONDS", "30")
+COUNT = int(os.getenv("REMINDER_BENCH_COUNT", "100000"))
+SPREAD = int(os.getenv("REMINDER_BENCH_SPREAD", "120"))
+LEAD = 5
+
+from app import database, models, notifications, reminders  # noqa: E402
+
+
+class CountingSender(notifications.Sender):
+    def __init__(self):
+        self.count = 0
+
+    def send(self, message):
+        self.count += 1
+
+    def send_many(self, messages):
+        self.count += len(messages)
+        return [None] * len(messages)
+
+
+def main():
+    database.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    customer = models.Customer(name="Reminder benchmark", phone="0000000000")
+    db.add(customer)
+    db.flush()
+    appointment = models.Appointment(customer_id=customer.id, date=date.today(), time=dtime(23, 59), status="pending", total_amount=0)
+    db.add(appointment)
+    db.flush()
+
+    first = datetime.now() + timedelta(seconds=LEAD)
+    started = time.perf_counter()
+    rows = [{
+        "appointment_id": appointment.id,
+        "kind": "reminder",
+        "status": "scheduled",
+        "attempts": 0,
+        "due_at": first + timedelta(seconds=SPREAD * i / COUNT)
+    } for i in range(COUNT)]
+    db.execute(models.Reminder.__table__.insert(), rows)
+    db.commit()
+    print(f"inserted {COUNT} reminders in {time.perf_counter() - started:.1f}s, due over {SPREAD}s")
+
+    sender = CountingSender()
+    reminders.set_sender(sender)
+    reminders.start()
+    try:
+        deadline = time.time() + LEAD + SPREAD + 60
+        while sender.count < COUNT and time.time() < deadline:
+            time.sleep(1)
+    finally:
+        reminders.stop()
+    lag = sorted((sent_at - due_at).total_seconds() * 1000 for due_at, sent_at in db.query(models.Reminder.due_at, models.Reminder.sent_at).filter(
+        models.Reminder.appointment_id == appointment.id, models.Reminder.status == "sent"
+    ))
+    p50, p99 = (lag[min(len(lag) - 1, int(len(lag) * p / 100))] if lag else None for p in (50, 99))
+    print(f"sent {sender.count}/{COUNT}, lag p50 {p50:.1f} ms, p99 {p99:.1f} ms, max {lag[-1]:.1f} ms" if lag else f"sent {sender.count}/{COUNT}")
+
+    db.query(models.Reminder).filter(models.Reminder.appointment_id == appointment.id).delete(synchronize_session=False)
+    db.delete(appointment)
+    db.delete(customer)
+    db.commit()
+    db.close()
+    ok = sender.count == COUNT and p99 is not None and p99 < 1000
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import itertools
+import os
+import tempfile
+
+# The whole API runs against a private in-memory SQLite database. Every test
+# process gets its own ("sqlite://" lives in the process), so parallel
+# workers (pytest -n with pytest-xdist) never see each other's rows. The
+# environment is set before app is imported because the engines are built
+# at import time; a DATABASE_URL in app/.env does not override it.
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["REPLICA_DATABASE_URLS"] = ""
+os.environ["NOTIFICATION_FILE"] = os.path.join(tempfile.gettempdir(), f"salon-test-notifications-{os.getpid()}.log")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app as application
+from app import authutils, database, models
+
+ADMIN_EMAIL = "admin@test.local"
+PASSWORD = "password"
+_phones = itertools.count(9000000001)
+
+
+@pytest.fixture(scope="session")
+def app():
+    # Startup (job resume, reminder and event threads) runs once per worker
+    with TestClient(application):
+        yield application
+
+
+@pytest.fixture(scope="session")
+def admin_token(app):
+    db = database.SessionLocal()
+    try:
+        db.add(models.User(name="Admin", email=ADMIN_EMAIL, password=authutils.get_password_hash(PASSWORD), role="admin"))
+        db.commit()
+    finally:
+        db.close()
+    client = TestClient(app)
+    return client.post("/auth/login", data={"username": ADMIN_EMAIL, "password": PASSWORD}).json()["access_token"]
+
+
+@pytest.fixture
+def client(app, admin_token):
+    # Logged in as a chain-wide admin; tests create the rows they need
+    client = TestClient(app)
+    client.headers["Authorization"] = f"Bearer {admin_token}"
+    return client
+
+
+@pytest.fixture
+def db(app):
+    # The in-memory database has a single connection: end the session's
+    # transaction (db.rollback()) before calling the API again
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def service(client):
+    return client.post("/services/", json={"name": "Haircut", "category": "Hair", "price": 300, "duration": 30}).json()
+
+
+@pytest.fixture
+def customer(client):
+    # Distinct phone numbers so customers are not flagged as duplicates of each other
+    return client.post("/customers/", json={"name": "Test Customer", "phone": str(next(_phones))}).json()["id"]
@@ -0,0 +1,33 @@
+from datetime import date
+
+from app import analytics, jobs, models
+from test_smoke import _book
+
+
+def _run(db, kind, **params):
+    job = models.Job(kind=kind, params=params, result={}, status="queued")
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+    jobs.run_job(job_id)
+    return db.query(models.Job).filter(models.Job.id == job_id).one()
+
+
+def test_rollup_rebuild_covers_archived_months(client, db, customer, service, monkeypatch):
+    day = date(2019, 2, 11)
+    appointment_id = _book(client, customer, service, day)["id"]
+    assert client.put(f"/appointments/{appointment_id}/status", params={"status": "completed"}).status_code == 200
+    assert _run(db, "archive_appointments", months=12).status == "completed"
+    assert db.query(models.Appointment.id).filter(models.Appointment.id == appointment_id).first() is None
+
+    db.query(models.RevenueRollup).delete(synchronize_session=False)
+    db.commit()
+    scheduled = []
+    monkeypatch.setattr(jobs, "schedule_once", lambda db, kind, params=None: scheduled.append(kind))
+    analytics.ensure_rollups(db)
+    assert "rebuild_revenue_rollups" in scheduled
+    monkeypatch.undo()
+
+    assert _run(db, "rebuild_revenue_rollups").status == "completed"
+    assert db.query(models.RevenueRollup).filter(models.RevenueRollup.day == day).count() == 1
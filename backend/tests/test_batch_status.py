@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+
+from sqlalchemy import event, text
+
+from app import database, models
+from test_smoke import _book
+
+
+def test_close_out_reports_each_item(client, db, customer, service):
+    day = date.today() - timedelta(days=1)
+    done, stale, moved = (_book(client, customer, service, day, time=t) for t in ("09:00", "10:00", "11:00"))
+    # Someone edits one of them after the front desk loaded the day
+    assert client.put(f"/appointments/{stale['id']}/status", params={"status": "confirmed"}).status_code == 200
+    new_day = day + timedelta(days=7)
+
+    response = client.post("/appointments/status:batch", json={"items": [
+        {"id": done["id"], "status": "completed", "version": done["version"]},
+        {"id": stale["id"], "status": "completed", "version": stale["version"]},
+        {"id": moved["id"], "status": "confirmed", "date": str(new_day)},
+        {"id": done["id"], "status": "cancelled"},
+        {"id": 999999, "status": "completed"},
+    ]})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    results = [(r["id"], r["result"]) for r in body["results"]]
+    assert results == [
+        (done["id"], "updated"), (stale["id"], "conflict"), (moved["id"], "updated"),
+        (done["id"], "duplicate"), (999999, "not_found"),
+    ]
+    assert body["updated"] == 2
+    completed = body["results"][0]
+    assert (completed["status"], completed["payment_status"], completed["total_amount"]) == ("completed", "paid", service["price"])
+    assert completed["version"] == done["version"] + 1
+    assert body["results"][1]["version"] == stale["version"] + 1
+
+    rows = {a.id: a for a in db.query(models.Appointment).filter(models.Appointment.id.in_([done["id"], stale["id"], moved["id"]]))}
+    assert rows[done["id"]].status == "completed"
+    assert (rows[stale["id"]].status, rows[stale["id"]].version) == ("confirmed", stale["version"] + 1)
+    assert rows[moved["id"]].date == new_day
+    revenue = db.query(models.RevenueRollup.revenue).filter(models.RevenueRollup.day == day, models.RevenueRollup.service_id == service["id"]).all()
+    assert [r.revenue for r in revenue] == [service["price"]]
+
+
+def test_an_edit_racing_the_close_out_fails_the_whole_batch(client, db, customer, service):
+    day = date.today() - timedelta(days=2)
+    first, second = (_book(client, customer, service, day, time=t) for t in ("09:00", "10:00"))
+
+    edits = [second["id"]]
+
+    def concurrent_edit(session, flush_context, instances):
+        # Lands between the batch loading the rows and flushing them
+        if edits:
+            session.execute(text("UPDATE appointments SET version = version + 1 WHERE id = :id"), {"id": edits.pop()})
+    event.listen(database.RoutingSession, "before_flush", concurrent_edit)
+    try:
+        response = client.post("/appointments/status:batch", json={"items": [
+            {"id": first["id"], "status": "completed"},
+            {"id": second["id"], "status": "completed"},
+        ]})
+    finally:
+        event.remove(database.RoutingSession, "before_flush", concurrent_edit)
+    assert response.status_code == 409
+    statuses = dict(db.query(models.Appointment.id, models.Appointment.status).filter(models.Appointment.id.in_([first["id"], second["id"]])).all())
+    assert statuses == {first["id"]: "pending", second["id"]: "pending"}
+
+
+def test_close_out_is_bounded(client, monkeypatch):
+    from app.routes import appointments
+    monkeypatch.setattr(appointments, "BATCH_STATUS_MAX", 1)
+    response = client.post("/appointments/status:batch", json={"items": [{"id": 1, "status": "completed"}, {"id": 2, "status": "completed"}]})
+    assert response.status_code == 400
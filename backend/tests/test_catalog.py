@@ -0,0 +1,18 @@
+from datetime import date, timedelta
+
+from app import catalog, models
+
+
+def test_state_row_is_seeded_and_bumped_by_service_changes(client, db, customer, service):
+    before = db.query(models.CatalogState.version).filter(models.CatalogState.id == catalog.CATALOG_STATE_ID).scalar()
+    db.rollback()
+    assert before is not None
+    response = client.put(f"/services/{service['id']}", json={**service, "price": 450})
+    assert response.status_code == 200, response.text
+    assert db.query(models.CatalogState.version).filter(models.CatalogState.id == catalog.CATALOG_STATE_ID).scalar() == before + 1
+    db.rollback()
+    booked = client.post("/appointments/", json={
+        "customer_id": customer, "date": str(date.today() + timedelta(days=3)), "time": "12:00",
+        "status": "pending", "total_amount": 0, "service_ids": [service["id"]]
+    }).json()
+    assert booked["total_amount"] == 450
@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+from test_smoke import _book
+
+
+def test_same_version_updates_one_wins(client, customer):
+    current = client.get(f"/customers/{customer}")
+    version = current.json()["version"]
+    assert current.headers["ETag"] == f'"{version}"'
+
+    first = client.put(f"/customers/{customer}", json={"name": "First Writer", "phone": current.json()["phone"], "version": version})
+    second = client.put(f"/customers/{customer}", json={"name": "Second Writer", "phone": current.json()["phone"], "version": version})
+    assert sorted([first.status_code, second.status_code]) == [200, 409]
+    assert first.json()["version"] == version + 1
+    assert second.headers["ETag"] == f'"{version + 1}"'
+
+    after = client.get(f"/customers/{customer}").json()
+    assert (after["name"], after["version"]) == ("First Writer", version + 1)
+
+
+def test_reschedule_checks_the_callers_version(client, customer, service):
+    day = date.today() + timedelta(days=12)
+    booked = _book(client, customer, service, day)
+    moved = str(day + timedelta(days=1))
+    assert client.put(f"/appointments/{booked['id']}/status", params={"status": "confirmed", "version": booked["version"]}).status_code == 200
+
+    stale = client.put(f"/appointments/{booked['id']}/status", params={"status": "confirmed", "date": moved}, headers={"If-Match": f'"{booked["version"]}"'})
+    assert stale.status_code == 409
+    assert client.get(f"/appointments/{booked['id']}").json()["date"] == str(day)
+
+    fresh = client.put(f"/appointments/{booked['id']}/status", params={"status": "confirmed", "date": moved}, headers={"If-Match": f'"{booked["version"] + 1}"'})
+    assert fresh.status_code == 200
+    assert fresh.json()["version"] == booked["version"] + 2
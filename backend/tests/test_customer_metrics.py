@@ -0,0 +1,29 @@
+from datetime import date, timedelta
+
+from app import customer_metrics, models
+from test_smoke import _book
+
+
+def _metrics(db, customer):
+    return db.query(models.CustomerMetrics).filter(models.CustomerMetrics.customer_id == customer).all()
+
+
+def test_a_completed_visit_updates_the_row_in_place(client, db, customer, service):
+    appointment = _book(client, customer, service, date.today() - timedelta(days=1))
+    [before] = _metrics(db, customer)
+    assert (before.visits, before.segment) == (0, "prospect")
+    db.rollback()
+
+    assert client.put(f"/appointments/{appointment['id']}/status", params={"status": "completed"}).status_code == 200
+    db.expire_all()
+    [after] = _metrics(db, customer)
+    assert (after.visits, after.lifetime_spend, after.last_visit) == (1, service["price"], date.today() - timedelta(days=1))
+    assert after.segment != "prospect"
+
+
+def test_overlapping_refreshes_do_not_collide(db, customer):
+    # A second writer scoring the same customer before the first commits updates the same row
+    customer_metrics.refresh_customers(db, [customer])
+    customer_metrics.refresh_customers(db, [customer, None])
+    db.commit()
+    assert len(_metrics(db, customer)) == 1
@@ -0,0 +1,59 @@
+from datetime import date, timedelta
+
+from app import jobs, models
+from test_smoke import _book
+
+
+def _customer(client, name, phone, email=None):
+    response = client.post("/customers/", json={"name": name, "phone": phone, "email": email})
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_merge_moves_the_duplicates_history(client, db, service):
+    keep = _customer(client, "Kavya Menon", "9500000001")
+    duplicate = _customer(client, "Kavya  Menon", "+91 95000 00001", "kavya.menon@example.com")
+    visit = _book(client, duplicate, service, date.today() - timedelta(days=3), status="completed")
+    upcoming = _book(client, duplicate, service, date.today() + timedelta(days=3))
+
+    response = client.post(f"/customers/{keep}/merge", json={"duplicate_ids": [duplicate]})
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == "kavya.menon@example.com"
+
+    rows = {a.id: a for a in db.query(models.Appointment).filter(models.Appointment.id.in_([visit["id"], upcoming["id"]]))}
+    assert {a.customer_id for a in rows.values()} == {keep}
+    assert rows[upcoming["id"]].version == upcoming["version"] + 1
+    assert db.query(models.Customer).filter(models.Customer.id == duplicate).count() == 0
+    assert db.query(models.CustomerMetrics).filter(models.CustomerMetrics.customer_id == duplicate).count() == 0
+    assert db.query(models.CustomerMetrics.visits).filter(models.CustomerMetrics.customer_id == keep).scalar() == 1
+    pairs = db.query(models.CustomerDuplicate.status).filter(models.CustomerDuplicate.duplicate_id == duplicate).all()
+    assert [p.status for p in pairs] == ["merged"]
+
+
+def test_merge_rejects_unknown_customers(client, customer):
+    assert client.post(f"/customers/{customer}/merge", json={"duplicate_ids": [customer]}).status_code == 400
+    assert client.post(f"/customers/{customer}/merge", json={"duplicate_ids": [999999]}).status_code == 404
+
+
+def test_auto_merge_follows_chains_of_matches(client, db, service):
+    # first~second share a phone, second~third an email; first and third share neither
+    first = _customer(client, "Ishaan Verma", "9500000011", "ishaan.v@example.com")
+    second = _customer(client, "Ishaan Verma", "9500000011", "ishaan.verma@example.com")
+    third = _customer(client, "Ishaan Verma", "9500000012", "Ishaan.Verma+salon@example.com")
+    bystander = _customer(client, "Zoya Qureshi", "9500000011")
+    booking = _book(client, third, service, date.today() + timedelta(days=5))
+    db.rollback()
+
+    job = models.Job(kind="dedup_customers", params={"merge": True, "merge_score": 0.7}, result={}, status="queued")
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+    jobs.run_job(job_id)
+
+    job = db.query(models.Job).filter(models.Job.id == job_id).one()
+    assert job.status == "completed", job.error
+    assert job.result["merged"] >= 2
+    remaining = {c.id for c in db.query(models.Customer.id).filter(models.Customer.id.in_([first, second, third, bystander]))}
+    assert remaining == {first, bystander}
+    assert db.query(models.Appointment.customer_id).filter(models.Appointment.id == booking["id"]).scalar() == first
@@ -0,0 +1,14 @@
+from app import events
+
+
+def test_late_commit_below_the_cursor_is_still_broadcast(monkeypatch):
+    monkeypatch.setattr(events, "_last_id", 10)
+    monkeypatch.setattr(events, "_gaps", {})
+    # 12 commits before 11: 11 is remembered and sent when it shows up
+    assert events._advance(12)
+    assert events._gaps.keys() == {11}
+    assert events._advance(11)
+    assert not events._gaps
+    assert not events._advance(11)
+    assert not events._advance(12)
+    assert events._last_id == 12
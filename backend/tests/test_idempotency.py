@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from app import idempotency, models
+
+
+def test_racing_retries_create_one_customer(client, db, monkeypatch):
+    # Both requests pass the lookup before either commits, as when they arrive together
+    monkeypatch.setattr(idempotency, "lookup", lambda *args: None)
+    body = {"name": "Racing Retry", "phone": "9400000001"}
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        responses = list(pool.map(lambda _: client.post("/customers/", json=body, headers={"Idempotency-Key": "race-customer"}), range(2)))
+
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[0].json()["id"] == responses[1].json()["id"]
+    assert sorted(r.headers.get("Idempotent-Replayed", "false") for r in responses) == ["false", "true"]
+    assert db.query(models.Customer).filter(models.Customer.phone == body["phone"]).count() == 1
+    assert db.query(models.IdempotencyKey).filter(models.IdempotencyKey.key == "race-customer").count() == 1
+
+
+def test_racing_retries_book_once(client, db, customer, service, monkeypatch):
+    monkeypatch.setattr(idempotency, "lookup", lambda *args: None)
+    body = {
+        "customer_id": customer, "staff_id": None, "date": str(date.today() + timedelta(days=14)), "time": "16:00",
+        "status": "pending", "total_amount": 0, "service_ids": [service["id"]]
+    }
+    first = client.post("/appointments/", json=body, headers={"Idempotency-Key": "race-booking"})
+    second = client.post("/appointments/", json=body, headers={"Idempotency-Key": "race-booking"})
+
+    assert (first.status_code, second.status_code) == (200, 200)
+    assert second.json()["id"] == first.json()["id"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert db.query(models.Appointment).filter(models.Appointment.customer_id == customer).count() == 1
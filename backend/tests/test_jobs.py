@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from app import jobs, models
+
+
+def _job(db, **values):
+    job = models.Job(kind="refresh_reports", params={}, result={}, **values)
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+    return job_id
+
+
+def test_a_job_is_claimed_once(db):
+    job_id = _job(db, status="queued")
+    jobs.run_job(job_id)
+    jobs.run_job(job_id)
+    job = db.query(models.Job).filter(models.Job.id == job_id).one()
+    assert (job.status, job.attempts) == ("completed", 1)
+    assert job.claimed_at is not None
+
+
+def test_resume_takes_back_only_stale_running_jobs(db, monkeypatch):
+    now = datetime.now()
+    live = _job(db, status="running", claimed_at=now, heartbeat_at=now)
+    stale = _job(db, status="running", claimed_at=now - timedelta(hours=2), heartbeat_at=now - timedelta(seconds=jobs.JOB_STALE_SECONDS + 60))
+    queued = _job(db, status="queued")
+    enqueued = []
+    monkeypatch.setattr(jobs, "enqueue", enqueued.append)
+
+    jobs.resume_pending_jobs()
+    assert live not in enqueued
+    assert {stale, queued} <= set(enqueued)
+    statuses = dict(db.query(models.Job.id, models.Job.status).filter(models.Job.id.in_([live, stale])).all())
+    assert statuses == {live: "running", stale: "queued"}
+    db.query(models.Job).filter(models.Job.id.in_([live, stale, queued])).update({"status": "cancelled"}, synchronize_session=False)
+    db.commit()
@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+from app import models, notifications, reminders
+from test_smoke import _book
+
+
+class BrokenSender(notifications.Sender):
+    def send(self, message):
+        raise AssertionError("send_many is overridden")
+
+    def send_many(self, messages):
+        raise ConnectionError("provider unreachable")
+
+
+def test_sender_failure_returns_the_batch_for_retry(client, db, customer, service, monkeypatch):
+    appointment_id = _book(client, customer, service, date.today() + timedelta(days=7))["id"]
+    batch = [(r.due_at, r.id) for r in db.query(models.Reminder).filter(models.Reminder.appointment_id == appointment_id)]
+    assert batch
+    db.close()
+
+    monkeypatch.setattr(reminders, "_sender", BrokenSender())
+    reminders._dispatch(batch)
+
+    rows = db.query(models.Reminder).filter(models.Reminder.id.in_([reminder_id for _, reminder_id in batch])).all()
+    assert {r.status for r in rows} == {"scheduled"}
+    assert {r.attempts for r in rows} == {1}
+    assert all("provider unreachable" in r.error for r in rows)
@@ -0,0 +1,45 @@
+import itertools
+import time
+
+import pytest
+
+from app import database
+
+
+@pytest.fixture
+def replica(app, monkeypatch):
+    # Stands in for a replica that has the users but not the latest writes
+    engine = database.make_engine("sqlite://")
+    database.Base.metadata.create_all(bind=engine)
+    users = database.Base.metadata.tables["users"]
+    with database.engine.connect() as primary, engine.begin() as conn:
+        conn.execute(users.insert(), [dict(r._mapping) for r in primary.execute(users.select())])
+    monkeypatch.setattr(database, "_engine_stats", dict(database._engine_stats))
+    monkeypatch.setattr(database, "_engine_names", {**database._engine_names, id(engine): database._register("replica-0", engine)})
+    monkeypatch.setattr(database, "replica_engines", [engine])
+    monkeypatch.setattr(database, "_replica_cycle", itertools.cycle([0]))
+    yield engine
+    engine.dispose()
+
+
+def _routed(name):
+    return next(m["routed"] for m in database.engine_metrics() if m["name"] == name)
+
+
+def test_reads_after_a_write_stay_on_the_primary(client, replica, monkeypatch):
+    customer = client.post("/customers/", json={"name": "Just Written", "phone": "9300000001"}).json()["id"]
+    # Within REPLICA_MAX_LAG_SECONDS of the write the replica may not have it yet
+    assert client.get(f"/customers/{customer}").status_code == 200
+    assert _routed("replica-0") == 0
+
+    monkeypatch.setattr(database, "_last_write_at", time.monotonic() - database.REPLICA_MAX_LAG_SECONDS - 1)
+    assert client.get(f"/customers/{customer}").status_code == 404
+    assert _routed("replica-0") > 0
+
+
+def test_a_failed_replica_is_skipped(client, replica, monkeypatch):
+    customer = client.post("/customers/", json={"name": "Replica Down", "phone": "9300000002"}).json()["id"]
+    monkeypatch.setattr(database, "_last_write_at", 0.0)
+    database._engine_stats["replica-0"]["down_until"] = time.monotonic() + 60
+    assert client.get(f"/customers/{customer}").status_code == 200
+    assert _routed("replica-0") == 0
@@ -0,0 +1,70 @@
+from datetime import date
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import jobs, models, reports
+from test_smoke import _book
+
+
+def test_failed_refresh_keeps_the_touched_months(db, monkeypatch):
+    monkeypatch.setattr(reports, "REPORT_REFRESH_WRITES", 10 ** 6)
+    touched = date(2020, 3, 14)
+    reports.mark_changed(db, [touched])
+    db.commit()
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("database went away")
+    with monkeypatch.context() as m:
+        m.setattr(reports, "_monthly_revenue", broken)
+        with pytest.raises(RuntimeError):
+            reports.refresh_snapshot(db)
+    db.rollback()
+    assert touched in [c.day for c in db.query(models.ReportChange).all()]
+
+    snapshot = reports.refresh_snapshot(db)
+    assert db.query(models.ReportChange).count() == 0
+    assert reports._writes_since_refresh == 0
+    # A second snapshot with the same version is refused
+    db.add(models.ReportSnapshot(version=snapshot.version, payload={}))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+
+def test_forced_refresh_rebuilds_months_changed_outside_the_api(client, db, customer, service):
+    day = date(2021, 5, 10)
+    booked = _book(client, customer, service, day)
+    appointment_id, price = booked["id"], booked["total_amount"]
+    assert client.put(f"/appointments/{appointment_id}/status", params={"status": "completed"}).status_code == 200
+    client.get("/dashboard/reports", params={"refresh": "true"})
+
+    # A correction written without marking the day, as an old audit run would have done
+    db.query(models.Appointment).filter(models.Appointment.id == appointment_id).update({"total_amount": 555}, synchronize_session=False)
+    db.commit()
+    reports.refresh_snapshot(db)
+    db.close()
+    monthly = {m["month"]: m["revenue"] for m in client.get("/dashboard/reports").json()["monthly_revenue"]}
+    assert monthly["2021-05"] == price
+
+    monthly = {m["month"]: m["revenue"] for m in client.get("/dashboard/reports", params={"refresh": "true"}).json()["monthly_revenue"]}
+    assert monthly["2021-05"] == 555
+
+
+def test_audit_marks_the_days_it_corrects(client, db, customer, service):
+    day = date(2021, 8, 3)
+    appointment_id = _book(client, customer, service, day)["id"]
+    assert client.put(f"/appointments/{appointment_id}/status", params={"status": "completed"}).status_code == 200
+    db.query(models.Appointment).filter(models.Appointment.id == appointment_id).update({"total_amount": 555}, synchronize_session=False)
+    db.commit()
+    reports.refresh_snapshot(db, full=True)
+
+    job = models.Job(kind="audit_revenue", params={}, status="queued")
+    db.add(job)
+    db.commit()
+    job_id = job.id
+    db.close()
+    jobs.run_job(job_id)
+    assert day in [c.day for c in db.query(models.ReportChange).all()]
+    snapshot = reports.refresh_snapshot(db)
+    assert {m["month"]: m["revenue"] for m in snapshot.payload["monthly_revenue"]}["2021-08"] != 555
@@ -0,0 +1,31 @@
+from datetime import date, timedelta
+
+from app import models
+
+
+def _series(client, customer, service, start, count):
+    response = client.post("/series/", json={
+        "customer_id": customer, "frequency": "weekly", "start_date": str(start),
+        "time": "09:00", "count": count, "service_ids": [service["id"]]
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_this_and_following_edit_keeps_cancelled_occurrences_cancelled(client, db, customer, service):
+    start = date.today() + timedelta(days=7)
+    created = _series(client, customer, service, start, 4)
+    assert len(created["appointment_ids"]) == 4
+    # The third occurrence is cancelled on its own, then the time changes from the second on
+    third = db.query(models.Appointment.id).filter(models.Appointment.series_id == created["series"]["id"], models.Appointment.occurrence == 2).scalar()
+    db.rollback()
+    assert client.put(f"/appointments/{third}/status", params={"status": "cancelled"}).status_code == 200
+
+    response = client.put(f"/series/{created['series']['id']}", json={"from_date": str(start + timedelta(days=7)), "time": "11:00"})
+    assert response.status_code == 200, response.text
+    assert response.json()["removed"] == 2
+
+    rows = db.query(models.Appointment.date, models.Appointment.status).filter(models.Appointment.customer_id == customer).order_by(models.Appointment.date, models.Appointment.id).all()
+    cancelled_day = start + timedelta(days=14)
+    assert [(d, s) for d, s in rows if d == cancelled_day] == [(cancelled_day, "cancelled")]
+    assert len(response.json()["appointment_ids"]) == 2
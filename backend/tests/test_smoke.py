@@ -0,0 +1,74 @@
+from datetime import date, timedelta
+
+from app import archive, database
+
+
+def _book(client, customer, service, day, time="10:00", **extra):
+    response = client.post("/appointments/", json={
+        "customer_id": customer, "staff_id": None, "date": str(day), "time": time,
+        "status": "pending", "total_amount": 0, "service_ids": [service["id"]], **extra
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_runs_on_in_memory_sqlite(app):
+    assert database.engine.url.drivername == "sqlite"
+    assert database.engine.url.database in (None, "", ":memory:")
+
+
+def test_booking_is_priced_and_timed(client, customer, service):
+    day = date.today() + timedelta(days=7)
+    appointment = _book(client, customer, service, day)
+    assert appointment["total_amount"] == 300
+    assert appointment["duration_minutes"] == 30
+    assert appointment["ends_at"] == f"{day}T10:30:00"
+
+
+def test_completing_an_appointment_shows_in_revenue(client, customer, service):
+    day = date.today() - timedelta(days=400)
+    appointment = _book(client, customer, service, day)
+    response = client.put(f"/appointments/{appointment['id']}/status", params={"status": "completed"})
+    assert response.status_code == 200
+    revenue = client.get("/dashboard/analytics/revenue", params={"start_date": str(day), "end_date": str(day), "granularity": "day"}).json()
+    assert revenue["points"] == [{"bucket": str(day), "revenue": 300.0, "bookings": 1}]
+
+
+def test_appointment_with_several_services_is_one_booking(client, customer, service):
+    day = date.today() - timedelta(days=401)
+    extra = [client.post("/services/", json={"name": name, "category": "Hair", "price": 100, "duration": 15}).json()["id"] for name in ("Wash", "Dry")]
+    appointment = _book(client, customer, service, day, service_ids=[service["id"], *extra])
+    client.put(f"/appointments/{appointment['id']}/status", params={"status": "completed"})
+    revenue = client.get("/dashboard/analytics/revenue", params={"start_date": str(day), "end_date": str(day), "granularity": "day"}).json()
+    assert revenue["points"] == [{"bucket": str(day), "revenue": 500.0, "bookings": 1}]
+
+
+def test_stale_version_is_rejected(client, customer, service):
+    appointment = _book(client, customer, service, date.today() + timedelta(days=8))
+    first = client.put(f"/appointments/{appointment['id']}/status", params={"status": "pending"}, headers={"If-Match": '"1"'})
+    assert first.status_code == 200
+    second = client.put(f"/appointments/{appointment['id']}/status", params={"status": "cancelled"}, headers={"If-Match": '"1"'})
+    assert second.status_code == 409
+    assert second.headers["ETag"] == '"2"'
+
+
+def test_idempotent_create_returns_the_first_booking(client, customer, service):
+    key = {"Idempotency-Key": "smoke-create-1"}
+    body = {"customer_id": customer, "date": str(date.today() + timedelta(days=9)), "time": "11:00",
+            "status": "pending", "total_amount": 0, "service_ids": [service["id"]]}
+    first = client.post("/appointments/", json=body, headers=key).json()
+    second = client.post("/appointments/", json=body, headers=key).json()
+    assert first["id"] == second["id"]
+
+
+def test_archived_appointments_stay_in_dashboard_totals(client, db, customer, service):
+    day = date.today() - timedelta(days=800)
+    appointment = _book(client, customer, service, day)
+    client.put(f"/appointments/{appointment['id']}/status", params={"status": "completed"})
+    before = client.get("/dashboard/summary").json()
+    archive.archive_chunk(db, day + timedelta(days=1), 0, 1000)
+    db.commit()
+    db.close()
+    after = client.get("/dashboard/summary").json()
+    assert after["total_revenue"] == before["total_revenue"]
+    assert after["popular_services"] == before["popular_services"]
@@ -0,0 +1,24 @@
+from datetime import date, timedelta
+
+from app import models, staff_reports
+
+
+def test_rows_without_stored_duration_fall_back_to_their_services(client, db, customer, service):
+    staff = models.User(name="Stylist", email="stylist@example.com", password="x", role="staff")
+    db.add(staff)
+    db.commit()
+    staff_id = staff.id
+    db.close()
+    day = date.today() - timedelta(days=30)
+    for time, stored in (("10:00", True), ("11:00", False)):
+        booked = client.post("/appointments/", json={
+            "customer_id": customer, "staff_id": staff_id, "date": str(day), "time": time,
+            "status": "pending", "total_amount": 0, "service_ids": [service["id"]]
+        }).json()
+        if not stored:
+            # As if booked before duration_minutes existed
+            db.query(models.Appointment).filter(models.Appointment.id == booked["id"]).update({"duration_minutes": None})
+            db.commit()
+            db.close()
+    row = staff_reports._compute(db, day, day)[staff_id]
+    assert row["booked_minutes"] == 60
@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+from conftest import PASSWORD
+
+
+def _branch_admin(app, client, branch_id, email):
+    user = client.post("/users/", json={"name": "Branch Admin", "email": email, "password": PASSWORD, "role": "admin", "branch_id": branch_id})
+    assert user.status_code == 200, user.text
+    branch_client = TestClient(app)
+    token = branch_client.post("/auth/login", data={"username": email, "password": PASSWORD}).json()["access_token"]
+    branch_client.headers["Authorization"] = f"Bearer {token}"
+    return branch_client
+
+
+def test_branch_user_cannot_reach_another_branch(app, client):
+    branch_a = client.post("/branches/", json={"name": "Branch A"}).json()["id"]
+    branch_b = client.post("/branches/", json={"name": "Branch B"}).json()["id"]
+    as_b = {"X-Branch-Id": str(branch_b)}
+    service = client.post("/services/", json={"name": "Colour", "category": "Hair", "price": 900, "duration": 60}, headers=as_b).json()
+    customer = client.post("/customers/", json={"name": "Branch B Customer", "phone": "9100000001"}, headers=as_b).json()
+    appointment = client.post("/appointments/", json={
+        "customer_id": customer["id"], "staff_id": None, "date": str(date.today() + timedelta(days=3)), "time": "11:00",
+        "status": "pending", "total_amount": 0, "service_ids": [service["id"]]
+    }, headers=as_b).json()
+    assert customer["branch_id"] == appointment["branch_id"] == branch_b
+
+    a_admin = _branch_admin(app, client, branch_a, "branch-a-admin@example.com")
+    assert customer["id"] not in [c["id"] for c in a_admin.get("/customers/").json()]
+    assert appointment["id"] not in [a["id"] for a in a_admin.get("/appointments/").json()]
+    assert a_admin.get(f"/customers/{customer['id']}").status_code == 404
+    assert a_admin.get(f"/appointments/{appointment['id']}").status_code == 404
+
+    renamed = a_admin.put(f"/customers/{customer['id']}", json={"name": "Taken Over", "phone": "9100000001"})
+    assert renamed.status_code == 404
+    moved = a_admin.put(f"/appointments/{appointment['id']}", json={
+        "customer_id": customer["id"], "staff_id": None, "date": appointment["date"], "time": "12:00",
+        "status": "pending", "total_amount": 0, "service_ids": [service["id"]]
+    })
+    assert moved.status_code == 404
+    assert a_admin.put(f"/appointments/{appointment['id']}/status", params={"status": "cancelled"}).status_code == 404
+    # A branch user cannot switch branches with the header either
+    assert a_admin.get(f"/customers/{customer['id']}", headers=as_b).status_code == 403
+
+    assert client.get(f"/customers/{customer['id']}", headers=as_b).json()["name"] == "Branch B Customer"
+    unchanged = client.get(f"/appointments/{appointment['id']}", headers=as_b).json()
+    assert (unchanged["status"], unchanged["time"], unchanged["version"]) == ("pending", appointment["time"], appointment["version"])
@@ -0,0 +1,6 @@
+def test_moving_a_user_to_a_missing_branch_is_rejected(client):
+    user = client.post("/users/", json={"name": "Front Desk", "email": "desk@example.com", "password": "secret", "role": "staff"})
+    assert user.status_code == 200, user.text
+    response = client.put(f"/users/{user.json()['id']}", json={"branch_id": 999999})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "Branch not found"
@@ -0,0 +1,49 @@
+from datetime import date, datetime, timedelta
+
+from app import models, waitlist
+from test_smoke import _book
+
+
+def _wait(client, customer, service, day):
+    response = client.post("/waitlist/", json={
+        "customer_id": customer, "date_from": str(day), "date_to": str(day),
+        "time_from": "09:00", "time_to": "18:00", "service_ids": [service["id"]]
+    })
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def _new_customer(client, phone):
+    return client.post("/customers/", json={"name": "Waiting Customer", "phone": phone}).json()["id"]
+
+
+def test_cancelling_a_cancelled_appointment_offers_nothing(client, db, customer, service):
+    day = date.today() + timedelta(days=9)
+    appointment_id = _book(client, customer, service, day, time="14:00")["id"]
+    assert client.put(f"/appointments/{appointment_id}/status", params={"status": "cancelled"}).status_code == 200
+
+    _wait(client, _new_customer(client, "9200000001"), service, day)
+    assert client.put(f"/appointments/{appointment_id}/status", params={"status": "cancelled"}).status_code == 200
+    assert db.query(models.WaitlistOffer).filter(models.WaitlistOffer.source_appointment_id == appointment_id).count() == 0
+
+
+def test_an_expired_offer_cannot_close_the_slot(client, db, customer, service):
+    day = date.today() + timedelta(days=10)
+    appointment_id = _book(client, customer, service, day, time="15:00")["id"]
+    for phone in ("9200000002", "9200000003"):
+        _wait(client, _new_customer(client, phone), service, day)
+    assert client.put(f"/appointments/{appointment_id}/status", params={"status": "cancelled"}).status_code == 200
+
+    offers = db.query(models.WaitlistOffer).filter(models.WaitlistOffer.source_appointment_id == appointment_id).order_by(models.WaitlistOffer.id).all()
+    assert len(offers) == 2
+    expired, other = offers
+    expired.expires_at = datetime.now() - timedelta(minutes=1)
+    db.commit()
+    assert not waitlist.claim(db, expired)
+    db.rollback()
+    other_id = other.id
+    assert db.query(models.WaitlistOffer.status).filter(models.WaitlistOffer.id == other_id).scalar() == "pending"
+    db.close()
+
+    assert client.post(f"/waitlist/offers/{other_id}/accept").status_code == 200
+    assert db.query(models.WaitlistOffer.status).filter(models.WaitlistOffer.id == other_id).scalar() == "accepted"
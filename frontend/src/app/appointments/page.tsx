@@ -1,7 +1,8 @@
 'use client';
 
-import { useState, useEffect } from 'react';
-import api from '@/lib/api';
+import { useState, useEffect, useRef } from 'react';
+import api, { idempotencyHeaders, IdempotencyKeyRef } from '@/lib/api';
+import { LiveEvent, statusChanges, upsertRow, useLiveEvents } from '@/lib/events';
 import DashboardLayout from '@/components/DashboardLayout';
 import { useAuth } from '@/context/AuthContext';
 import { Plus, Check, X, Clock, Calendar as CalendarIcon, User as UserIcon, Edit2 } from 'lucide-react';
@@ -24,6 +25,7 @@ interface Appointment {
     status: string;
     total_amount: number;
     services: Service[];
+    version?: number;
 }
 
 interface Customer {
@@ -63,6 +65,9 @@ export default function AppointmentsPage() {
         phone: '',
         notes: ''
     });
+    // Kept across resubmits of the booking form, so a retry after a lost response books (and adds the client) once
+    const customerKey = useRef<IdempotencyKeyRef['current']>(null);
+    const appointmentKey = useRef<IdempotencyKeyRef['current']>(null);
 
     const fetchData = async () => {
         try {
@@ -91,6 +96,34 @@ export default function AppointmentsPage() {
         fetchData();
     }, []);
 
+    // Changes made elsewhere arrive on the live feed and are applied to the lists in place
+    const applyEvent = async (event: LiveEvent) => {
+        if (event.topic === 'appointment') {
+            if (event.action === 'deleted') {
+                setAppointments((list) => list.filter((a) => a.id !== event.entity_id));
+            } else if (event.action === 'status') {
+                setAppointments((list) => list.map((a) => (a.id === event.entity_id ? { ...a, ...statusChanges(event.payload) } : a)));
+            } else {
+                // New and edited bookings are read back once for their services and staff
+                const res = await api.get(`/appointments/${event.entity_id}`).catch(() => null);
+                if (res) setAppointments((list) => upsertRow(list, res.data));
+            }
+        } else if (event.topic === 'customer') {
+            if (event.action === 'merged') {
+                // The duplicates' bookings moved to the kept customer
+                fetchData();
+            } else if (event.action === 'deleted') {
+                setCustomers((list) => list.filter((c) => c.id !== event.entity_id));
+            } else {
+                setCustomers((list) => upsertRow(list, { id: event.payload.id, name: event.payload.name }));
+            }
+        } else if (event.topic === 'service') {
+            const res = await api.get('/services/').catch(() => null);
+            if (res) setServices(res.data);
+        }
+    };
+    useLiveEvents(['appointment', 'customer', 'service'], applyEvent, fetchData);
+
     const handleSubmit = async (e: React.FormEvent) => {
         e.preventDefault();
         if (selectedServices.length === 0) return alert('Select at least one service');
@@ -103,7 +136,7 @@ export default function AppointmentsPage() {
                 const sanitizedData: any = { ...newCustomerData };
                 if (!sanitizedData.notes) delete sanitizedData.notes;
 
-                const custRes = await api.post('/customers/', sanitizedData);
+                const custRes = await api.post('/customers/', sanitizedData, { headers: idempotencyHeaders(customerKey, sanitizedData) });
                 customerId = custRes.data.id;
             }
 
@@ -126,10 +159,12 @@ export default function AppointmentsPage() {
             };
 
             if (editingAppointment) {
-                await api.put(`/appointments/${editingAppointment.id}`, data);
+                await api.put(`/appointments/${editingAppointment.id}`, { ...data, version: editingAppointment.version });
             } else {
-                await api.post('/appointments/', data);
+                await api.post('/appointments/', data, { headers: idempotencyHeaders(appointmentKey, data) });
             }
+            customerKey.current = null;
+            appointmentKey.current = null;
             setShowModal(false);
             setEditingAppointment(null);
             setSelectedServices([]);
@@ -158,10 +193,15 @@ export default function AppointmentsPage() {
 
     const handleStatusUpdate = async (id: number, status: string) => {
         try {
-            await api.put(`/appointments/${id}/status?status=${status}`);
+            const version = appointments.find(a => a.id === id)?.version;
+            await api.put(`/appointments/${id}/status?status=${status}`, null, version ? { headers: { 'If-Match': `"${version}"` } } : undefined);
             fetchData();
-        } catch (error) {
+        } catch (error: any) {
             console.error('Failed to update status', error);
+            if (error.response?.status === 409) {
+                alert(error.response.data.detail);
+                fetchData();
+            }
         }
     };
 
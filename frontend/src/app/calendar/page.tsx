@@ -20,6 +20,7 @@ import {
     parseISO
 } from 'date-fns';
 import api from '@/lib/api';
+import { LiveEvent, statusChanges, upsertRow, useLiveEvents } from '@/lib/events';
 import DashboardLayout from '@/components/DashboardLayout';
 import {
     ChevronLeft,
@@ -74,6 +75,37 @@ export default function CalendarPage() {
         fetchData();
     }, []);
 
+    // Bookings changed elsewhere arrive on the live feed and are applied in place
+    const customerName = (id: number) => customers.find((c: any) => c.id === id)?.name || 'Walk-in';
+    const applyEvent = async (event: LiveEvent) => {
+        if (event.topic === 'customer') {
+            if (event.action === 'merged') {
+                // The duplicates' bookings moved to the kept customer
+                fetchData();
+                return;
+            }
+            if (event.action === 'deleted') {
+                setCustomers((list) => list.filter((c: any) => c.id !== event.entity_id));
+                return;
+            }
+            setCustomers((list) => upsertRow(list, { ...list.find((c: any) => c.id === event.entity_id), ...event.payload }));
+            setAppointments((list) => list.map((a) => (a.customer_id === event.entity_id ? { ...a, customer_name: event.payload.name } : a)));
+            return;
+        }
+        if (event.action === 'deleted') {
+            setAppointments((list) => list.filter((a) => a.id !== event.entity_id));
+            setSelectedApp((app) => (app?.id === event.entity_id ? null : app));
+        } else if (event.action === 'status') {
+            const changes = statusChanges(event.payload);
+            setAppointments((list) => list.map((a) => (a.id === event.entity_id ? { ...a, ...changes } : a)));
+            setSelectedApp((app) => (app?.id === event.entity_id ? { ...app, ...changes } : app));
+        } else {
+            const res = await api.get(`/appointments/${event.entity_id}`).catch(() => null);
+            if (res) setAppointments((list) => upsertRow(list, { ...res.data, customer_name: customerName(res.data.customer_id) }));
+        }
+    };
+    useLiveEvents(['appointment', 'customer'], applyEvent, fetchData);
+
     const navigate = (direction: 'next' | 'prev') => {
         if (view === 'month') {
             setCurrentDate(direction === 'next' ? addMonths(currentDate, 1) : subMonths(currentDate, 1));
@@ -1,7 +1,7 @@
 'use client';
 
-import { useState, useEffect } from 'react';
-import api from '@/lib/api';
+import { useState, useEffect, useRef } from 'react';
+import api, { idempotencyHeaders, IdempotencyKeyRef } from '@/lib/api';
 import DashboardLayout from '@/components/DashboardLayout';
 import { Search, Plus, UserPlus, Edit2, Trash2, X, History, Calendar, IndianRupee, Clock, User as UserIcon } from 'lucide-react';
 
@@ -12,6 +12,7 @@ interface Customer {
     name: string;
     phone: string;
     notes?: string;
+    version?: number;
 }
 
 export default function CustomersPage() {
@@ -27,6 +28,8 @@ export default function CustomersPage() {
         phone: '',
         notes: ''
     });
+    // Kept across resubmits of the add form
+    const createKey = useRef<IdempotencyKeyRef['current']>(null);
 
     const fetchCustomers = async () => {
         try {
@@ -45,16 +48,27 @@ export default function CustomersPage() {
         e.preventDefault();
         try {
             if (editingCustomer) {
-                await api.put(`/customers/${editingCustomer.id}`, formData);
+                // Sends the version that was edited so a concurrent change is rejected (409) instead of overwritten
+                await api.put(`/customers/${editingCustomer.id}`, { ...formData, version: editingCustomer.version });
             } else {
-                await api.post('/customers/', formData);
+                const response = await api.post('/customers/', formData, { headers: idempotencyHeaders(createKey, formData) });
+                createKey.current = null;
+                const matches = response.data.possible_duplicates || [];
+                if (matches.length > 0) {
+                    // Saved anyway; the pair is queued for an admin to merge or dismiss
+                    alert(`Possible duplicate of: ${matches.map((m: any) => `${m.name} (${m.phone})`).join(', ')}`);
+                }
             }
             setShowModal(false);
             setEditingCustomer(null);
             setFormData({ name: '', phone: '', notes: '' });
             fetchCustomers();
-        } catch (error) {
+        } catch (error: any) {
             console.error('Failed to save customer', error);
+            if (error.response?.status === 409) {
+                alert(error.response.data.detail);
+                fetchCustomers();
+            }
         }
     };
 
@@ -1,7 +1,8 @@
 'use client';
 
-import { useEffect, useState } from 'react';
+import { useCallback, useEffect, useRef, useState } from 'react';
 import api from '@/lib/api';
+import { LiveEvent, useLiveEvents } from '@/lib/events';
 import DashboardLayout from '@/components/DashboardLayout';
 import { useAuth } from '@/context/AuthContext';
 import { Users, Calendar, IndianRupee, TrendingUp, ShieldCheck } from 'lucide-react';
@@ -17,19 +18,41 @@ interface DashboardSummary {
 export default function DashboardPage() {
     const { user: currentUser } = useAuth();
     const [summary, setSummary] = useState<DashboardSummary | null>(null);
+    const refetchTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
+    const isAdmin = currentUser?.role === 'admin';
+
+    const fetchSummary = useCallback(async () => {
+        if (!isAdmin) return;
+        try {
+            const response = await api.get('/dashboard/summary');
+            setSummary(response.data);
+        } catch (error) {
+            console.error('Failed to fetch summary', error);
+        }
+    }, [isAdmin]);
 
     useEffect(() => {
-        const fetchSummary = async () => {
-            if (currentUser?.role !== 'admin') return;
-            try {
-                const response = await api.get('/dashboard/summary');
-                setSummary(response.data);
-            } catch (error) {
-                console.error('Failed to fetch summary', error);
-            }
-        };
         fetchSummary();
-    }, [currentUser]);
+    }, [fetchSummary]);
+
+    // Counts the feed fully describes are applied in place; anything touching
+    // revenue or pending totals is re-read once a burst of changes settles
+    const applyEvent = (event: LiveEvent) => {
+        if (event.topic === 'customer') {
+            const delta = event.action === 'created' ? 1 : event.action === 'deleted' ? -1 : 0;
+            if (delta) setSummary((s) => s && { ...s, total_customers: s.total_customers + delta });
+            return;
+        }
+        if (event.topic === 'appointment' && event.action === 'created' && event.payload?.status === 'pending') {
+            setSummary((s) => s && { ...s, total_appointments: s.total_appointments + 1 });
+        }
+        if (refetchTimer.current) clearTimeout(refetchTimer.current);
+        refetchTimer.current = setTimeout(fetchSummary, 2000);
+    };
+    useLiveEvents(['appointment', 'customer', 'service'], applyEvent, fetchSummary, isAdmin);
+    useEffect(() => () => {
+        if (refetchTimer.current) clearTimeout(refetchTimer.current);
+    }, []);
 
     if (currentUser?.role !== 'admin') {
         return (
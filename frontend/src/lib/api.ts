@@ -14,4 +14,21 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
+export type IdempotencyKeyRef = { current: { key: string; body: string } | null };
+
+// Headers for a create that may be submitted again after a failed or lost
+// response. Resubmitting the same form reuses the key, so the API returns the
+// original result instead of creating a duplicate; a changed form gets a new
+// key. Clear the ref (ref.current = null) once the create succeeds.
+export const idempotencyHeaders = (ref: IdempotencyKeyRef, data: unknown): Record<string, string> => {
+  if (typeof crypto === "undefined" || !("randomUUID" in crypto)) {
+    return {};
+  }
+  const body = JSON.stringify(data);
+  if (!ref.current || ref.current.body !== body) {
+    ref.current = { key: crypto.randomUUID(), body };
+  }
+  return { "Idempotency-Key": ref.current.key };
+};
+
 export default api;
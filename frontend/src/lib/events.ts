@@ -0,0 +1,101 @@
+import { useEffect, useRef } from 'react';
+
+export interface LiveEvent<P = any> {
+  id: number;
+  branch_id: number | null;
+  topic: string;
+  action: string;
+  entity_id: number;
+  event_date: string | null;
+  payload: P;
+}
+
+const POLL_MS = 30000;
+
+// Subscribes to the API change feed (GET /events/stream) for the given topics
+// and hands every event to onEvent. The browser reconnects by itself and the
+// API replays what was missed from Last-Event-ID, so a dropped connection
+// loses nothing. onReload refetches the page's data; it runs when the
+// stream cannot be opened (then every POLL_MS until it is back), after a
+// fresh connection replaces a closed one, and when the API asks for a resync
+// because the client fell behind.
+export function useLiveEvents(topics: string[], onEvent: (event: LiveEvent) => void, onReload: () => void, enabled = true) {
+  const handlers = useRef({ onEvent, onReload });
+  useEffect(() => {
+    handlers.current = { onEvent, onReload };
+  });
+  const topicList = topics.join(',');
+
+  useEffect(() => {
+    if (!enabled) return;
+    let source: EventSource | null = null;
+    let poll: ReturnType<typeof setInterval> | null = null;
+    let retry: ReturnType<typeof setTimeout> | null = null;
+    let stopped = false;
+
+    const startPolling = () => {
+      if (!poll) poll = setInterval(() => handlers.current.onReload(), POLL_MS);
+    };
+    const stopPolling = () => {
+      if (poll) clearInterval(poll);
+      poll = null;
+    };
+
+    const token = localStorage.getItem('token');
+    if (typeof EventSource === 'undefined' || !token) {
+      startPolling();
+      return stopPolling;
+    }
+    const url = `${process.env.NEXT_PUBLIC_API_URL}/events/stream?topics=${encodeURIComponent(topicList)}&token=${encodeURIComponent(token)}`;
+
+    const connect = (fresh: boolean) => {
+      source = new EventSource(url);
+      source.onopen = () => {
+        stopPolling();
+        // A new connection has no Last-Event-ID, so whatever happened in between is fetched once
+        if (fresh) handlers.current.onReload();
+        fresh = false;
+      };
+      const deliver = (message: MessageEvent) => {
+        try {
+          handlers.current.onEvent(JSON.parse(message.data));
+        } catch (error) {
+          console.error('Bad live event', error);
+        }
+      };
+      topicList.split(',').forEach((topic) => source?.addEventListener(topic, deliver));
+      source.addEventListener('resync', () => reopen());
+      source.onerror = () => {
+        startPolling();
+        // The browser retries by itself unless the server refused the stream
+        if (source?.readyState === EventSource.CLOSED && !stopped) {
+          retry = setTimeout(() => connect(true), POLL_MS);
+        }
+      };
+    };
+    const reopen = () => {
+      source?.close();
+      connect(true);
+    };
+
+    connect(false);
+    return () => {
+      stopped = true;
+      source?.close();
+      stopPolling();
+      if (retry) clearTimeout(retry);
+    };
+  }, [topicList, enabled]);
+}
+
+// Puts a changed row into a list held in state: replaced where it was, or appended
+export const upsertRow = <T extends { id: number }>(list: T[], row: T): T[] =>
+  list.some((r) => r.id === row.id) ? list.map((r) => (r.id === row.id ? row : r)) : [...list, row];
+
+// Appointment status events carry every field a status change can touch
+export const APPOINTMENT_STATUS_FIELDS = ['date', 'time', 'status', 'payment_status', 'total_amount', 'version'] as const;
+
+export const statusChanges = (payload: Record<string, any>) =>
+  Object.fromEntries(
+    APPOINTMENT_STATUS_FIELDS.filter((f) => f in payload).map((f) => [f, payload[f]])
+  ) as Partial<Record<(typeof APPOINTMENT_STATUS_FIELDS)[number], any>>;